@@ -25,6 +25,17 @@ public class TCP : MonoBehaviour
     NetworkStream stream = null;
     Thread thread;
 
+    // Tracking datagrams (Datagrams.py): uint32 sequence, then a JSON or binary tracking message.
+    // Calibration stays on the TCP connection, a pose older than the last applied one is dropped
+    const int DATAGRAM_PORT = 13457;
+    const int DATAGRAM_HEADER_SIZE = 4;
+    UdpClient datagramServer = null;
+    Thread datagramThread;
+    IPAddress clientAddress = null;     // only the connected client may send datagrams
+    private uint lastDatagramSequence = 0;
+    private bool datagramApplied = false;   // no datagram of the current connection applied yet
+    private int staleDatagrams = 0;
+
     const int MISSING_THRESHOLD = 5;
     // anchor position
     string targetName = "AnchorPrefab(Clone)";
@@ -57,6 +68,9 @@ public class TCP : MonoBehaviour
     public class TransformedMessage
     {
         public List<TransformedAnchor> transformedAnchors = new List<TransformedAnchor>();
+        public int deltaMode;   // Deltas.py: 0 full, 1 keyframe, 2 delta
+        public List<int> appearedAnchors = new List<int>();
+        public List<int> disappearedAnchors = new List<int>();
     }
 
     [Serializable]
@@ -70,7 +84,55 @@ public class TCP : MonoBehaviour
 
     private float timer = 0;
     private static object Lock = new object();  // lock to prevent conflict in main thread and server thread
+
+    // Binary tracking messages (WireFormat.py version 1), used once the client offered them at connect
+    const int BINARY_VERSION = 1;
+    const byte TRACKING_FRAME = 0x01;   // + deltaMode, so kinds 1 to 3
+    const int KEYFRAME_MODE = 1;
+    const int DELTA_MODE = 2;
+    const uint APPEARED_FLAG = 4;
+    const uint DISAPPEARED_FLAG = 8;
+    const int FRAME_HEADER_SIZE = 8;    // uint8 kind, uint8 version, uint16 count, uint32 sequence
+    const int RECORD_SIZE = 48;         // int32 id, uint32 flags, float32[3] original, float32[3] transformed, float32[4] rotation
+    private static object writeLock = new object();  // the server thread answers the version offer while Update sends anchors
+
+    [Serializable]
+    public class VersionOffer
+    {
+        public int[] protocolVersions;
+    }
+
+    [Serializable]
+    public class VersionAnswer
+    {
+        public int protocolVersion;
+    }
+
+    private bool AnswerVersionOffer(string json_string)
+    {
+        if (!json_string.Contains("protocolVersions"))
+        {
+            return false;
+        }
+        VersionOffer offer = JsonUtility.FromJson<VersionOffer>(json_string);
+        VersionAnswer answer = new VersionAnswer();
+        answer.protocolVersion = offer.protocolVersions != null && offer.protocolVersions.Contains(BINARY_VERSION) ? BINARY_VERSION : 0;
+        byte[] msg = WriteFrame(JsonUtility.ToJson(answer));
+        lock (writeLock)
+        {
+            stream.Write(msg, 0, msg.Length);
+        }
+        Debug.Log("Wire format version: " + answer.protocolVersion);
+        return true;
+    }
+
+    // BitConverter reads little endian on every platform Unity runs this on, like the client writes
+    private static Vector3 ReadVector3(byte[] buffer, int offset)
+    {
+        return new Vector3(BitConverter.ToSingle(buffer, offset), BitConverter.ToSingle(buffer, offset + 4), BitConverter.ToSingle(buffer, offset + 8));
+    }
     private List<TransformedMessage> MessageQueue = new List<TransformedMessage>();
+    private Dictionary<int, TransformedAnchor> deltaAnchors = new Dictionary<int, TransformedAnchor>();  // guarded by Lock
 
     private Dictionary<int, GameObject> anchorObjects = new Dictionary<int, GameObject>();
 
@@ -90,6 +152,8 @@ public class TCP : MonoBehaviour
     {
         thread = new Thread(new ThreadStart(SetupServer));
         thread.Start();
+        datagramThread = new Thread(new ThreadStart(SetupDatagramServer));
+        datagramThread.Start();
 
         UpdateAnchorDictionary();
     }
@@ -317,20 +381,40 @@ public class TCP : MonoBehaviour
 
                 data = null;
                 stream = client.GetStream();
+                lock (Lock)
+                {
+                    // a new client starts with a keyframe and its own datagram sequence
+                    deltaAnchors.Clear();
+                    datagramApplied = false;
+                }
+                clientAddress = ((IPEndPoint)client.Client.RemoteEndPoint).Address;
 
-                // Receive message from client    
-                int i;
-                while ((i = stream.Read(buffer, 0, buffer.Length)) != 0)
+                // Receive message from client, one frame each
+                int length;
+                while ((length = ReadFrame(stream, ref buffer)) >= 0)
                 {
-                    data = Encoding.UTF8.GetString(buffer, 0, i);
-                    Debug.Log("RAW DATA RECEIVED: " + data);
-                    TransformedMessage message = DecodeTransformed(data);
-                    // Add received message to que
-                    lock (Lock)
+                    if (length == 0)
+                    {
+                        continue;   // keepalive (UnityLink.py)
+                    }
+                    TransformedMessage message;
+                    if (IsTrackingFrame(buffer, length))
                     {
-                        MessageQueue.Add(message);
+                        message = DecodeTransformedBinary(buffer, length);
                     }
+                    else
+                    {
+                        data = Encoding.UTF8.GetString(buffer, 0, length);
+                        Debug.Log("RAW DATA RECEIVED: " + data);
+                        if (AnswerVersionOffer(data))
+                        {
+                            continue;
+                        }
+                        message = DecodeTransformed(data);
+                    }
+                    QueueMessage(message);
                 }
+                clientAddress = null;
                 client.Close();
             }
         }
@@ -344,12 +428,82 @@ public class TCP : MonoBehaviour
         }
     }
 
+    private void SetupDatagramServer()
+    {
+        try
+        {
+            datagramServer = new UdpClient(new IPEndPoint(IPAddress.Parse(HOST_IP), DATAGRAM_PORT));
+            IPEndPoint sender = new IPEndPoint(IPAddress.Any, 0);
+            while (true)
+            {
+                byte[] datagram = datagramServer.Receive(ref sender);
+                IPAddress expected = clientAddress;
+                if (datagram.Length < DATAGRAM_HEADER_SIZE || expected == null || !expected.Equals(sender.Address))
+                {
+                    continue;
+                }
+                uint sequence = BitConverter.ToUInt32(datagram, 0);
+                lock (Lock)
+                {
+                    // serial number comparison, the sequence may wrap around
+                    if (datagramApplied && (int)(sequence - lastDatagramSequence) <= 0)
+                    {
+                        staleDatagrams++;
+                        continue;
+                    }
+                    lastDatagramSequence = sequence;
+                    datagramApplied = true;
+                }
+
+                int length = datagram.Length - DATAGRAM_HEADER_SIZE;
+                byte[] payload = new byte[length];
+                Buffer.BlockCopy(datagram, DATAGRAM_HEADER_SIZE, payload, 0, length);
+                if (IsTrackingFrame(payload, length))
+                {
+                    QueueMessage(DecodeTransformedBinary(payload, length));
+                }
+                else
+                {
+                    QueueMessage(DecodeTransformed(Encoding.UTF8.GetString(payload, 0, length)));
+                }
+            }
+        }
+        catch (SocketException e)
+        {
+            Debug.Log("Datagram SocketException: " + e);
+        }
+    }
+
+    private static bool IsTrackingFrame(byte[] buffer, int length)
+    {
+        return length > 0 && buffer[0] >= TRACKING_FRAME && buffer[0] <= TRACKING_FRAME + DELTA_MODE;
+    }
+
+    // Tracking arrives over TCP or as datagrams, both share the delta state under the lock
+    private void QueueMessage(TransformedMessage message)
+    {
+        lock (Lock)
+        {
+            message = ApplyDelta(message);
+            if (message != null)
+            {
+                MessageQueue.Add(message);
+            }
+        }
+    }
+
     private void OnApplicationQuit()
     {
         stream.Close();
         client.Close();
         server.Stop();
         thread.Abort();
+        if (datagramServer != null)
+        {
+            Debug.Log("Stale datagrams dropped: " + staleDatagrams);
+            datagramServer.Close();
+        }
+        datagramThread.Abort();
     }
 
     public void SendMessageToClient(Message message)
@@ -358,11 +512,62 @@ public class TCP : MonoBehaviour
             return;
         }
         Debug.Log(Encode(message));
-        byte[] msg = Encoding.UTF8.GetBytes(Encode(message));
-        stream.Write(msg, 0, msg.Length);
+        byte[] msg = WriteFrame(Encode(message));
+        lock (writeLock)
+        {
+            stream.Write(msg, 0, msg.Length);
+        }
         Debug.Log("Sent: " + message);
     }
 
+    // Length prefixed frames like Framing.py: 4 byte little endian payload length, then the UTF-8 JSON.
+    // A single Read can return part of a message or several messages, so read exactly one frame at a time.
+    private static bool ReadExactly(NetworkStream stream, byte[] buffer, int count)
+    {
+        int offset = 0;
+        while (offset < count)
+        {
+            int read = stream.Read(buffer, offset, count - offset);
+            if (read == 0)
+            {
+                return false;
+            }
+            offset += read;
+        }
+        return true;
+    }
+
+    // Payload of the next frame into buffer, returns its length or -1 when the client disconnected
+    private static int ReadFrame(NetworkStream stream, ref byte[] buffer)
+    {
+        if (!ReadExactly(stream, buffer, 4))
+        {
+            return -1;
+        }
+        int length = buffer[0] | (buffer[1] << 8) | (buffer[2] << 16) | (buffer[3] << 24);
+        if (length > buffer.Length)
+        {
+            buffer = new byte[Math.Max(length, buffer.Length * 2)];
+        }
+        if (!ReadExactly(stream, buffer, length))
+        {
+            return -1;
+        }
+        return length;
+    }
+
+    private static byte[] WriteFrame(string json)
+    {
+        int length = Encoding.UTF8.GetByteCount(json);
+        byte[] frame = new byte[4 + length];
+        frame[0] = (byte)length;
+        frame[1] = (byte)(length >> 8);
+        frame[2] = (byte)(length >> 16);
+        frame[3] = (byte)(length >> 24);
+        Encoding.UTF8.GetBytes(json, 0, json.Length, frame, 4);
+        return frame;
+    }
+
     // Encode message from struct to Json String
     public string Encode(Message message)
     {
@@ -396,4 +601,66 @@ public class TCP : MonoBehaviour
             return null;
         }
     }
+
+    public TransformedMessage DecodeTransformedBinary(byte[] buffer, int length)
+    {
+        int count = length >= FRAME_HEADER_SIZE ? BitConverter.ToUInt16(buffer, 2) : 0;
+        if (length < FRAME_HEADER_SIZE || buffer[1] != BINARY_VERSION || length < FRAME_HEADER_SIZE + count * RECORD_SIZE)
+        {
+            Debug.LogError("Failed to decode binary transformed message of " + length + " bytes");
+            return null;
+        }
+        TransformedMessage msg = new TransformedMessage();
+        msg.deltaMode = buffer[0] - TRACKING_FRAME;
+        for (int i = 0; i < count; i++)
+        {
+            int offset = FRAME_HEADER_SIZE + i * RECORD_SIZE;
+            int id = BitConverter.ToInt32(buffer, offset);
+            uint flags = BitConverter.ToUInt32(buffer, offset + 4);
+            if ((flags & DISAPPEARED_FLAG) != 0)
+            {
+                msg.disappearedAnchors.Add(id);
+                continue;
+            }
+            if ((flags & APPEARED_FLAG) != 0)
+            {
+                msg.appearedAnchors.Add(id);
+            }
+            TransformedAnchor anchor = new TransformedAnchor();
+            anchor.anchor_id = id;
+            anchor.original_position = ReadVector3(buffer, offset + 8);
+            anchor.transformed_position = ReadVector3(buffer, offset + 20);
+            msg.transformedAnchors.Add(anchor);
+        }
+        return msg;
+    }
+
+    // Keyframes and deltas (Deltas.py) are merged back into full messages here,
+    // so ProcessTransformedAnchors keeps seeing every anchor in every message
+    public TransformedMessage ApplyDelta(TransformedMessage msg)
+    {
+        if (msg == null || msg.deltaMode == 0)
+        {
+            return msg;
+        }
+        if (msg.deltaMode == KEYFRAME_MODE)
+        {
+            deltaAnchors.Clear();
+        }
+        foreach (int id in msg.disappearedAnchors)
+        {
+            deltaAnchors.Remove(id);
+        }
+        foreach (TransformedAnchor anchor in msg.transformedAnchors)
+        {
+            deltaAnchors[anchor.anchor_id] = anchor;
+        }
+        if (msg.appearedAnchors.Count > 0 || msg.disappearedAnchors.Count > 0)
+        {
+            Debug.Log("Anchors appeared: " + string.Join(", ", msg.appearedAnchors) + " disappeared: " + string.Join(", ", msg.disappearedAnchors));
+        }
+        TransformedMessage full = new TransformedMessage();
+        full.transformedAnchors.AddRange(deltaAnchors.Values);
+        return full;
+    }
 }
\ No newline at end of file
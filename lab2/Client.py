@@ -1,5 +1,6 @@
+import os
+import sys
 import socket
-import json
 import pyrealsense2 as rs
 import numpy as np
 import cv2
@@ -10,6 +11,10 @@ import time
 from scipy.linalg import lstsq
 from scipy.spatial.transform import Rotation
 
+# Lab_2_Project's Server.cs reads and writes length prefixed frames, the framing lives with the lab4 clients
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lab4', 'Lab4_Unity'))
+from Framing import FramedConnection
+
 # HOST = "192.168.0.115"
 HOST = "127.0.0.1"   # localhost
 PORT = 13456
@@ -54,9 +59,10 @@ def socket_client():
     
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
         sock.connect((HOST, PORT))
+        connection = FramedConnection(sock)
         while True:
             try:
-                msg = receive(sock)
+                msg = receive(connection)
 
                 # thread safety
                 with lock:
@@ -143,7 +149,7 @@ def socket_client():
                         }
                         
                         print("Sending calibration message:", response_msg, flush=True)
-                        send(sock, response_msg)
+                        send(connection, response_msg)
                         calibration_sent = True
                         time.sleep(0.5) # Give Unity time to process calibration
                         continue
@@ -195,14 +201,14 @@ def socket_client():
                         }
                         
                         print(f"Sending {len(transformed_anchors)} visible markers (smoothed):", response_msg, flush=True)
-                        send(sock, response_msg)
+                        send(connection, response_msg)
                     else:
                         # send empty message when no markers are visible
                         response_msg = {
                             'transformedAnchors': []
                         }
                         print("No markers visible - sending empty message", flush=True)
-                        send(sock, response_msg)
+                        send(connection, response_msg)
                         
                         # lear position history for invisible markers
                         with lock:
@@ -218,16 +224,14 @@ def socket_client():
                 print("Socket error:", e, flush=True)
                 break
 
-def receive(sock):
-    data = sock.recv(1024)
-    data = data.decode('utf-8')
-    msg = json.loads(data)
+def receive(connection):
+    "Next whole message, however TCP split or joined it"
+    msg = connection.receive()
     print("Received:", msg, flush=True)
     return msg
 
-def send(sock, msg):
-    data = json.dumps(msg)
-    sock.sendall(data.encode('utf-8'))
+def send(connection, msg):
+    connection.send(msg)
     print("Sent to server:", msg, flush=True)
 
 def realsense_loop():
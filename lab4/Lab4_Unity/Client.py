@@ -1,88 +1,121 @@
 # LAB2
-import socket
-import json
-import pyrealsense2 as rs
 import numpy as np
 import cv2
-from collections import defaultdict, deque
 import threading
 import time
+import argparse
 
 from scipy.linalg import lstsq
 from scipy.spatial.transform import Rotation
 
+from MarkerDepth import MarkerDepthEstimator
+from MarkerPose import MarkerPoseEstimator
+from Smoothing import create_filter_bank
+from Prediction import PosePredictor
+from Tracks import TrackTable, describe, COAST_TTL
+from Snapshots import SnapshotBuffer, SendScheduler
+from UnityLink import UnityLink
+from WireFormat import encode_tracking, json_message, BINARY_VERSION, APPEARED
+from Deltas import DeltaEncoder, FULL, KEYFRAME_INTERVAL, POSITION_DEADBAND
+from Datagrams import DatagramChannel, DATAGRAM_PORT
+from MarkerTracking import MarkerTracker
+from PyramidDetection import PyramidDetector
+from MarkerRegistry import RestrictedDetector, MARKER_DEPLOYMENTS
+from FrameSource import open_source, benchmark, benchmark_profiles, STREAM_PROFILES
+from Tracing import tracer
+
 # HOST = "192.168.0.115"
 HOST = "127.0.0.1"   # localhost
 PORT = 13456
 
-id_coordinates = {}
-id_rotations = {}
-lock = threading.Lock()
+# marker depth from a 5x5 grid inside each marker quad instead of the 4 corner pixels
+MARKER_DEPTH = MarkerDepthEstimator(grid=5, method='median')
 
-# window averaging filter to avoid 
-WINDOW_SIZE = 5  
-position_history = defaultdict(lambda: deque(maxlen=WINDOW_SIZE)) # auto dequeuing oldest position to keep the recent ones
+# confirmed and coasting markers of the latest frame, published by the camera thread
+snapshots = SnapshotBuffer()
+MAX_SEND_RATE = 30.0    # tracking messages per second, the camera frame rate
 
-def averaging_window_position(marker_id, position):
-    position_history[marker_id].append(position)
-    
-    if len(position_history[marker_id]) > 0:
-        positions_array = np.array(list(position_history[marker_id]))
-        smoothed = np.mean(positions_array, axis=0)
-        return smoothed.tolist()
-    
-    return position
+# window averaging filter to avoid jitter, one_euro and kalman lag less (Smoothing.py)
+WINDOW_SIZE = 5  
+SMOOTHING_PARAMS = {'average': {'window': WINDOW_SIZE}, 'one_euro': {}, 'kalman': {}, 'none': {}}
 
 def compute_marker_rotation(corners_3d):
-    x_axis = corners_3d[1] - corners_3d[0]
-    x_axis = x_axis / np.linalg.norm(x_axis)
+    return compute_marker_rotations(np.asarray(corners_3d)[None])[0]
+
+def compute_marker_rotations(corners_3d):
+    "(M,4,3) marker corners -> (M,3,3) rotation matrices, same axes as one marker at a time"
+    x_axis = corners_3d[:, 1] - corners_3d[:, 0]
+    x_axis = x_axis / np.linalg.norm(x_axis, axis=1, keepdims=True)
     
-    y_axis = corners_3d[3] - corners_3d[0]
-    y_axis = y_axis / np.linalg.norm(y_axis)
+    y_axis = corners_3d[:, 3] - corners_3d[:, 0]
+    y_axis = y_axis / np.linalg.norm(y_axis, axis=1, keepdims=True)
     
     z_axis = np.cross(x_axis, y_axis)
-    z_axis = z_axis / np.linalg.norm(z_axis)
+    z_axis = z_axis / np.linalg.norm(z_axis, axis=1, keepdims=True)
     
     y_axis = np.cross(z_axis, x_axis)
     
-    rotation_matrix = np.column_stack([x_axis, y_axis, z_axis])
+    rotation_matrices = np.stack([x_axis, y_axis, z_axis], axis=2)
     
-    return rotation_matrix
+    return rotation_matrices
 
-def socket_client():
+def socket_client(position_filter=None, predictor=None, max_rate=MAX_SEND_RATE, wire_format='json', delta_encoder=None,
+                  datagram_options=None):
+    # tracking messages go out when the camera thread publishes a frame, not on a timer
+    scheduler = SendScheduler(snapshots, max_rate)
     T_matrix = None
-    calibration_sent = False # todo later
-    
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        sock.connect((HOST, PORT))
+    calibration_msg = None  # sent again after a reconnect
+    smoothed_sequence = 0   # snapshot the position filter last saw
+    anchors_seen = 0        # unity messages the calibration has looked at
+    marker_ids = []
+    smoothed_positions = np.empty((0, 3))
+
+    def reconnected(link):
+        # a restarted unity lost the calibration and the delta state, T_matrix still holds
+        if delta_encoder is not None:
+            delta_encoder.reset()
+        if calibration_msg is not None:
+            send(link, calibration_msg)
+
+    # the socket runs on its own asyncio thread and reconnects by itself, the wire format is negotiated per connection
+    link = UnityLink(HOST, PORT, wire_format, on_connect=reconnected).start()
+    # calibration stays on tcp, tracking messages can go out as udp datagrams (Datagrams.py)
+    tracking = DatagramChannel(HOST, **datagram_options) if datagram_options is not None else link
+    try:
         while True:
             try:
-                msg = receive(sock)
-
-                # thread safety
-                with lock:
-                    coords_to_send = id_coordinates.copy()
-                    rots_to_send = id_rotations.copy()
-
-                print("anchors:", msg['listOfAnchors'], flush=True)
-                anchors = msg['listOfAnchors']
-                sorted_anchors = sorted(anchors, key=lambda x: x['id'])
-                quest_ids = [anchor['id'] for anchor in sorted_anchors]
-
-                quest_points = np.array([
-                    [anchor['position']['x'], anchor['position']['y'], anchor['position']['z']]
-                    for anchor in sorted_anchors
-                ])
-
-                print("quest points:", quest_points, flush=True)
-                print("quest ids:", quest_ids, flush=True)
+                if T_matrix is None:
+                    # calibration waits for the next quest anchors unity sends
+                    received = receive(link, anchors_seen)
+                    if received is None:
+                        continue
+                    anchors_seen, msg = received
+
+                    # one consistent view of the markers for this message, no lock and no copy
+                    snapshot = snapshots.latest()
+
+                    print("anchors:", msg['listOfAnchors'], flush=True)
+                    anchors = msg['listOfAnchors']
+                    sorted_anchors = sorted(anchors, key=lambda x: x['id'])
+                    quest_ids = [anchor['id'] for anchor in sorted_anchors]
+
+                    quest_points = np.array([
+                        [anchor['position']['x'], anchor['position']['y'], anchor['position']['z']]
+                        for anchor in sorted_anchors
+                    ])
+
+                    print("quest points:", quest_points, flush=True)
+                    print("quest ids:", quest_ids, flush=True)
+                else:
+                    # tracking wakes up on every new detection frame, unity's anchors are no longer needed
+                    snapshot = scheduler.next()
             
                 # CALIBRATION PHASE: Match quast anchors with markes
                 if T_matrix is None:
                     marker_points_list = []
                     for quest_id in quest_ids:
-                        if quest_id in id_coordinates:
-                            marker_points_list.append(id_coordinates[quest_id])
+                        if quest_id in snapshot.coordinates:
+                            marker_points_list.append(snapshot.coordinates[quest_id])
                         else:
                             print(f"WARNING: quest id {quest_id} not found in marker points", flush=True)
                             marker_points_list = []
@@ -90,14 +123,13 @@ def socket_client():
                     
                     if not marker_points_list:
                         print("Waiting for all calibration markers...", flush=True)
-                        time.sleep(0.2)
                         continue
 
                     marker_points = np.array(marker_points_list)
                     
                     print("marker points:", marker_points, flush=True)
-                    print("marker points dict:", id_coordinates, flush=True)
-                    print("marker rotations dict:", id_rotations, flush=True)
+                    print("marker points dict:", dict(snapshot.coordinates), flush=True)
+                    print("marker rotations dict:", dict(snapshot.rotations), flush=True)
 
                     if quest_points.shape[0] == marker_points.shape[0] and len(quest_points) >= 3:
                         quest_homogeneous = np.hstack([quest_points, np.ones((quest_points.shape[0], 1))])
@@ -128,8 +160,8 @@ def socket_client():
                             }
                             
                             # include rotation if available
-                            if quest_id in rots_to_send:
-                                quat = rots_to_send[quest_id]
+                            if quest_id in snapshot.rotations:
+                                quat = snapshot.rotations[quest_id]
                                 transformed_anchor['rotation'] = {
                                     'x': float(quat[0]),
                                     'y': float(quat[1]),
@@ -144,185 +176,253 @@ def socket_client():
                         }
                         
                         print("Sending calibration message:", response_msg, flush=True)
-                        send(sock, response_msg)
-                        calibration_sent = True
-                        time.sleep(0.5) # Give Unity time to process calibration
+                        send(link, response_msg)
+                        calibration_msg = response_msg
                         continue
                 
                 # TRACKING PHASE: send only currently visible markes with smoothing
                 if T_matrix is not None:
-                    transformed_anchors = []
-                    
-                    with lock:
-                        current_markers = id_coordinates.copy()
-                        current_rotations = id_rotations.copy()
-                    
-                    if current_markers:
-                        for marker_id, marker_pos in current_markers.items():
-                            # apply smoothing to raw marker position
-                            smoothed_pos = averaging_window_position(marker_id, marker_pos)
-                            
-                            # transform the smoothed marker position
-                            marker_point = np.array([smoothed_pos[0], smoothed_pos[1], smoothed_pos[2], 1.0])
-                            transformed_point = (T_matrix @ marker_point)[:3]
-                            
-                            transformed_anchor = {
-                                'anchor_id': marker_id,
-                                'original_position': {
-                                    'x': float(smoothed_pos[0]),
-                                    'y': float(smoothed_pos[1]),
-                                    'z': float(smoothed_pos[2])
-                                },
-                                'transformed_position': {
-                                    'x': float(transformed_point[0]),
-                                    'y': float(transformed_point[1]),
-                                    'z': float(transformed_point[2])
-                                }
-                            }
-                            
-                            if marker_id in current_rotations:
-                                quat = current_rotations[marker_id]
-                                transformed_anchor['rotation'] = {
-                                    'x': float(quat[0]),
-                                    'y': float(quat[1]),
-                                    'z': float(quat[2]),
-                                    'w': float(quat[3])
-                                }
-                            
-                            transformed_anchors.append(transformed_anchor)
-                        
-                        response_msg = {
-                            'transformedAnchors': transformed_anchors
-                        }
-                        
-                        print(f"Sending {len(transformed_anchors)} visible markers (smoothed):", response_msg, flush=True)
-                        send(sock, response_msg)
-                    else:
+                    # the filter takes every frame once, a snapshot we already sent reuses its output
+                    if snapshot.sequence != smoothed_sequence:
+                        # the track table decides when a marker is gone, drop its filter state then
+                        if position_filter is not None:
+                            position_filter.retain(snapshot.coordinates)
+                        if predictor is not None:
+                            predictor.retain(snapshot.coordinates)
+
+                        # apply smoothing to all raw marker positions at once
+                        marker_ids = list(snapshot.coordinates)
+                        smoothed_positions = np.array([snapshot.coordinates[marker_id] for marker_id in marker_ids]).reshape(-1, 3)
+                        if position_filter is not None:
+                            smoothed_positions = position_filter.update(marker_ids, smoothed_positions, snapshot.capture_time)
+                        smoothed_sequence = snapshot.sequence
+
+                    current_positions = smoothed_positions
+                    current_rotations = snapshot.rotations
+                    if marker_ids and predictor is not None:
+                        # extrapolate to when the headset shows the pose
+                        predictor.set_horizon(snapshot.capture_time, time.time())
+                        current_positions = predictor.update(marker_ids, smoothed_positions, snapshot.capture_time)
+                        rotation_ids = [marker_id for marker_id in marker_ids if marker_id in current_rotations]
+                        predicted = predictor.rotate(rotation_ids, [current_rotations[marker_id] for marker_id in rotation_ids], snapshot.capture_time)
+                        current_rotations = {**current_rotations, **dict(zip(rotation_ids, predicted))}
+
+                    # transform all smoothed marker positions at once
+                    with tracer.stage('transform', snapshot.frame_number):
+                        current_positions = np.asarray(current_positions, dtype=np.float64).reshape(-1, 3)
+                        transformed_points = current_positions @ T_matrix[:3, :3].T + T_matrix[:3, 3]
+                    quaternions = np.array([current_rotations.get(marker_id, (np.nan,) * 4) for marker_id in marker_ids]).reshape(-1, 4)
+
+                    mode, send_mask, appeared, disappeared = FULL, np.ones(len(marker_ids), dtype=bool), [], []
+                    if delta_encoder is not None:
+                        update = delta_encoder.update(marker_ids, transformed_points, quaternions)
+                        if update is None:
+                            # nothing moved beyond its dead-band, unity keeps the last state
+                            continue
+                        mode, send_mask, appeared, disappeared = update
+                    rows = np.flatnonzero(send_mask)
+                    send_ids = [marker_ids[i] for i in rows]
+
+                    if not marker_ids:
                         # send empty message when no markers are visible
-                        response_msg = {
-                            'transformedAnchors': []
-                        }
                         print("No markers visible - sending empty message", flush=True)
-                        send(sock, response_msg)
-                        
-                        # lear position history for invisible markers
-                        with lock:
-                            visible_ids = set(id_coordinates.keys())
-                        all_ids = set(position_history.keys())
-                        for marker_id in all_ids - visible_ids:
-                            if len(position_history[marker_id]) == 0:
-                                del position_history[marker_id]
+                    else:
+                        print(f"Sending {len(send_ids)} of {len(marker_ids)} visible markers (smoothed)", flush=True)
 
-                time.sleep(0.2)
+                    if link.wire_version == BINARY_VERSION:
+                        send_tracking(tracking, snapshot.sequence, send_ids, current_positions[rows], transformed_points[rows],
+                                      quaternions[rows], mode, appeared, disappeared)
+                    else:
+                        response_msg = json_message(send_ids, current_positions[rows], transformed_points[rows], quaternions[rows])
+                        if mode != FULL:
+                            response_msg.update({'deltaMode': mode, 'appearedAnchors': appeared, 'disappearedAnchors': disappeared})
+                        send(tracking, response_msg)
+                    tracer.sent(snapshot.capture_time, snapshot.frame_number)
 
             except Exception as e:
-                print("Socket error:", e, flush=True)
+                # connection errors stay inside the link, this is a bug in the loop
+                print("Client error:", e, flush=True)
                 break
-
-def realsense_loop():
-    global id_coordinates, id_rotations
-    pipeline = rs.pipeline()
-    config = rs.config()
-
-    pipeline_wrapper = rs.pipeline_wrapper(pipeline)
-    pipeline_profile = config.resolve(pipeline_wrapper)
-    device = pipeline_profile.get_device()
-
-    config.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
-    config.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 30)
-
-    arucoDict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_1000)
+    finally:
+        if tracking is not link:
+            tracking.close()
+        link.stop()
+        scheduler.report()
+
+def detect_markers(frame, arucoDetector, poseEstimator=None):
+    "ArUco detection plus 3D position and rotation for every marker with valid depth"
+    with tracer.stage('detect_markers', frame.number):
+        corners, ids, _ = arucoDetector.detectMarkers(frame.color_image)
+
+    local_coordinates = {}
+    local_rotations = {}
+
+    if ids is not None and poseEstimator is not None:
+        # pose from the 2D corners, depth only refines it where it is valid
+        with tracer.stage('depth_lookup', frame.number):
+            positions, quaternions, errors, valid = poseEstimator.estimate(frame, np.concatenate(corners))
+        for id, position, quaternion, is_valid in zip(ids, positions, quaternions, valid):
+            if is_valid:
+                local_coordinates[int(id[0])] = position.tolist()
+                local_rotations[int(id[0])] = quaternion.tolist()
+
+    elif ids is not None:
+        # 3D corners of all markers at once from depth sampled over each marker
+        with tracer.stage('depth_lookup', frame.number):
+            corners_3d_all, valid = MARKER_DEPTH.estimate(frame, np.concatenate(corners))
+
+        if np.any(valid):
+            corners_3d_valid = corners_3d_all[valid]
+            avg_coords = np.mean(corners_3d_valid, axis=1)
+
+            # rotations of every marker from its 3D corners in one scipy call
+            quaternions = Rotation.from_matrix(compute_marker_rotations(corners_3d_valid)).as_quat()
+
+            for id, avg_coord, quaternion in zip(ids[valid], avg_coords, quaternions):
+                local_coordinates[int(id[0])] = avg_coord.tolist()
+                local_rotations[int(id[0])] = quaternion.tolist()
+
+    return local_coordinates, local_rotations, corners, ids
+
+def create_aruco_detector(tracking=False, pyramid_scale=None, deployment=None):
     arucoParam = cv2.aruco.DetectorParameters()
-    arucoDetector = cv2.aruco.ArucoDetector(arucoDict, arucoParam)
-
-    pipeline.start(config)
-    align = rs.align(rs.stream.color)
+    if deployment is not None:
+        # dictionary with only the markers of this deployment (MarkerRegistry.MARKER_DEPLOYMENTS)
+        arucoDetector = RestrictedDetector(deployment, arucoParam)
+    else:
+        arucoDict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_1000)
+        arucoDetector = cv2.aruco.ArucoDetector(arucoDict, arucoParam)
+    if pyramid_scale is not None:
+        # find markers at low resolution, refine their corners at full resolution
+        arucoDetector = PyramidDetector(arucoDetector, scale=pyramid_scale)
+    if tracking:
+        # search only around the predicted markers, full frame every few frames
+        return MarkerTracker(arucoDetector)
+    return arucoDetector
+
+def realsense_loop(source, aruco_options=None, poseEstimator=None, coast_ttl=COAST_TTL, trace_file=None):
+    aruco_options = aruco_options or {}
+    arucoDetector = create_aruco_detector(**aruco_options)
+    # markers coast on their last pose for a few frames instead of vanishing on one missed detection
+    tracks = TrackTable(coast_ttl=coast_ttl)
+
+    source.start()
 
     try:
-        while True:
-            frames = pipeline.wait_for_frames()
+        for frame_count, frame in enumerate(source):
+            # gaps in the camera frame numbers are frames we never saw
+            tracer.frame(frame)
+            local_coordinates, local_rotations, corners, ids = detect_markers(frame, arucoDetector, poseEstimator)
+            color_image = frame.color_image
 
-            aligned_frames = align.process(frames)
+            transitions = tracks.update(frame_count, local_coordinates, local_rotations)
+            if transitions:
+                print("Marker tracks:", describe(transitions), flush=True)
+            visible_coordinates, visible_rotations = tracks.visible()
 
-            depth_frame = aligned_frames.get_depth_frame()
-            color_frame = aligned_frames.get_color_frame()
-            
-            if not depth_frame or not color_frame:
-                continue
-
-            depth_image = np.asanyarray(depth_frame.get_data())
-            color_image = np.asanyarray(color_frame.get_data())
-
-            corners, ids, _ = arucoDetector.detectMarkers(color_image)
-            intrinsics = depth_frame.profile.as_video_stream_profile().get_intrinsics()
-
-            local_coordinates = {}
-            local_rotations = {}
+            # the dicts are new every frame, the socket thread reads them without a lock
+            snapshots.publish(visible_coordinates, visible_rotations, frame.capture_time(), frame.number)
 
             if ids is not None:
-                for id, marker in zip(ids, corners):
-                    valid_coords = []
-                    
-                    for corner in marker[0]:
-                        x, y = corner
-                        depth = depth_frame.get_distance(int(x), int(y))
-                        
-                        if depth > 0:
-                            coord = rs.rs2_deproject_pixel_to_point(intrinsics, [x, y], depth)
-                            valid_coords.append(coord)
-                    
-                    if len(valid_coords) == 4:
-                        avg_coord = np.mean(valid_coords, axis=0)
-                        local_coordinates[int(id[0])] = avg_coord.tolist()
-                        
-                        # compute rotation from 3D corners
-                        corners_3d = np.array(valid_coords)
-                        rotation_matrix = compute_marker_rotation(corners_3d)
-                        
-                        r = Rotation.from_matrix(rotation_matrix)
-                        quaternion = r.as_quat()
-                        
-                        local_rotations[int(id[0])] = quaternion.tolist()
-
-                # update with thread safety
-                with lock:
-                    id_coordinates = local_coordinates.copy()
-                    id_rotations = local_rotations.copy()
-
-                color_image = cv2.aruco.drawDetectedMarkers(color_image, corners, ids)
-            else:
-                # no markers detected - clear coordinates and rotations
-                with lock:
-                    id_coordinates = {}
-                    id_rotations = {}
+                color_image = cv2.aruco.drawDetectedMarkers(color_image.copy(), corners, ids)
 
-            depth_colormap = cv2.applyColorMap(cv2.convertScaleAbs(depth_image, alpha=0.03), cv2.COLORMAP_JET)
+            depth_colormap = cv2.applyColorMap(cv2.convertScaleAbs(frame.depth_image, alpha=0.03), cv2.COLORMAP_JET)
+            if depth_colormap.shape != color_image.shape:
+                # sparse alignment keeps the raw depth stream, only scale it for display
+                depth_colormap = cv2.resize(depth_colormap, (color_image.shape[1], color_image.shape[0]))
             images = np.hstack((color_image, depth_colormap))
             cv2.imshow('RealSense', images)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
+            key = cv2.waitKey(1) & 0xFF
+            if key == ord('t'):
+                # stage latencies so far, without stopping
+                tracer.report()
+            if key == ord('q'):
                 break
 
     finally:
-        pipeline.stop()
+        source.stop()
         cv2.destroyAllWindows()
-
-def receive(sock):
-    data = sock.recv(1024)
-    data = data.decode('utf-8')
-    msg = json.loads(data)
-    print("Received:", msg, flush=True)
-    return msg
-
-def send(sock, msg):
-    data = json.dumps(msg)
-    sock.sendall(data.encode('utf-8'))
+        tracer.report(trace_file)
+
+def benchmark_loop(source, aruco_options=None, poseEstimator=None, trace_file=None):
+    "Replay the source through detect_markers without socket or display"
+    aruco_options = aruco_options or {}
+    arucoDetector = create_aruco_detector(**aruco_options)
+    with source:
+        result = benchmark(source, lambda frame: detect_markers(frame, arucoDetector, poseEstimator))
+    if isinstance(arucoDetector, MarkerTracker):
+        arucoDetector.report()
+    tracer.report(trace_file)
+    return result
+
+def receive(link, seen, timeout=1.0):
+    "(message count, message) of the next unity message after seen, None when none arrives in time"
+    received = link.wait(seen, timeout)
+    if received is not None:
+        print("Received:", received[1], flush=True)
+    return received
+
+def send(connection, msg):
+    connection.send(msg)
     print("Sent to server:", msg, flush=True)
 
-if __name__ == "__main__":
-    # start thread with socket code
-    # t1 = threading.Thread(target=socket_client)
-    # t1.start()
+def send_tracking(connection, sequence, marker_ids, positions, transformed, quaternions, mode=FULL, appeared=(), disappeared=()):
+    "Binary tracking message (WireFormat.py), one float32 record per marker"
+    with tracer.stage('encode'):
+        flags = np.array([APPEARED if marker_id in appeared else 0 for marker_id in marker_ids], dtype=np.uint32)
+        payload = encode_tracking(marker_ids, positions, transformed, quaternions, flags, sequence, mode, disappeared)
+    connection.send_frame(payload)
 
-    socket_client()
-    # realsense runs on the main thread
-    # realsense_loop()
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', help="recorded .bag or .npz file instead of the live camera")
+    parser.add_argument('--benchmark', action='store_true', help="replay as fast as possible and report frames/s")
+    parser.add_argument('--align', choices=['full', 'sparse'], default='full', help="rs.align every frame or only the queried pixels")
+    parser.add_argument('--profile', choices=list(STREAM_PROFILES), help="stream profile, default picks the fastest one the camera supports")
+    parser.add_argument('--benchmark-profiles', action='store_true', help="compare latency of every stream profile on the live camera")
+    parser.add_argument('--depth-filters', type=lambda s: s.split(','), help="numpy depth filters run around the queried pixels, e.g. spatial,temporal,hole_filling")
+    parser.add_argument('--filter-full-frame', action='store_true', help="run --depth-filters on the whole depth image")
+    parser.add_argument('--rs-filters', type=lambda s: s.split(','), help="librealsense filters on the raw frame, e.g. spatial,temporal,hole_filling")
+    parser.add_argument('--track-markers', action='store_true', help="detect markers only around their predicted positions")
+    parser.add_argument('--pyramid-scale', type=float, choices=[0.5, 0.25], help="find markers on a downscaled image, refine corners at full resolution")
+    parser.add_argument('--markers', choices=list(MARKER_DEPLOYMENTS), help="decode only the marker IDs of this deployment")
+    parser.add_argument('--marker-size', type=float, help="printed marker side in meters, enables solvePnP marker poses")
+    parser.add_argument('--smoothing', choices=list(SMOOTHING_PARAMS), default='average', help="marker position filter")
+    parser.add_argument('--coast-ttl', type=int, default=COAST_TTL, help="frames a marker keeps its last pose after its last detection")
+    parser.add_argument('--max-rate', type=float, default=MAX_SEND_RATE, help="most tracking messages per second, new frames in between are coalesced")
+    parser.add_argument('--wire-format', choices=['json', 'binary'], default='json', help="binary float32 tracking messages if the server supports them")
+    parser.add_argument('--delta', action='store_true', help="send keyframes and in between only markers that moved")
+    parser.add_argument('--keyframe-interval', type=int, default=KEYFRAME_INTERVAL, help="messages between two full keyframes in --delta mode")
+    parser.add_argument('--deadband', type=float, default=POSITION_DEADBAND, help="meters a marker has to move before --delta sends it again")
+    parser.add_argument('--transport', choices=['tcp', 'udp'], default='tcp', help="tracking messages over the tcp connection or as udp datagrams")
+    parser.add_argument('--datagram-port', type=int, default=DATAGRAM_PORT, help="unity's udp port for --transport udp")
+    parser.add_argument('--inject-loss', type=float, default=0.0, help="drop this fraction of tracking datagrams, for testing")
+    parser.add_argument('--inject-reorder', type=float, default=0.0, help="swap this fraction of tracking datagrams with the next one, for testing")
+    parser.add_argument('--predict-latency', type=float, help="extrapolate poses by the capture to send time plus this many seconds")
+    parser.add_argument('--trace-file', help="write the per-stage latency histograms (Tracing.py) as JSON on exit")
+    args = parser.parse_args()
+    aruco_options = {'tracking': args.track_markers, 'pyramid_scale': args.pyramid_scale, 'deployment': args.markers}
+    poseEstimator = MarkerPoseEstimator(args.marker_size, MARKER_DEPTH) if args.marker_size else None
+
+    if args.benchmark_profiles:
+        arucoDetector = create_aruco_detector(**aruco_options)
+        benchmark_profiles(lambda frame: detect_markers(frame, arucoDetector, poseEstimator), align=args.align)
+    elif args.benchmark:
+        benchmark_loop(open_source(args.source, real_time=False, align=args.align, profile=args.profile,
+                                   rs_filters=args.rs_filters, depth_filters=args.depth_filters,
+                                   filter_full_frame=args.filter_full_frame), aruco_options, poseEstimator, args.trace_file)
+    else:
+        # start thread with socket code
+        position_filter = create_filter_bank(args.smoothing, **SMOOTHING_PARAMS[args.smoothing])
+        predictor = PosePredictor(latency=args.predict_latency) if args.predict_latency is not None else None
+        delta_encoder = DeltaEncoder(args.keyframe_interval, args.deadband) if args.delta else None
+        datagram_options = {'port': args.datagram_port, 'loss': args.inject_loss, 'reorder': args.inject_reorder} if args.transport == 'udp' else None
+        t1 = threading.Thread(target=socket_client, args=(position_filter, predictor, args.max_rate, args.wire_format, delta_encoder,
+                                                          datagram_options))
+        t1.start()
+
+        # realsense runs on the main thread
+        realsense_loop(open_source(args.source, align=args.align, profile=args.profile,
+                                   rs_filters=args.rs_filters, depth_filters=args.depth_filters,
+                                   filter_full_frame=args.filter_full_frame), aruco_options, poseEstimator, args.coast_ttl,
+                       args.trace_file)
@@ -0,0 +1,171 @@
+# LAB4
+
+'''
+UDP transport for the tracking stream.
+On TCP one delayed packet holds back every pose sent after it, although a
+stale pose is worthless once a newer one exists. With --transport udp the
+calibration handshake (listOfAnchors -> transformedAnchors) and the version
+offer stay on the TCP connection to port 13456, and every tracking message
+goes out as one datagram to DATAGRAM_PORT:
+    uint32 sequence (little endian), then the JSON or binary payload
+Server.cs applies a datagram only when its sequence is newer than the last
+one it applied and drops the rest. A lost delta (Deltas.py) is repaired by
+the next keyframe.
+Run this file for a loopback test with loss and reorder injection:
+    python Datagrams.py [--count 2000] [--loss 0.1] [--reorder 0.1]
+'''
+import json
+import time
+import random
+import socket
+import struct
+import argparse
+import numpy as np
+
+from WireFormat import encode_tracking, decode_tracking
+from Tracing import tracer
+
+DATAGRAM_PORT = 13457
+HEADER = struct.Struct('<I')
+MAX_DATAGRAM = 65507        # bytes, the largest UDP payload over IPv4
+
+
+def is_newer(sequence, last):
+    "Serial number comparison, so the uint32 sequence may wrap around"
+    return 0 < ((sequence - last) & 0xFFFFFFFF) < 0x80000000
+
+
+class Impairment:
+    "Drops and reorders outgoing datagrams, for testing the receiver"
+    def __init__(self, loss=0.0, reorder=0.0, seed=None):
+        self.loss = loss            # probability a datagram is dropped
+        self.reorder = reorder      # probability a datagram is held back and sent after the next one
+        self.rng = random.Random(seed)
+        self.held = None
+
+    def apply(self, datagram):
+        "Datagrams to send now, in order"
+        if self.rng.random() < self.loss:
+            return []
+        if self.held is None and self.rng.random() < self.reorder:
+            self.held = datagram
+            return []
+        datagrams = [datagram]
+        if self.held is not None:
+            datagrams.append(self.held)
+            self.held = None
+        return datagrams
+
+
+class DatagramChannel:
+    "Tracking messages as sequence numbered datagrams, with the send methods of FramedConnection"
+    def __init__(self, host, port=DATAGRAM_PORT, loss=0.0, reorder=0.0, seed=None):
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sequence = 0
+        self.impairment = Impairment(loss, reorder, seed) if loss or reorder else None
+        self.sent = 0
+        self.dropped = 0        # messages too large for one datagram
+
+    def send(self, msg):
+        with tracer.stage('encode'):
+            payload = json.dumps(msg).encode('utf-8')
+        self.send_frame(payload)
+
+    def send_frame(self, payload):
+        "Send one message as a datagram, drop it when it does not fit in one"
+        if HEADER.size + len(payload) > MAX_DATAGRAM:
+            # like a full UnityLink queue: lose this pose, the next one may fit, tracking goes on
+            if self.dropped == 0:
+                print(f"tracking message of {HEADER.size + len(payload)} bytes does not fit in a datagram, dropped", flush=True)
+            self.dropped += 1
+            return
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        datagram = HEADER.pack(self.sequence) + payload
+        with tracer.stage('send'):
+            for sent in (self.impairment.apply(datagram) if self.impairment else (datagram,)):
+                self.sock.sendto(sent, self.address)
+        self.sent += 1
+
+    def close(self):
+        self.sock.close()
+        print(f"datagram channel: {self.sent} messages sent, {self.dropped} dropped as too large", flush=True)
+
+
+class DatagramReceiver:
+    "Receiving end like Server.cs: applies only datagrams newer than the last applied one"
+    def __init__(self, sock):
+        self.sock = sock
+        self.last = None            # sequence of the last applied datagram
+        self.applied = 0
+        self.stale = 0              # arrived after a newer one, dropped
+
+    def accept(self, datagram):
+        "Payload of the datagram if it is newer than the last applied one, else None"
+        if len(datagram) < HEADER.size:
+            return None
+        sequence, = HEADER.unpack_from(datagram)
+        if self.last is not None and not is_newer(sequence, self.last):
+            self.stale += 1
+            return None
+        self.last = sequence
+        self.applied += 1
+        return memoryview(datagram)[HEADER.size:]
+
+    def receive(self):
+        "Next payload worth applying; blocks, a socket timeout raises socket.timeout"
+        while True:
+            payload = self.accept(self.sock.recv(MAX_DATAGRAM))
+            if payload is not None:
+                return payload
+
+
+def loopback_test(count=2000, loss=0.1, reorder=0.1, anchors=8, seed=0):
+    "Send binary tracking datagrams over loopback through the impairment, check only newer ones are applied"
+    receiver_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver_sock.bind(('127.0.0.1', 0))
+    receiver_sock.settimeout(0.2)
+    receiver = DatagramReceiver(receiver_sock)
+    channel = DatagramChannel('127.0.0.1', receiver_sock.getsockname()[1], loss, reorder, seed)
+
+    rng = np.random.default_rng(seed)
+    ids = np.arange(anchors)
+    applied = []
+    t0 = time.perf_counter()
+    for sequence in range(1, count + 1):
+        points = rng.normal(size=(anchors, 3))
+        channel.send_frame(encode_tracking(ids, points, points, sequence=sequence))
+        # drain as we go, the loopback receive buffer is not unbounded
+        receiver_sock.setblocking(False)
+        try:
+            while True:
+                payload = receiver.accept(receiver_sock.recv(MAX_DATAGRAM))
+                if payload is not None:
+                    applied.append(decode_tracking(payload)[1])
+        except BlockingIOError:
+            pass
+        receiver_sock.settimeout(0.2)
+    try:
+        while True:
+            applied.append(decode_tracking(receiver.receive())[1])
+    except socket.timeout:
+        pass
+    elapsed = time.perf_counter() - t0
+    channel.close()
+    receiver_sock.close()
+
+    assert all(a < b for a, b in zip(applied, applied[1:])), "an older datagram was applied after a newer one"
+    lost = count - receiver.applied - receiver.stale
+    print(f"loopback: {count} sent, {receiver.applied} applied, {receiver.stale} stale dropped, {lost} lost "
+          f"(injected loss {loss:.0%}, reorder {reorder:.0%}), {count / elapsed:.0f} datagrams/s", flush=True)
+    return {'sent': count, 'applied': receiver.applied, 'stale': receiver.stale, 'lost': lost}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=2000, help="datagrams to send")
+    parser.add_argument('--loss', type=float, default=0.1, help="probability a datagram is dropped")
+    parser.add_argument('--reorder', type=float, default=0.1, help="probability a datagram is swapped with the next one")
+    parser.add_argument('--anchors', type=int, default=8, help="anchors per message")
+    args = parser.parse_args()
+    loopback_test(args.count, args.loss, args.reorder, args.anchors)
@@ -0,0 +1,96 @@
+# LAB4
+
+'''
+Sparse delta updates for the anchor stream.
+A static scene used to cost a full tracking message on every tick. In delta
+mode the client sends a keyframe with every anchor every keyframe_interval
+ticks; the messages in between carry only the anchors that moved further
+than their dead-band since they were last sent, plus the IDs that appeared
+or disappeared. A tick where nothing changed sends nothing at all.
+Server.cs rebuilds the full anchor list from keyframe and deltas (ApplyDelta),
+so everything after decoding sees the same messages as before.
+Message fields, JSON and binary (WireFormat.py frame kinds):
+    deltaMode                   FULL, KEYFRAME or DELTA
+    appeared... / disappeared...  anchor ids, one pair per anchor list
+'''
+import numpy as np
+
+FULL = 0        # every anchor, no delta state, what old servers expect
+KEYFRAME = 1    # every anchor, the server replaces its state
+DELTA = 2       # changed anchors and appear / disappear events on top of the last state
+
+KEYFRAME_INTERVAL = 30      # ticks, a lost delta is repaired within a second at 30 Hz
+POSITION_DEADBAND = 0.002   # meters in Unity space
+ROTATION_DEADBAND = 0.02    # radians
+
+
+class DeltaEncoder:
+    "Last sent pose per anchor id, decides what the next message has to carry"
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL, position_deadband=POSITION_DEADBAND,
+                 rotation_deadband=ROTATION_DEADBAND, deadbands=None):
+        self.keyframe_interval = keyframe_interval
+        self.position_deadband = position_deadband
+        self.rotation_deadband = rotation_deadband
+        self.deadbands = dict(deadbands or {})  # anchor id -> position dead-band overriding the default
+        self.sent_positions = {}                # anchor id -> position Unity has
+        self.sent_rotations = {}                # anchor id -> quaternion Unity has, nan when none was sent
+        self.ticks = 0                          # updates since the last keyframe
+        self.force_keyframe = True
+
+    def update(self, ids, positions, rotations=None):
+        "(N,) ids, (N,3) positions, (N,4) quaternions or nan rows -> (mode, (N,) send mask, appeared, disappeared) or None"
+        ids = [int(anchor_id) for anchor_id in ids]
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        if rotations is None:
+            rotations = np.full((len(ids), 4), np.nan)
+        rotations = np.asarray(rotations, dtype=np.float64).reshape(-1, 4)
+
+        current = set(ids)
+        appeared = [anchor_id for anchor_id in ids if anchor_id not in self.sent_positions]
+        disappeared = [anchor_id for anchor_id in self.sent_positions if anchor_id not in current]
+
+        self.ticks += 1
+        if self.force_keyframe or self.ticks >= self.keyframe_interval:
+            mode = KEYFRAME
+            send = np.ones(len(ids), dtype=bool)
+            self.sent_positions.clear()
+            self.sent_rotations.clear()
+            self.ticks = 0
+            self.force_keyframe = False
+        else:
+            mode = DELTA
+            send = self.moved(ids, positions, rotations)
+            if not np.any(send) and not disappeared:
+                return None
+            for anchor_id in disappeared:
+                del self.sent_positions[anchor_id]
+                del self.sent_rotations[anchor_id]
+
+        # compare against what Unity has, so slow drift still gets sent once it adds up
+        for i in np.flatnonzero(send):
+            self.sent_positions[ids[i]] = positions[i]
+            self.sent_rotations[ids[i]] = rotations[i]
+        return mode, send, appeared, disappeared
+
+    def moved(self, ids, positions, rotations):
+        "Anchors that are new or moved beyond their dead-band since they were last sent"
+        known = np.array([anchor_id in self.sent_positions for anchor_id in ids], dtype=bool)
+        send = ~known
+        if np.any(known):
+            rows = np.flatnonzero(known)
+            known_ids = [ids[i] for i in rows]
+            previous = np.array([self.sent_positions[anchor_id] for anchor_id in known_ids])
+            deadband = np.array([self.deadbands.get(anchor_id, self.position_deadband) for anchor_id in known_ids])
+            send[rows] |= np.linalg.norm(positions[rows] - previous, axis=1) > deadband
+
+            previous = np.array([self.sent_rotations[anchor_id] for anchor_id in known_ids])
+            # angle between the quaternions, a rotation appearing or vanishing always counts
+            dot = np.abs(np.sum(previous * rotations[rows], axis=1))
+            angle = 2.0 * np.arccos(np.clip(dot, 0.0, 1.0))
+            has_now, had = ~np.isnan(rotations[rows, 0]), ~np.isnan(previous[:, 0])
+            send[rows] |= (has_now != had) | (has_now & had & (angle > self.rotation_deadband))
+        return send
+
+    def reset(self):
+        "Next message is a keyframe, e.g. after a reconnect"
+        self.force_keyframe = True
@@ -0,0 +1,184 @@
+# LAB4
+
+'''
+Vectorized pixel -> 3D deprojection.
+Same math as rs.rs2_deproject_pixel_to_point (librealsense rsutil.h) but for
+an (N,2) array of pixels in one numpy pass instead of one FFI call per pixel.
+'''
+import numpy as np
+
+# rs.distortion enum values
+DISTORTION_NONE = 0
+DISTORTION_MODIFIED_BROWN_CONRADY = 1
+DISTORTION_INVERSE_BROWN_CONRADY = 2
+DISTORTION_FTHETA = 3
+DISTORTION_BROWN_CONRADY = 4
+DISTORTION_KANNALA_BRANDT4 = 5
+
+EPSILON = np.finfo(np.float32).eps
+
+deprojector_cache = {}
+
+
+def undistort_rays(intrinsics, x, y):
+    "Normalized image coordinates -> ray (x/z, y/z) for the intrinsics distortion model"
+    model = int(intrinsics.model)
+    c = [float(v) for v in intrinsics.coeffs]
+    xo, yo = x, y
+
+    # 10 iterations as in librealsense, determined empirically there
+    if model == DISTORTION_INVERSE_BROWN_CONRADY:
+        for _ in range(10):
+            r2 = x * x + y * y
+            icdist = 1.0 / (1.0 + ((c[4] * r2 + c[1]) * r2 + c[0]) * r2)
+            xq = x / icdist
+            yq = y / icdist
+            delta_x = 2 * c[2] * xq * yq + c[3] * (r2 + 2 * xq * xq)
+            delta_y = 2 * c[3] * xq * yq + c[2] * (r2 + 2 * yq * yq)
+            x = (xo - delta_x) * icdist
+            y = (yo - delta_y) * icdist
+
+    elif model == DISTORTION_BROWN_CONRADY:
+        for _ in range(10):
+            r2 = x * x + y * y
+            icdist = 1.0 / (1.0 + ((c[4] * r2 + c[1]) * r2 + c[0]) * r2)
+            delta_x = 2 * c[2] * x * y + c[3] * (r2 + 2 * x * x)
+            delta_y = 2 * c[3] * x * y + c[2] * (r2 + 2 * y * y)
+            x = (xo - delta_x) * icdist
+            y = (yo - delta_y) * icdist
+
+    elif model == DISTORTION_KANNALA_BRANDT4:
+        rd = np.maximum(np.sqrt(x * x + y * y), EPSILON)
+        theta = rd.copy()
+        for _ in range(4):
+            theta2 = theta * theta
+            f = theta * (1 + theta2 * (c[0] + theta2 * (c[1] + theta2 * (c[2] + theta2 * c[3])))) - rd
+            df = 1 + theta2 * (3 * c[0] + theta2 * (5 * c[1] + theta2 * (7 * c[2] + 9 * theta2 * c[3])))
+            theta = theta - f / df
+        r = np.tan(theta)
+        x = x * r / rd
+        y = y * r / rd
+
+    elif model == DISTORTION_FTHETA:
+        rd = np.maximum(np.sqrt(x * x + y * y), EPSILON)
+        r = np.tan(c[0] * rd) / np.arctan(2 * np.tan(c[0] / 2.0))
+        x = x * r / rd
+        y = y * r / rd
+
+    # modified brown conrady cannot be deprojected, librealsense treats it as none as well
+    return x, y
+
+
+class Deprojector:
+    "Deprojects pixels of one stream profile, keeps a ray for every pixel of the image"
+    def __init__(self, intrinsics, depth_scale):
+        self.intrinsics = intrinsics
+        self.depth_scale = depth_scale
+        self.width = intrinsics.width
+        self.height = intrinsics.height
+
+        # ray table: (x/z, y/z) for every integer pixel, computed once per profile
+        u, v = np.meshgrid(np.arange(self.width, dtype=np.float64),
+                           np.arange(self.height, dtype=np.float64))
+        self.ray_table = np.stack(self.pixel_rays(u, v), axis=-1).astype(np.float32)
+
+    def pixel_rays(self, u, v):
+        x = (u - self.intrinsics.ppx) / self.intrinsics.fx
+        y = (v - self.intrinsics.ppy) / self.intrinsics.fy
+        return undistort_rays(self.intrinsics, x, y)
+
+    def depth_at(self, pixels, depth_image):
+        "Depth in meters for an (N,2) pixel array, looked up at the truncated pixel like get_distance"
+        ix = np.clip(pixels[:, 0].astype(np.int32), 0, self.width - 1)
+        iy = np.clip(pixels[:, 1].astype(np.int32), 0, self.height - 1)
+        return depth_image[iy, ix] * self.depth_scale, ix, iy
+
+    def rays(self, pixels):
+        "(N,2) pixels -> ray components (x/z, y/z)"
+        if np.issubdtype(pixels.dtype, np.integer):
+            ix = np.clip(pixels[:, 0], 0, self.width - 1)
+            iy = np.clip(pixels[:, 1], 0, self.height - 1)
+            rays = self.ray_table[iy, ix]
+            return rays[:, 0], rays[:, 1]
+        # sub-pixel positions like marker corners go through the model directly
+        return self.pixel_rays(pixels[:, 0].astype(np.float64), pixels[:, 1].astype(np.float64))
+
+    def deproject_depth(self, pixels, depth):
+        "(N,2) pixels with known (N,) depth in meters -> (N,3) points"
+        pixels = np.asarray(pixels).reshape(-1, 2)
+        rx, ry = self.rays(pixels)
+        return np.stack([depth * rx, depth * ry, depth], axis=-1)
+
+    def deproject(self, pixels, depth_image):
+        "(N,2) pixels + z16 depth image -> (N,3) points in meters, z == 0 where depth is missing"
+        pixels = np.asarray(pixels).reshape(-1, 2)
+        depth, _, _ = self.depth_at(pixels, depth_image)
+        return self.deproject_depth(pixels, depth)
+
+    def deproject_image(self, depth_image):
+        "Whole depth image -> (H,W,3) point map from the ray table"
+        depth = depth_image * np.float32(self.depth_scale)
+        return np.dstack([self.ray_table[..., 0] * depth, self.ray_table[..., 1] * depth, depth])
+
+
+def project_points(intrinsics, points):
+    "(N,3) points -> (N,2) pixels, vectorized rs.rs2_project_point_to_pixel"
+    x = points[..., 0] / points[..., 2]
+    y = points[..., 1] / points[..., 2]
+    model = int(intrinsics.model)
+    c = [float(v) for v in intrinsics.coeffs]
+
+    if model in (DISTORTION_MODIFIED_BROWN_CONRADY, DISTORTION_INVERSE_BROWN_CONRADY):
+        r2 = x * x + y * y
+        f = 1 + c[0] * r2 + c[1] * r2 * r2 + c[4] * r2 * r2 * r2
+        x = x * f
+        y = y * f
+        dx = x + 2 * c[2] * x * y + c[3] * (r2 + 2 * x * x)
+        dy = y + 2 * c[3] * x * y + c[2] * (r2 + 2 * y * y)
+        x, y = dx, dy
+
+    elif model == DISTORTION_BROWN_CONRADY:
+        r2 = x * x + y * y
+        f = 1 + c[0] * r2 + c[1] * r2 * r2 + c[4] * r2 * r2 * r2
+        dx = x * f + 2 * c[2] * x * y + c[3] * (r2 + 2 * x * x)
+        dy = y * f + 2 * c[3] * x * y + c[2] * (r2 + 2 * y * y)
+        x, y = dx, dy
+
+    elif model == DISTORTION_FTHETA:
+        r = np.maximum(np.sqrt(x * x + y * y), EPSILON)
+        rd = 1.0 / c[0] * np.arctan(2 * r * np.tan(c[0] / 2.0))
+        x = x * rd / r
+        y = y * rd / r
+
+    elif model == DISTORTION_KANNALA_BRANDT4:
+        r = np.maximum(np.sqrt(x * x + y * y), EPSILON)
+        theta = np.arctan(r)
+        theta2 = theta * theta
+        rd = theta * (1 + theta2 * (c[0] + theta2 * (c[1] + theta2 * (c[2] + theta2 * c[3]))))
+        x = x * rd / r
+        y = y * rd / r
+
+    return np.stack([x * intrinsics.fx + intrinsics.ppx, y * intrinsics.fy + intrinsics.ppy], axis=-1)
+
+
+def extrinsics_to_matrix(extrinsics):
+    "rs.extrinsics -> (3,3) rotation, (3,) translation, librealsense stores the rotation column major"
+    rotation = np.array(extrinsics.rotation, dtype=np.float64).reshape(3, 3).T
+    translation = np.array(extrinsics.translation, dtype=np.float64)
+    return rotation, translation
+
+
+def intrinsics_key(intrinsics, depth_scale):
+    return (intrinsics.width, intrinsics.height, intrinsics.ppx, intrinsics.ppy,
+            intrinsics.fx, intrinsics.fy, int(intrinsics.model),
+            tuple(intrinsics.coeffs), depth_scale)
+
+
+def get_deprojector(intrinsics, depth_scale):
+    "Deprojector for this stream profile, built once and cached"
+    key = intrinsics_key(intrinsics, depth_scale)
+    deprojector = deprojector_cache.get(key)
+    if deprojector is None:
+        deprojector = Deprojector(intrinsics, depth_scale)
+        deprojector_cache[key] = deprojector
+    return deprojector
@@ -0,0 +1,199 @@
+# LAB4
+
+'''
+Depth post-processing between capture and detection.
+RealSenseFilterChain runs the librealsense filters (decimation, spatial,
+temporal, hole filling) on the whole raw depth frame before alignment.
+DepthFilterChain does spatial / temporal / hole filling in numpy + OpenCV and
+can be limited to the regions the detectors actually read depth from.
+Both keep the cost of every filter in milliseconds.
+'''
+import time
+import numpy as np
+import cv2
+import pyrealsense2 as rs
+
+ROI_PADDING = 8
+
+
+class FilterCosts:
+    "Running cost per filter in milliseconds"
+    def __init__(self, names):
+        self.names = list(names)
+        self.total_ms = {name: 0.0 for name in self.names}
+        self.last_ms = {name: 0.0 for name in self.names}
+        self.calls = 0
+
+    def add(self, name, ms):
+        self.total_ms[name] += ms
+        self.last_ms[name] += ms
+
+    def next_frame(self):
+        self.calls += 1
+        self.last_ms = {name: 0.0 for name in self.names}
+
+    def report(self):
+        calls = max(self.calls, 1)
+        parts = [f"{name} {self.total_ms[name] / calls:.2f} ms" for name in self.names]
+        print("depth filters (mean per frame): " + ", ".join(parts), flush=True)
+        return {name: self.total_ms[name] / calls for name in self.names}
+
+
+class RealSenseFilterChain:
+    "librealsense post-processing blocks on the full frameset, run before alignment"
+    def __init__(self, names=('decimation', 'spatial', 'temporal', 'hole_filling')):
+        factories = {
+            'decimation': rs.decimation_filter,
+            'spatial': rs.spatial_filter,
+            'temporal': rs.temporal_filter,
+            'hole_filling': rs.hole_filling_filter,
+        }
+        self.filters = [(name, factories[name]()) for name in names]
+        self.costs = FilterCosts(names)
+
+    def process(self, frames):
+        self.costs.next_frame()
+        for name, block in self.filters:
+            t0 = time.perf_counter()
+            # applied to a frameset the block replaces the depth frame and keeps color
+            frames = block.process(frames).as_frameset()
+            self.costs.add(name, (time.perf_counter() - t0) * 1000.0)
+        return frames
+
+
+class SpatialFilter:
+    "Edge preserving median smoothing"
+    def __init__(self, kernel=5):
+        self.kernel = kernel    # 3 or 5, the sizes cv2.medianBlur supports for uint16
+
+    def apply(self, depth, box, shape, update, entered):
+        return cv2.medianBlur(depth, self.kernel)
+
+
+class TemporalFilter:
+    "Per pixel exponential smoothing that keeps the last valid depth through short dropouts"
+    def __init__(self, alpha=0.4, delta=20, persistence=3):
+        self.alpha = alpha              # weight of the new sample
+        self.delta = delta              # depth units, bigger jumps reset the pixel
+        self.persistence = persistence  # frames a pixel keeps its value without new depth
+        self.state = None
+        self.missing = None
+
+    def apply(self, depth, box, shape, update, entered):
+        "Advance the state of the update pixels of box by one frame, entered pixels start over"
+        x0, y0, x1, y1 = box
+        if self.state is None or self.state.shape != shape:
+            self.state = np.zeros(shape, dtype=np.float32)
+            self.missing = np.zeros(shape, dtype=np.int32)
+        state = self.state[y0:y1, x0:x1]
+        missing = self.missing[y0:y1, x0:x1]
+        # outside every region last frame, whatever state the pixel has is from before that
+        state[entered] = 0.0
+        missing[entered] = 0
+
+        new = depth.astype(np.float32)
+        valid = new > 0
+        close = valid & (state > 0) & (np.abs(new - state) < self.delta)
+        blended = np.where(close, state + self.alpha * (new - state), new)
+        keep = ~valid & (state > 0) & (missing < self.persistence)
+
+        state[update] = np.where(valid, blended, np.where(keep, state, 0.0))[update]
+        missing[update] = np.where(valid, 0, missing + 1)[update]
+        return state.astype(depth.dtype)
+
+
+class HoleFillingFilter:
+    "Fill zero depth from the neighbourhood, 'farthest' like librealsense's default or 'nearest'"
+    def __init__(self, mode='farthest', iterations=2):
+        self.mode = mode
+        self.iterations = iterations
+        self.kernel = np.ones((3, 3), np.uint8)
+
+    def apply(self, depth, box, shape, update, entered):
+        filled = depth.copy()
+        for _ in range(self.iterations):
+            holes = filled == 0
+            if not np.any(holes):
+                break
+            if self.mode == 'nearest':
+                # min over non zero neighbours: erode with holes pushed to the max value
+                lifted = np.where(holes, np.iinfo(depth.dtype).max, filled).astype(depth.dtype)
+                neighbour = cv2.erode(lifted, self.kernel)
+                neighbour[neighbour == np.iinfo(depth.dtype).max] = 0
+            else:
+                neighbour = cv2.dilate(filled, self.kernel)
+            filled[holes] = neighbour[holes]
+        return filled
+
+
+class DepthFilterChain:
+    "numpy/OpenCV depth filters on a Frame, on the whole image or only inside ROIs"
+    def __init__(self, names=('spatial', 'temporal', 'hole_filling'), roi_only=True, padding=ROI_PADDING):
+        factories = {
+            'spatial': SpatialFilter,
+            'temporal': TemporalFilter,
+            'hole_filling': HoleFillingFilter,
+        }
+        self.filters = [(name, factories[name]()) for name in names]
+        self.roi_only = roi_only
+        self.padding = padding
+        self.costs = FilterCosts(names)
+        self.previous = None    # pixels filtered in the previous frame
+        self.current = None     # pixels filtered so far in this frame, frame.depth_filtered
+
+    def process(self, frame, pixel_groups=None):
+        "Filter frame.depth_image in place, inside the padded boxes around pixel_groups or everywhere"
+        height, width = frame.depth_image.shape
+        if frame.depth_filtered is None:
+            # first touch this frame, the buffer may belong to the camera or a recording
+            frame.depth_image = frame.depth_image.copy()
+            frame.depth_filtered = np.zeros((height, width), dtype=bool)
+            self.costs.next_frame()
+            same_shape = self.current is not None and self.current.shape == (height, width)
+            self.previous = self.current if same_shape else np.zeros((height, width), dtype=bool)
+            self.current = frame.depth_filtered
+
+        if pixel_groups is None:
+            boxes = [(0, 0, width, height)]
+        else:
+            boxes = merge_boxes([self.box(group, width, height) for group in pixel_groups if len(group)])
+
+        for box in boxes:
+            x0, y0, x1, y1 = box
+            # every pixel is filtered once per frame, even where regions of two calls overlap
+            update = ~frame.depth_filtered[y0:y1, x0:x1]
+            if not np.any(update):
+                continue
+            entered = update & ~self.previous[y0:y1, x0:x1]
+            crop = frame.depth_image[y0:y1, x0:x1]
+            for name, depth_filter in self.filters:
+                t0 = time.perf_counter()
+                crop[update] = depth_filter.apply(crop, box, frame.depth_image.shape, update, entered)[update]
+                self.costs.add(name, (time.perf_counter() - t0) * 1000.0)
+            frame.depth_filtered[y0:y1, x0:x1] = True
+
+    def box(self, pixels, width, height):
+        pixels = np.asarray(pixels).reshape(-1, 2)
+        x0, y0 = np.floor(pixels.min(axis=0)).astype(int) - self.padding
+        x1, y1 = np.ceil(pixels.max(axis=0)).astype(int) + self.padding + 1
+        return (max(x0, 0), max(y0, 0), min(x1, width), min(y1, height))
+
+
+def merge_boxes(boxes):
+    "Union overlapping boxes so no pixel is filtered twice"
+    boxes = [b for b in boxes if b[2] > b[0] and b[3] > b[1]]
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            for i, other in enumerate(result):
+                if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                    result[i] = (min(box[0], other[0]), min(box[1], other[1]),
+                                 max(box[2], other[2]), max(box[3], other[3]))
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return boxes
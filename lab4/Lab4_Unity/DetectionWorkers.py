@@ -0,0 +1,203 @@
+# LAB4
+
+'''
+Detection worker processes.
+Each frame is written once into a multiprocessing.shared_memory slot and the
+workers map the same memory as numpy arrays, so only (slot, frame number)
+travels through the task queues. Results come back tagged with the frame
+number and are joined per frame in the main process, together with the Frame
+they belong to, so the caller draws and timestamps that frame and not the one
+it just submitted.
+Region depth filters (DepthFilterChain with roi_only) run where the depth is
+read and keep temporal state, which the workers cannot share; frames filtered
+as a whole before they are submitted work.
+'''
+import multiprocessing
+from multiprocessing import shared_memory
+import queue
+from collections import namedtuple
+import numpy as np
+
+from FrameSource import Frame, intrinsics_to_array, intrinsics_from_array
+
+KINDS = ('pose', 'aruco')
+# the part of a Holistic result the pose worker sends back for drawing, the whole result does not pickle
+PoseLandmarks = namedtuple('PoseLandmarks', ('face_landmarks', 'pose_landmarks'))
+
+
+def worker_main(kind, slot_names, color_shape, depth_shape, intrinsics_values, depth_scale, aruco_options, smoothing,
+                tasks, results):
+    "Worker process loop, runs one detector on frames read straight from shared memory"
+    # imported here, MediaPipeClient imports this module; MediaPipe itself only loads in create_mediapipe,
+    # so the aruco worker never loads it
+    from MediaPipeClient import detect_pose, detect_aruco, create_aruco_detector, create_mediapipe
+
+    if kind == 'pose':
+        mp = create_mediapipe(smoothing)
+
+        def detect(frame):
+            skeleton_points, detection_results = detect_pose(frame, mp)
+            return skeleton_points, PoseLandmarks(detection_results.face_landmarks, detection_results.pose_landmarks)
+        empty = (np.empty((0, 3)), PoseLandmarks(None, None))
+    else:
+        arucoDetector = create_aruco_detector(**aruco_options)
+        detect = lambda frame: detect_aruco(frame, arucoDetector)
+        empty = ({}, (), None)
+
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    color_nbytes = int(np.prod(color_shape))
+    colors = [np.ndarray(color_shape, np.uint8, buffer=s.buf) for s in slots]
+    depths = [np.ndarray(depth_shape, np.uint16, buffer=s.buf, offset=color_nbytes) for s in slots]
+    intrinsics = intrinsics_from_array(intrinsics_values)
+
+    # tell the pool the detector is loaded
+    results.put((None, kind, None))
+
+    frame = None
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, number, timestamp = task
+            frame = Frame(number, timestamp, colors[slot], depths[slot], intrinsics, depth_scale)
+            try:
+                result = detect(frame)
+            except Exception as e:
+                # always answer, otherwise the frame never joins and its slot leaks
+                print(f"{kind} worker error on frame {number}:", e, flush=True)
+                result = empty
+            results.put((number, kind, result))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # views have to go before the shared memory can be closed
+        del frame, colors, depths
+        for s in slots:
+            s.close()
+
+
+class DetectionPool:
+    "Pose and aruco worker processes fed through shared memory frame slots"
+    def __init__(self, pose_workers=1, slot_count=4, aruco_options=None, smoothing='none'):
+        self.pose_workers = pose_workers
+        self.slot_count = slot_count
+        self.aruco_options = aruco_options or {}  # create_aruco_detector arguments for the aruco worker
+        self.smoothing = smoothing          # joint filter per pose worker, only continuous with one worker
+        self.context = multiprocessing.get_context('spawn')
+        self.started = False
+        self.pending = {}       # frame number -> slot and results that arrived so far
+        self.completed = {}     # frame number -> fully joined results
+        self.dropped = 0
+
+    def start(self, frame):
+        "Allocate slots for frames shaped like this one and launch the workers"
+        if frame.aligner is not None:
+            raise ValueError("detection workers need color aligned depth, use full alignment")
+        if frame.depth_filter is not None and frame.depth_filtered is None:
+            raise ValueError("detection workers cannot run region depth filters, filter the full frame")
+        color_shape = frame.color_image.shape
+        depth_shape = frame.depth_image.shape
+        color_nbytes = frame.color_image.nbytes
+        size = color_nbytes + frame.depth_image.nbytes
+
+        self.slots = [shared_memory.SharedMemory(create=True, size=size) for _ in range(self.slot_count)]
+        self.colors = [np.ndarray(color_shape, np.uint8, buffer=s.buf) for s in self.slots]
+        self.depths = [np.ndarray(depth_shape, np.uint16, buffer=s.buf, offset=color_nbytes) for s in self.slots]
+        self.free_slots = list(range(self.slot_count))
+
+        self.tasks = {kind: self.context.Queue() for kind in KINDS}
+        self.results = self.context.Queue()
+
+        slot_names = [s.name for s in self.slots]
+        intrinsics_values = intrinsics_to_array(frame.intrinsics)
+        self.processes = []
+        for kind in ['pose'] * self.pose_workers + ['aruco']:
+            process = self.context.Process(
+                target=worker_main,
+                args=(kind, slot_names, color_shape, depth_shape, intrinsics_values,
+                      frame.depth_scale, self.aruco_options, self.smoothing, self.tasks[kind], self.results),
+                daemon=True)
+            process.start()
+            self.processes.append((kind, process))
+
+        # model loading takes seconds, wait for it so the first frames are not dropped
+        try:
+            for _ in self.processes:
+                self.results.get(timeout=60.0)
+        except queue.Empty:
+            # a worker died or hangs while loading, stop() would not clean up a pool that never started
+            print("detection pool: a worker did not get ready, stopping the workers", flush=True)
+            for _, process in self.processes:
+                process.terminate()
+                process.join(timeout=2.0)
+            del self.colors, self.depths
+            for s in self.slots:
+                s.close()
+                s.unlink()
+            raise
+        self.started = True
+
+    def stop(self):
+        if not self.started:
+            return
+        for kind, _ in self.processes:
+            self.tasks[kind].put(None)
+        for _, process in self.processes:
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.terminate()
+        del self.colors, self.depths
+        for s in self.slots:
+            s.close()
+            s.unlink()
+        self.started = False
+        print(f"detection pool: {self.dropped} frames dropped with all slots busy", flush=True)
+
+    def submit(self, frame, block=False):
+        "Publish the frame to the workers, returns False if it was dropped because every slot is busy"
+        if not self.started:
+            self.start(frame)
+        self.collect()
+        while not self.free_slots:
+            if not block:
+                self.dropped += 1
+                return False
+            self.collect(timeout=1.0)
+
+        slot = self.free_slots.pop()
+        self.colors[slot][...] = frame.color_image
+        self.depths[slot][...] = frame.depth_image
+        self.pending[frame.number] = {'slot': slot, 'frame': frame}
+        for kind in KINDS:
+            self.tasks[kind].put((slot, frame.number, frame.timestamp))
+        return True
+
+    def collect(self, timeout=None):
+        "Join worker results by frame number and free the slots of finished frames"
+        while True:
+            try:
+                if timeout is None:
+                    number, kind, result = self.results.get_nowait()
+                else:
+                    number, kind, result = self.results.get(timeout=timeout)
+                    timeout = None
+            except queue.Empty:
+                return
+
+            entry = self.pending[number]
+            entry[kind] = result
+            if all(k in entry for k in KINDS):
+                del self.pending[number]
+                self.free_slots.append(entry['slot'])
+                entry['number'] = number
+                self.completed[number] = entry
+
+    def latest(self):
+        "Newest fully joined frame or None, older joined frames are stale and discarded; 'frame' is the submitted Frame"
+        self.collect()
+        if not self.completed:
+            return None
+        entry = self.completed[max(self.completed)]
+        self.completed.clear()
+        return entry
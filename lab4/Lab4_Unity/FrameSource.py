@@ -0,0 +1,484 @@
+# LAB4
+
+'''
+Frame sources for the tracking loops.
+A source yields Frame objects (color + z16 depth + intrinsics) so the
+detection code runs the same whether the frames come from the live camera,
+a recorded RealSense .bag file or a NumPy .npz dump.
+'''
+import time
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+import numpy as np
+import pyrealsense2 as rs
+
+from Deprojection import get_deprojector
+from SparseAlignment import SparseAligner
+from DepthFilters import RealSenseFilterChain, DepthFilterChain
+from Tracing import tracer
+
+# name -> ((depth width, height, fps), (color width, height, fps))
+STREAM_PROFILES = {
+    '640x480@30': ((640, 480, 30), (640, 480, 30)),
+    '640x480@60': ((640, 480, 60), (640, 480, 60)),
+    '848x480@90': ((848, 480, 90), (848, 480, 60)),    # D400 rgb tops out at 60 here
+    '424x240@90': ((424, 240, 90), (424, 240, 60)),
+    '1280x720@30': ((1280, 720, 30), (1280, 720, 30)),
+}
+DEFAULT_PROFILE = '640x480@30'
+
+# profiles to try per camera product line, fastest first
+PRODUCT_LINE_PROFILES = {
+    'D400': ['848x480@90', '640x480@60', '640x480@30'],
+    'D500': ['848x480@90', '640x480@60', '640x480@30'],
+    'L500': ['640x480@30'],
+    'SR300': ['640x480@60', '640x480@30'],
+}
+
+
+class Frame:
+    "Coherent color + depth pair with the metadata the detection path needs"
+    def __init__(self, number, timestamp, color_image, depth_image, intrinsics, depth_scale,
+                 aligner=None, system_time=False):
+        self.number = number                # camera frame number
+        self.timestamp = timestamp          # sensor timestamp in ms
+        self.system_time = system_time      # timestamp is on the host clock, comparable to time.time()
+        self.arrival_time = time.time()     # when the frame reached us, the capture time of replays
+        self.color_image = color_image
+        self.depth_image = depth_image      # z16, aligned to color unless an aligner is set
+        self.intrinsics = intrinsics        # color intrinsics
+        self.depth_scale = depth_scale      # meters per depth unit
+        self.aligner = aligner              # SparseAligner when depth_image is the raw depth stream
+        self.depth_filter = None            # DepthFilterChain waiting for the regions detection reads
+        self.depth_filtered = None          # (H,W) bool, pixels the depth filter already ran on this frame
+
+    def capture_time(self):
+        "Capture time in time.time() seconds, the arrival time for replays and when the camera clock is not the host clock"
+        if self.system_time:
+            return self.timestamp / 1000.0
+        return self.arrival_time
+
+    def filter_rois(self, pixel_groups):
+        "Run the pending depth filters around these pixel groups before their depth is read"
+        if self.depth_filter is None:
+            return
+        if self.aligner is not None:
+            # color pixel regions do not map onto the raw depth image, filter all of it
+            pixel_groups = None
+        self.depth_filter.process(self, pixel_groups)
+
+    def aligned_depth(self, pixels):
+        "(N,2) color pixels -> (N,) color aligned depth in meters"
+        pixels = np.asarray(pixels).reshape(-1, 2)
+        if self.aligner is not None:
+            return self.aligner.depth_at(pixels, self.depth_image)
+        return get_deprojector(self.intrinsics, self.depth_scale).depth_at(pixels, self.depth_image)[0]
+
+    def get_distance(self, x, y):
+        "Depth in meters at pixel (x, y), same as depth_frame.get_distance"
+        if self.aligner is not None:
+            return float(self.aligned_depth([[x, y]])[0])
+        return float(self.depth_image[y, x]) * self.depth_scale
+
+    def deproject(self, pixels):
+        "(N,2) pixels -> (N,3) points in meters in one pass, z == 0 where depth is missing"
+        pixels = np.asarray(pixels).reshape(-1, 2)
+        depth = self.aligned_depth(pixels)
+        return get_deprojector(self.intrinsics, self.depth_scale).deproject_depth(pixels, depth)
+
+
+class FrameSource(ABC):
+    "Base class, iterate over a started source to get frames until it runs out"
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    @abstractmethod
+    def read(self):
+        "Return the next Frame or None when the source is exhausted"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def __iter__(self):
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+
+class RealSenseSource(FrameSource):
+    "Live camera, or a recorded .bag file when bag_path is given"
+    def __init__(self, bag_path=None, real_time=True, profile=None, align='full', rs_filters=None):
+        self.bag_path = bag_path
+        self.real_time = real_time
+        self.profile = profile      # STREAM_PROFILES name, None picks by product line
+        self.align_mode = align     # 'full' runs rs.align, 'sparse' aligns only the pixels we query
+        self.rs_filters = RealSenseFilterChain(rs_filters) if rs_filters else None
+        self.pipeline = rs.pipeline()
+        self.config = rs.config()
+
+        if bag_path is not None:
+            # replay whatever streams were recorded
+            self.config.enable_device_from_file(bag_path, repeat_playback=False)
+
+        self.align = rs.align(rs.stream.color)
+        self.intrinsics = None
+        self.depth_scale = None
+        self.aligner = None
+
+    def start(self):
+        if self.bag_path is None:
+            pipeline_wrapper = rs.pipeline_wrapper(self.pipeline)
+            device = self.config.resolve(pipeline_wrapper).get_device()
+            found_rgb = False
+            for s in device.sensors:
+                if s.get_info(rs.camera_info.name) == 'RGB Camera':
+                    found_rgb = True
+                    break
+            if not found_rgb:
+                print("[main] The demo requires Depth camera with Color sensor")
+                exit(0)
+            self.profile = self.negotiate_profile(device, pipeline_wrapper)
+
+        profile = self.pipeline.start(self.config)
+        device = profile.get_device()
+        if self.bag_path is not None:
+            # real_time=False lets playback run as fast as we consume frames
+            device.as_playback().set_real_time(self.real_time)
+        self.depth_scale = device.first_depth_sensor().get_depth_scale()
+
+    def negotiate_profile(self, device, pipeline_wrapper):
+        "Enable the requested profile, or the fastest one the camera supports"
+        product_line = str(device.get_info(rs.camera_info.product_line))
+        candidates = list(PRODUCT_LINE_PROFILES.get(product_line, []))
+        if self.profile is not None:
+            candidates.insert(0, self.profile)
+        candidates.append(DEFAULT_PROFILE)
+
+        for name in candidates:
+            (depth_w, depth_h, depth_fps), (color_w, color_h, color_fps) = STREAM_PROFILES[name]
+            self.config.disable_all_streams()
+            self.config.enable_stream(rs.stream.depth, depth_w, depth_h, rs.format.z16, depth_fps)
+            self.config.enable_stream(rs.stream.color, color_w, color_h, rs.format.bgr8, color_fps)
+            if self.config.can_resolve(pipeline_wrapper):
+                if self.profile is not None and name != self.profile:
+                    print(f"[main] {self.profile} not supported by this {product_line}, using {name}", flush=True)
+                print(f"[main] {product_line} streaming {name}", flush=True)
+                return name
+        raise RuntimeError(f"no supported stream profile for {product_line}")
+
+    def stop(self):
+        self.pipeline.stop()
+        if self.rs_filters is not None:
+            self.rs_filters.costs.report()
+
+    def read(self):
+        while True:
+            with tracer.stage('wait_for_frames'):
+                if self.bag_path is None:
+                    frames = self.pipeline.wait_for_frames()
+                else:
+                    success, frames = self.pipeline.try_wait_for_frames(1000)
+            if self.bag_path is not None and not success:
+                return None
+
+            if self.rs_filters is not None:
+                frames = self.rs_filters.process(frames)
+
+            if self.align_mode == 'sparse':
+                depth_frame = frames.get_depth_frame()
+                color_frame = frames.get_color_frame()
+            else:
+                with tracer.stage('align'):
+                    aligned_frames = self.align.process(frames)
+                depth_frame = aligned_frames.get_depth_frame()
+                color_frame = aligned_frames.get_color_frame()
+            if not depth_frame or not color_frame:
+                continue
+
+            # intrinsics and extrinsics never change while streaming
+            if self.intrinsics is None:
+                self.setup_profiles(depth_frame, color_frame)
+
+            return Frame(
+                color_frame.get_frame_number(),
+                color_frame.get_timestamp(),
+                np.asanyarray(color_frame.get_data()),
+                np.asanyarray(depth_frame.get_data()),
+                self.intrinsics,
+                self.depth_scale,
+                self.aligner,
+                # a .bag keeps the global time of the recording, only a live camera is on the host clock now
+                self.bag_path is None and color_frame.get_frame_timestamp_domain() != rs.timestamp_domain.hardware_clock)
+
+    def setup_profiles(self, depth_frame, color_frame):
+        color_profile = color_frame.profile.as_video_stream_profile()
+        if self.align_mode == 'sparse':
+            depth_profile = depth_frame.profile.as_video_stream_profile()
+            self.aligner = SparseAligner(
+                depth_profile.get_intrinsics(),
+                color_profile.get_intrinsics(),
+                depth_profile.get_extrinsics_to(color_profile),
+                color_profile.get_extrinsics_to(depth_profile),
+                self.depth_scale)
+        # aligned depth shares the color intrinsics
+        self.intrinsics = color_profile.get_intrinsics()
+
+
+class NumpySource(FrameSource):
+    "Replay an .npz dump written by record_numpy"
+    def __init__(self, path, real_time=False):
+        self.path = path
+        self.real_time = real_time
+        self.index = 0
+
+    def start(self):
+        data = np.load(self.path)
+        self.color = data['color']
+        self.depth = data['depth']
+        self.timestamps = data['timestamps']
+        self.numbers = data['numbers']
+        self.depth_scale = float(data['depth_scale'])
+        self.intrinsics = intrinsics_from_array(data['intrinsics'])
+        self.index = 0
+        self.replay_start = None
+
+    def read(self):
+        if self.index >= len(self.color):
+            return None
+        i = self.index
+        self.index += 1
+
+        if self.real_time:
+            # pace playback by the recorded timestamps
+            if self.replay_start is None:
+                self.replay_start = time.perf_counter()
+            due = self.replay_start + (self.timestamps[i] - self.timestamps[0]) / 1000.0
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        return Frame(int(self.numbers[i]), float(self.timestamps[i]),
+                     self.color[i], self.depth[i], self.intrinsics, self.depth_scale)
+
+
+class ThreadedSource(FrameSource):
+    "Capture another source on its own thread, read() always returns the newest frame"
+    def __init__(self, source, buffer_size=2):
+        self.source = source
+        self.buffer = deque(maxlen=buffer_size)  # small ring, oldest frame falls out
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.finished = False
+        self.captured = 0
+        self.consumed = 0
+        self.dropped = 0
+
+    def start(self):
+        self.source.start()
+        self.running = True
+        self.finished = False
+        self.thread = threading.Thread(target=self.capture_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+        self.source.stop()
+        print(f"capture: {self.captured} captured, {self.consumed} processed, "
+              f"{self.dropped} dropped", flush=True)
+
+    def capture_loop(self):
+        try:
+            while self.running:
+                frame = self.source.read()
+                if frame is None:
+                    break
+                with self.condition:
+                    if len(self.buffer) == self.buffer.maxlen:
+                        self.dropped += 1
+                    self.buffer.append(frame)
+                    self.captured += 1
+                    self.condition.notify()
+        except RuntimeError as e:
+            # wait_for_frames raises once the pipeline is stopped underneath it
+            if self.running:
+                print("capture error:", e, flush=True)
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def read(self):
+        with self.condition:
+            while not self.buffer and not self.finished:
+                self.condition.wait()
+            if not self.buffer:
+                return None
+            frame = self.buffer.pop()
+            # everything older than the newest frame is stale
+            self.dropped += len(self.buffer)
+            self.buffer.clear()
+            self.consumed += 1
+            return frame
+
+    def stats(self):
+        with self.condition:
+            return {'captured': self.captured, 'consumed': self.consumed, 'dropped': self.dropped}
+
+
+class FilteredSource(FrameSource):
+    "Attach a DepthFilterChain to every frame, run at once or when detection asks for its regions"
+    def __init__(self, source, chain):
+        self.source = source
+        self.chain = chain
+
+    def start(self):
+        self.source.start()
+
+    def stop(self):
+        self.source.stop()
+        self.chain.costs.report()
+
+    def read(self):
+        frame = self.source.read()
+        if frame is None:
+            return None
+        frame.depth_filter = self.chain
+        if not self.chain.roi_only:
+            frame.filter_rois(None)
+        return frame
+
+
+def intrinsics_to_array(intrinsics):
+    "Flatten rs.intrinsics so it can be stored in an .npz"
+    return np.array([intrinsics.width, intrinsics.height,
+                     intrinsics.ppx, intrinsics.ppy,
+                     intrinsics.fx, intrinsics.fy,
+                     int(intrinsics.model)] + list(intrinsics.coeffs), dtype=np.float64)
+
+
+def intrinsics_from_array(values):
+    "Inverse of intrinsics_to_array"
+    intrinsics = rs.intrinsics()
+    intrinsics.width = int(values[0])
+    intrinsics.height = int(values[1])
+    intrinsics.ppx = float(values[2])
+    intrinsics.ppy = float(values[3])
+    intrinsics.fx = float(values[4])
+    intrinsics.fy = float(values[5])
+    intrinsics.model = rs.distortion(int(values[6]))
+    intrinsics.coeffs = [float(c) for c in values[7:12]]
+    return intrinsics
+
+
+def record_numpy(source, path, count):
+    "Dump count frames of a started source into an .npz file"
+    frames = []
+    for frame in source:
+        frames.append(frame)
+        if len(frames) >= count:
+            break
+    if not frames:
+        raise ValueError("source produced no frames")
+    if frames[0].aligner is not None:
+        raise ValueError("record with full alignment, dumps store color aligned depth")
+
+    np.savez_compressed(
+        path,
+        color=np.stack([f.color_image for f in frames]),
+        depth=np.stack([f.depth_image for f in frames]),
+        timestamps=np.array([f.timestamp for f in frames]),
+        numbers=np.array([f.number for f in frames]),
+        depth_scale=frames[0].depth_scale,
+        intrinsics=intrinsics_to_array(frames[0].intrinsics))
+    print(f"recorded {len(frames)} frames to {path}", flush=True)
+
+
+def open_source(path=None, real_time=True, align='full', profile=None, rs_filters=None,
+                depth_filters=None, filter_full_frame=False):
+    "Live camera for None, otherwise pick the source from the file extension"
+    if path is None:
+        source = RealSenseSource(profile=profile, align=align, rs_filters=rs_filters)
+    elif path.endswith('.bag'):
+        source = RealSenseSource(bag_path=path, real_time=real_time, align=align, rs_filters=rs_filters)
+    elif path.endswith('.npz'):
+        source = NumpySource(path, real_time=real_time)
+    else:
+        raise ValueError(f"unsupported frame source: {path}")
+
+    if depth_filters:
+        source = FilteredSource(source, DepthFilterChain(depth_filters, roi_only=not filter_full_frame))
+    return source
+
+
+def benchmark(source, process, max_frames=None):
+    "Push every frame of a started source through process(frame) as fast as possible"
+    latencies = []
+    ages = []
+    start = time.perf_counter()
+    for frame in source:
+        tracer.frame(frame)
+        t0 = time.perf_counter()
+        process(frame)
+        latencies.append(time.perf_counter() - t0)
+        if frame.system_time:
+            # sensor timestamp to processed, only meaningful for live frames
+            ages.append(time.time() * 1000.0 - frame.timestamp)
+        if max_frames is not None and len(latencies) >= max_frames:
+            break
+    elapsed = time.perf_counter() - start
+
+    if not latencies:
+        print("benchmark: no frames", flush=True)
+        return None
+
+    latencies_ms = np.array(latencies) * 1000.0
+    report = {
+        'frames': len(latencies),
+        'fps': len(latencies) / elapsed,
+        'latency_mean_ms': float(np.mean(latencies_ms)),
+        'latency_p50_ms': float(np.percentile(latencies_ms, 50)),
+        'latency_p95_ms': float(np.percentile(latencies_ms, 95)),
+        'latency_max_ms': float(np.max(latencies_ms)),
+    }
+    print(f"benchmark: {report['frames']} frames, {report['fps']:.1f} frames/s, "
+          f"latency mean {report['latency_mean_ms']:.2f} ms, "
+          f"p50 {report['latency_p50_ms']:.2f} ms, "
+          f"p95 {report['latency_p95_ms']:.2f} ms, "
+          f"max {report['latency_max_ms']:.2f} ms", flush=True)
+
+    if ages:
+        report['end_to_end_mean_ms'] = float(np.mean(ages))
+        report['end_to_end_p95_ms'] = float(np.percentile(ages, 95))
+        print(f"benchmark: sensor to processed mean {report['end_to_end_mean_ms']:.2f} ms, "
+              f"p95 {report['end_to_end_p95_ms']:.2f} ms", flush=True)
+    return report
+
+
+def benchmark_profiles(process, names=None, max_frames=300, align='full'):
+    "Run the live camera through process(frame) once per stream profile and compare"
+    reports = {}
+    for name in names or list(STREAM_PROFILES):
+        source = RealSenseSource(profile=name, align=align)
+        source.start()
+        try:
+            if source.profile != name:
+                print(f"benchmark: skipping {name}, camera fell back to {source.profile}", flush=True)
+                continue
+            print(f"benchmark: profile {name}", flush=True)
+            reports[name] = benchmark(source, process, max_frames)
+        finally:
+            source.stop()
+    return reports
@@ -0,0 +1,127 @@
+# LAB4
+
+'''
+Length prefixed message framing between the clients and the Unity server.
+TCP is a byte stream: one recv can return half a message or several of them,
+so json.loads on whatever recv returned fails as soon as the message rate goes
+up. Every message is sent as a 4 byte little endian payload length followed
+by the UTF-8 JSON payload (Server.cs ReadFrame / WriteFrame do the same).
+An empty frame is a keepalive (UnityLink.py) and carries no message.
+FrameDecoder receives straight into one reusable bytearray and hands out
+memoryview slices of the complete frames, so partial frames wait for the next
+read and several frames per read are all returned, without copying bytes.
+'''
+import json
+import select
+import struct
+
+HEADER = struct.Struct('<I')
+MAX_FRAME = 1 << 20         # bytes, a longer length means the stream is out of sync
+
+
+def encode_frame(payload):
+    "Header and payload in one bytes object, so they leave in one send"
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    "Incremental decoder over a reusable receive buffer"
+    def __init__(self, capacity=8192):
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.start = 0          # first byte not yet decoded
+        self.end = 0            # first free byte
+
+    def recv_into(self, sock):
+        "Receive whatever the socket has into the free space, return the byte count (0 when closed)"
+        if len(self.buffer) - self.end < len(self.buffer) // 4:
+            self.make_room(len(self.buffer) // 4)
+        count = sock.recv_into(self.view[self.end:])
+        self.end += count
+        return count
+
+    def feed(self, data):
+        "Append bytes that did not come from recv_into, e.g. the payload of a datagram"
+        if self.end + len(data) > len(self.buffer):
+            self.make_room(len(data))
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def make_room(self, size):
+        "Free space for size more bytes: move the undecoded bytes to the front, grow only if that is not enough"
+        pending = self.end - self.start
+        capacity = len(self.buffer)
+        while capacity - pending < size:
+            capacity *= 2
+        if capacity == len(self.buffer):
+            self.view[:pending] = self.view[self.start:self.end]
+        else:
+            buffer = bytearray(capacity)
+            buffer[:pending] = self.view[self.start:self.end]
+            self.buffer, self.view = buffer, memoryview(buffer)
+        self.start, self.end = 0, pending
+
+    def next_frame(self):
+        "Payload of the next complete frame as a memoryview, None while it is incomplete"
+        available = self.end - self.start
+        if available < HEADER.size:
+            return None
+        length, = HEADER.unpack_from(self.buffer, self.start)
+        if length > MAX_FRAME:
+            raise ValueError(f"frame of {length} bytes, the stream is out of sync")
+        if available < HEADER.size + length:
+            if self.start + HEADER.size + length > len(self.buffer):
+                # the rest of the frame has to fit behind what is already buffered
+                self.make_room(HEADER.size + length - available)
+            return None
+        payload = self.view[self.start + HEADER.size:self.start + HEADER.size + length]
+        self.start += HEADER.size + length
+        return payload
+
+
+class FramedConnection:
+    "JSON messages over a connected TCP socket, one frame each"
+    def __init__(self, sock):
+        self.sock = sock
+        self.decoder = FrameDecoder()
+
+    def fill(self):
+        if self.decoder.recv_into(self.sock) == 0:
+            raise ConnectionError("server closed the connection")
+
+    def receive(self):
+        "Next message; a non-blocking socket raises BlockingIOError while no complete frame is buffered"
+        while True:
+            frame = self.decoder.next_frame()
+            if frame is None:
+                self.fill()
+            elif len(frame):
+                # the payload view is only valid until the next read, decode it right away
+                return json.loads(str(frame, 'utf-8'))
+
+    def poll(self):
+        "Every complete message that arrived so far, without blocking"
+        messages = []
+        while True:
+            frame = self.decoder.next_frame()
+            if frame is not None:
+                if len(frame):
+                    messages.append(json.loads(str(frame, 'utf-8')))
+            elif select.select([self.sock], [], [], 0)[0]:
+                self.fill()
+            else:
+                return messages
+
+    def receive_frame(self):
+        "Next frame as bytes, for payloads that are not JSON"
+        while True:
+            frame = self.decoder.next_frame()
+            if frame is not None:
+                return bytes(frame)
+            self.fill()
+
+    def send(self, msg):
+        self.send_frame(json.dumps(msg).encode('utf-8'))
+
+    def send_frame(self, payload):
+        self.sock.sendall(encode_frame(payload))
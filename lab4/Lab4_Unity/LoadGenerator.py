@@ -0,0 +1,159 @@
+# LAB4
+
+'''
+End-to-end load test: the lab2 client against the stand-in server in one process.
+Detections are published into Client.snapshots the way the camera thread
+does, either synthetic markers moving on circles or the detections of a
+recording replayed at --rate. Marker PROBE_ID carries the snapshot sequence
+in its x coordinate, so every message the server applies says which
+detection it carries; latency is published -> applied by the server, on one
+clock. The client runs unfiltered (no smoothing, no prediction) so the probe
+arrives unchanged.
+    python LoadGenerator.py [--seconds 10] [--rate 60] [--markers 8] [--source rec.npz]
+                            [--wire-format binary] [--transport udp] [--delta] [--max-rate 30]
+                            [--delay 0] [--stall 0 --stall-every 0] [--inject-loss 0 --inject-reorder 0]
+'''
+import time
+import argparse
+import threading
+import numpy as np
+
+import Client
+from Tracks import TrackTable
+from Deltas import DeltaEncoder
+from FrameSource import open_source
+from Tracing import tracer
+from StandInServer import StandInServer, ANCHOR_SETS, LISTS
+
+PROBE_ID = 999
+CALIBRATION_TIMEOUT = 10.0  # seconds
+
+
+def synthetic_detections(markers=8, anchor_ids=ANCHOR_SETS['lab2'], rate=60.0, seed=0):
+    "Endless (coordinates, rotations) frames: fixed calibration markers plus markers moving on circles"
+    rng = np.random.default_rng(seed)
+    anchors = {anchor_id: (0.2 * i - 0.2, 0.1 * (i % 2), 1.5 + 0.05 * i) for i, anchor_id in enumerate(anchor_ids)}
+    ids = [100 + i for i in range(markers)]
+    centers = rng.uniform([-0.4, -0.3, 1.2], [0.4, 0.3, 1.8], size=(markers, 3))
+    speeds = rng.uniform(0.5, 2.0, size=markers)   # radians per second
+    frame = 0
+    while True:
+        angle = speeds * frame / rate
+        points = centers + 0.05 * np.stack([np.cos(angle), np.sin(angle), np.zeros(markers)], axis=1)
+        coordinates = {**anchors, **{marker_id: point.tolist() for marker_id, point in zip(ids, points)}}
+        # a rotation about z, as MarkerPose.py would report it
+        rotations = {marker_id: [0.0, 0.0, float(np.sin(a / 2)), float(np.cos(a / 2))] for marker_id, a in zip(ids, angle)}
+        yield coordinates, rotations
+        frame += 1
+
+
+def replayed_detections(path):
+    "Endless (coordinates, rotations) frames: the visible tracks of a recording, detected once and looped"
+    detector = Client.create_aruco_detector()
+    tracks = TrackTable()
+    frames = []
+    with open_source(path, real_time=False) as source:
+        for frame_number, frame in enumerate(source):
+            coordinates, rotations, _, _ = Client.detect_markers(frame, detector)
+            tracks.update(frame_number, coordinates, rotations)
+            frames.append(tracks.visible())
+    print(f"replaying {len(frames)} frames of {path}", flush=True)
+    while True:
+        yield from frames
+
+
+def percentiles(samples):
+    "p50, p90, p99 and max of the samples in milliseconds"
+    if not samples:
+        return "no samples"
+    p50, p90, p99 = np.percentile(samples, [50, 90, 99]) * 1000
+    return f"p50 {p50:.2f} ms, p90 {p90:.2f} ms, p99 {p99:.2f} ms, max {max(samples) * 1000:.2f} ms"
+
+
+def run_load(detections, seconds=10.0, rate=60.0, wire_format='json', delta=False, max_rate=Client.MAX_SEND_RATE,
+             datagram_options=None, server_options=None):
+    "Drive the client with detections at rate for seconds after calibration, return the latency samples in seconds"
+    published = {}          # snapshot sequence -> perf_counter when it was published
+    latencies = []
+    newest = [0]            # newest probe sequence the server applied
+
+    def applied(message, received):
+        probe = message[LISTS['lab2'][0]].get(PROBE_ID)
+        if probe is None:
+            return
+        sequence = int(round(probe[0][0]))
+        # a repeat or an older message carries nothing new
+        if sequence > newest[0] and sequence in published:
+            newest[0] = sequence
+            latencies.append(time.perf_counter() - published[sequence])
+
+    server = StandInServer('lab2', host=Client.HOST, port=Client.PORT, on_message=applied, **(server_options or {})).start()
+    delta_encoder = DeltaEncoder() if delta else None
+    client = threading.Thread(target=Client.socket_client, args=(None, None, max_rate, wire_format, delta_encoder, datagram_options),
+                              daemon=True)
+    client.start()
+
+    def publish(until):
+        interval = 1.0 / rate
+        next_time = time.perf_counter()
+        count = 0
+        while time.perf_counter() < until():
+            coordinates, rotations = next(detections)
+            sequence = Client.snapshots.latest().sequence + 1
+            coordinates = {**coordinates, PROBE_ID: [float(sequence), 0.0, 1.0]}
+            published[sequence] = time.perf_counter()
+            Client.snapshots.publish(coordinates, rotations, time.time())
+            count += 1
+            next_time += interval
+            time.sleep(max(next_time - time.perf_counter(), 0))
+        return count
+
+    # calibration needs the anchors to be detected, keep publishing until the server saw the reply
+    deadline = time.perf_counter() + CALIBRATION_TIMEOUT
+    publish(lambda: deadline if not (server.calibrated and server.messages > 1) else 0)
+    if not server.calibrated:
+        print("the client did not calibrate, are the anchor markers in the detections?", flush=True)
+        server.stop()
+        return latencies
+
+    del latencies[:]
+    messages, bytes_received = server.messages, server.bytes
+    start = time.perf_counter()
+    count = publish(lambda: start + seconds)
+    elapsed = time.perf_counter() - start
+    time.sleep(0.2)     # let the last messages land
+    messages, bytes_received = server.messages - messages, server.bytes - bytes_received
+
+    transport = 'udp' if datagram_options is not None else 'tcp'
+    print(f"load: {count} detections at {count / elapsed:.1f}/s, {messages} messages applied at {messages / elapsed:.1f}/s "
+          f"({bytes_received / max(messages, 1):.0f} bytes each), {wire_format} over {transport}{' with deltas' if delta else ''}",
+          flush=True)
+    print(f"latency published -> applied ({len(latencies)} probes): {percentiles(latencies)}", flush=True)
+    server.report()
+    # the client side stages of the same run (Tracing.py)
+    tracer.report()
+    server.stop()
+    return latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=10.0, help="measured time after calibration")
+    parser.add_argument('--rate', type=float, default=60.0, help="detections published per second")
+    parser.add_argument('--markers', type=int, default=8, help="synthetic markers besides the calibration anchors")
+    parser.add_argument('--source', help="replay the detections of a recording instead of synthetic markers")
+    parser.add_argument('--max-rate', type=float, default=Client.MAX_SEND_RATE, help="client's most tracking messages per second")
+    parser.add_argument('--wire-format', choices=['json', 'binary'], default='json')
+    parser.add_argument('--transport', choices=['tcp', 'udp'], default='tcp')
+    parser.add_argument('--delta', action='store_true', help="keyframe and delta messages")
+    parser.add_argument('--delay', type=float, default=0.0, help="server seconds per message before it is applied")
+    parser.add_argument('--stall', type=float, default=0.0, help="server stops reading for this many seconds ...")
+    parser.add_argument('--stall-every', type=float, default=0.0, help="... every this many seconds")
+    parser.add_argument('--inject-loss', type=float, default=0.0, help="fraction of tracking datagrams dropped")
+    parser.add_argument('--inject-reorder', type=float, default=0.0, help="fraction of tracking datagrams swapped")
+    args = parser.parse_args()
+
+    detections = replayed_detections(args.source) if args.source else synthetic_detections(args.markers, rate=args.rate)
+    datagram_options = {'loss': args.inject_loss, 'reorder': args.inject_reorder} if args.transport == 'udp' else None
+    run_load(detections, args.seconds, args.rate, args.wire_format, args.delta, args.max_rate, datagram_options,
+             {'delay': args.delay, 'stall': args.stall, 'stall_every': args.stall_every})
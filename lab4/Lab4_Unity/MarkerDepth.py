@@ -0,0 +1,93 @@
+# LAB4
+
+'''
+Region based marker depth.
+Instead of reading depth at exactly the four corners (where RealSense depth
+holes show up first) every marker quad is sampled on a fixed grid, the depth
+is reduced with a median or trimmed mean and a plane is fitted through the
+inlier samples. The corners are then intersected with that plane, so a marker
+survives missing corner depth and every marker costs the same.
+All markers of a frame are handled together in numpy.
+'''
+import numpy as np
+
+from Deprojection import get_deprojector
+
+
+class MarkerDepthEstimator:
+    "Robust 3D corners for all markers of a frame from a grid of depth samples inside each quad"
+    def __init__(self, grid=5, margin=0.1, method='median', trim=0.2,
+                 inlier_tolerance=0.03, min_valid=0.3):
+        self.grid = grid                            # grid x grid samples per marker
+        self.method = method                        # 'median' or 'trimmed'
+        self.trim = trim                            # fraction cut on each side for 'trimmed'
+        self.inlier_tolerance = inlier_tolerance    # meters around the robust depth
+        self.min_valid = min_valid                  # fraction of samples that need depth
+
+        # bilinear weights of the sample grid inside the unit quad, kept away from the border
+        s = np.linspace(margin, 1.0 - margin, grid)
+        u, v = np.meshgrid(s, s)
+        u = u.ravel()
+        v = v.ravel()
+        # corner order of cv2.aruco: top-left, top-right, bottom-right, bottom-left
+        self.weights = np.stack([(1 - u) * (1 - v), u * (1 - v), u * v, (1 - u) * v], axis=1)
+
+    def sample_pixels(self, corners):
+        "(M,4,2) corners -> (M,S,2) sample pixels inside each quad"
+        return np.einsum('sk,mkd->msd', self.weights, corners)
+
+    def robust_depth(self, depth):
+        "(M,S) depth with nan holes -> (M,) robust depth per marker"
+        if self.method == 'trimmed':
+            low = np.nanpercentile(depth, 100 * self.trim, axis=1, keepdims=True)
+            high = np.nanpercentile(depth, 100 * (1 - self.trim), axis=1, keepdims=True)
+            kept = np.where((depth >= low) & (depth <= high), depth, np.nan)
+            return np.nanmean(kept, axis=1)
+        return np.nanmedian(depth, axis=1)
+
+    def estimate(self, frame, corners):
+        "(M,4,2) corners -> ((M,4,3) corner points, (M,) valid mask)"
+        corners = np.asarray(corners, dtype=np.float64).reshape(-1, 4, 2)
+        count = corners.shape[0]
+        if count == 0:
+            return np.empty((0, 4, 3)), np.zeros(0, dtype=bool)
+
+        deprojector = get_deprojector(frame.intrinsics, frame.depth_scale)
+        frame.filter_rois(corners)
+        samples = self.sample_pixels(corners)
+        depth = frame.aligned_depth(samples.reshape(-1, 2))
+        depth = depth.reshape(count, -1).astype(np.float64)
+        depth[depth <= 0] = np.nan
+
+        enough = np.mean(~np.isnan(depth), axis=1) >= self.min_valid
+        if not np.any(enough):
+            return np.zeros((count, 4, 3)), enough
+
+        with np.errstate(all='ignore'):
+            center_depth = self.robust_depth(depth)
+            inliers = np.abs(depth - center_depth[:, None]) <= self.inlier_tolerance
+        weights = inliers.astype(np.float64)
+        n_inliers = weights.sum(axis=1)
+
+        # 3D sample points, holes get zero weight
+        rx, ry = deprojector.pixel_rays(samples[..., 0], samples[..., 1])
+        z = np.where(inliers, depth, 0.0)
+        points = np.stack([rx * z, ry * z, z], axis=-1)
+
+        # weighted plane fit, the normal is the direction of least spread
+        safe_n = np.maximum(n_inliers, 1.0)[:, None]
+        centroid = np.einsum('ms,msd->md', weights, points) / safe_n
+        offsets = (points - centroid[:, None, :]) * weights[..., None]
+        covariance = np.einsum('msi,msj->mij', offsets, offsets)
+        _, eigenvectors = np.linalg.eigh(covariance)
+        normal = eigenvectors[:, :, 0]
+
+        # intersect the corner rays with the plane
+        cx, cy = deprojector.pixel_rays(corners[..., 0], corners[..., 1])
+        rays = np.stack([cx, cy, np.ones_like(cx)], axis=-1)
+        with np.errstate(all='ignore'):
+            t = np.einsum('md,md->m', normal, centroid)[:, None] / np.einsum('md,mkd->mk', normal, rays)
+        corners_3d = rays * t[..., None]
+
+        valid = enough & (n_inliers >= 3) & np.all(np.isfinite(corners_3d[..., 2]), axis=1) & np.all(corners_3d[..., 2] > 0, axis=1)
+        return np.where(valid[:, None, None], corners_3d, 0.0), valid
@@ -0,0 +1,132 @@
+# LAB4
+
+'''
+Marker pose from solvePnP.
+compute_marker_rotation builds the orientation out of four deprojected corner
+depths, so one noisy or missing depth pixel breaks position and rotation.
+Here the pose comes from the 2D corners alone (cv2.SOLVEPNP_IPPE_SQUARE with
+the printed marker size and the color intrinsics). Depth only refines the
+distance along the viewing ray and picks between the two IPPE solutions when
+it is valid, so the pose survives depth dropouts.
+Rotations use the compute_marker_rotation axes (x along the top edge, y down
+the left edge, z = x cross y) so the quaternions sent to Unity do not change.
+'''
+import numpy as np
+import cv2
+from scipy.spatial.transform import Rotation
+
+from Deprojection import undistort_rays, DISTORTION_NONE, DISTORTION_BROWN_CONRADY
+
+# IPPE_SQUARE object frame has y up and z out of the marker, compute_marker_rotation has y down
+MARKER_AXES = np.diag([1.0, -1.0, -1.0])
+
+# refine IPPE poses that reproject worse than this many pixels
+REFINE_ERROR = 1.0
+REFINE_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 10, 1e-6)
+
+
+def camera_model(intrinsics):
+    "rs.intrinsics -> OpenCV camera matrix, distortion coefficients, True when the corners need undistort_corners first"
+    camera_matrix = np.array([[intrinsics.fx, 0.0, intrinsics.ppx],
+                              [0.0, intrinsics.fy, intrinsics.ppy],
+                              [0.0, 0.0, 1.0]])
+    model = int(intrinsics.model)
+    if model == DISTORTION_BROWN_CONRADY:
+        # the forward model OpenCV uses, k1 k2 p1 p2 k3 in its order
+        return camera_matrix, np.array(intrinsics.coeffs, dtype=np.float64), False
+    # inverse / modified brown conrady, ftheta and kannala brandt are not OpenCV's model, undistort with Deprojection
+    return camera_matrix, np.zeros(5), model != DISTORTION_NONE
+
+
+def undistort_corners(intrinsics, corners):
+    "(M,4,2) pixels -> the pixels an ideal pinhole camera with the same intrinsics would have seen"
+    x = (corners[..., 0] - intrinsics.ppx) / intrinsics.fx
+    y = (corners[..., 1] - intrinsics.ppy) / intrinsics.fy
+    x, y = undistort_rays(intrinsics, x, y)
+    return np.stack([x * intrinsics.fx + intrinsics.ppx, y * intrinsics.fy + intrinsics.ppy], axis=-1)
+
+
+class MarkerPoseEstimator:
+    "Position, quaternion and reprojection error for all markers of a frame from solvePnP, depth fused where valid"
+    def __init__(self, marker_size, depth_estimator=None, depth_weight=0.5, max_error=4.0):
+        self.marker_size = marker_size          # printed side length in meters, black border included
+        self.depth_estimator = depth_estimator  # MarkerDepthEstimator, None uses the 2D corners only
+        self.depth_weight = depth_weight        # 0 keeps the PnP distance, 1 takes the depth distance
+        self.max_error = max_error              # RMS reprojection error in pixels for a valid pose
+        half = marker_size / 2.0
+        # corner order of cv2.aruco and SOLVEPNP_IPPE_SQUARE: top-left, top-right, bottom-right, bottom-left
+        self.object_points = np.array([[-half, half, 0.0], [half, half, 0.0],
+                                       [half, -half, 0.0], [-half, -half, 0.0]])
+        self.model_key = None
+
+    def estimate(self, frame, corners):
+        "(M,4,2) corners -> (M,3) positions, (M,4) quaternions xyzw, (M,) RMS error in pixels, (M,) valid"
+        corners = np.asarray(corners, dtype=np.float64).reshape(-1, 4, 2)
+        count = corners.shape[0]
+        positions = np.zeros((count, 3))
+        rotvecs = np.zeros((count, 3))
+        errors = np.full(count, np.inf)
+        if count == 0:
+            return positions, np.zeros((0, 4)), errors, np.zeros(0, dtype=bool)
+
+        if self.model_key is not frame.intrinsics:
+            self.camera_matrix, self.distortion, self.undistort = camera_model(frame.intrinsics)
+            self.model_key = frame.intrinsics
+
+        if self.depth_estimator is not None:
+            depth_corners, depth_valid = self.depth_estimator.estimate(frame, corners)
+            normals = np.cross(depth_corners[:, 1] - depth_corners[:, 0], depth_corners[:, 3] - depth_corners[:, 0])
+            with np.errstate(all='ignore'):
+                normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+        else:
+            depth_valid = np.zeros(count, dtype=bool)
+        if self.undistort:
+            # depth is looked up at the raw corners above, solvePnP gets them with zero distortion
+            corners = undistort_corners(frame.intrinsics, corners)
+
+        for i in range(count):
+            solutions, rvecs, tvecs, reprojection = cv2.solvePnPGeneric(
+                self.object_points, corners[i], self.camera_matrix, self.distortion,
+                flags=cv2.SOLVEPNP_IPPE_SQUARE)
+            reprojection = np.asarray(reprojection).ravel()
+            # IPPE hands back nan for the second solution of markers facing the camera exactly
+            usable = [j for j in range(solutions) if np.isfinite(reprojection[j]) and np.all(np.isfinite(rvecs[j]))]
+            if not usable:
+                continue
+            best = min(usable, key=lambda j: reprojection[j])
+            ambiguous = [j for j in usable if reprojection[j] <= self.max_error]
+            if depth_valid[i] and len(ambiguous) > 1:
+                # the two IPPE solutions mirror the marker tilt, the depth plane tells them apart
+                best = max(ambiguous, key=lambda j: abs(cv2.Rodrigues(rvecs[j])[0][:, 2] @ normals[i]))
+            rvec, tvec = rvecs[best], tvecs[best]
+            if len(usable) < solutions or reprojection[best] > REFINE_ERROR:
+                # IPPE_SQUARE degenerates for markers facing the camera exactly, a few LM steps fix it
+                rvec, tvec = cv2.solvePnPRefineLM(self.object_points, corners[i], self.camera_matrix, self.distortion,
+                                                  rvec.copy(), tvec.copy(), REFINE_CRITERIA)
+                projected, _ = cv2.projectPoints(self.object_points, rvec, tvec, self.camera_matrix, self.distortion)
+                reprojection[best] = np.sqrt(np.mean(np.sum((projected.reshape(4, 2) - corners[i]) ** 2, axis=1)))
+            rotvecs[i] = np.ravel(rvec)
+            positions[i] = np.ravel(tvec)
+            errors[i] = reprojection[best]
+
+        rotations = Rotation.from_rotvec(rotvecs)
+        fuse = depth_valid & np.isfinite(errors) & (positions[:, 2] > 0)
+        if np.any(fuse):
+            # pull the distance along the viewing ray towards the region depth
+            depth_z = np.mean(depth_corners[fuse][:, :, 2], axis=1)
+            ratio = depth_z / positions[fuse, 2]
+            positions[fuse] *= ((1.0 - self.depth_weight) + self.depth_weight * ratio)[:, None]
+
+            # tilt the marker normal towards the depth plane normal, the in-plane angle stays from the corners
+            z_axes = rotations.as_matrix()[:, :, 2]
+            normals = np.where(np.sum(normals * z_axes, axis=1, keepdims=True) < 0, -normals, normals)
+            axes = np.cross(z_axes, normals)
+            angles = np.arctan2(np.linalg.norm(axes, axis=1), np.sum(z_axes * normals, axis=1))
+            with np.errstate(all='ignore'):
+                axes /= np.linalg.norm(axes, axis=1, keepdims=True)
+            correction = np.where(fuse[:, None] & np.isfinite(axes), axes * (self.depth_weight * angles)[:, None], 0.0)
+            rotations = Rotation.from_rotvec(correction) * rotations
+
+        valid = np.isfinite(errors) & (errors <= self.max_error) & (positions[:, 2] > 0)
+        rotations = rotations * Rotation.from_matrix(MARKER_AXES)
+        return positions, rotations.as_quat(), errors, valid
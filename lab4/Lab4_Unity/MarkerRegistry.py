@@ -0,0 +1,140 @@
+# LAB4
+
+'''
+Marker registry.
+The clients load a predefined 1000 marker dictionary but only a handful of
+IDs are ever printed. A deployment lists those IDs; restricted_dictionary
+builds a cv2.aruco.Dictionary from just their rows of the base dictionary, so
+the printed markers stay valid, decoding compares every candidate against a
+few codes instead of 1000, and noise cannot decode to an ID we never use.
+The chosen markers are much further apart than the worst pair of the full
+dictionary, the error correction is set from that distance.
+Run this file to compare decode time and false positives against the full
+dictionary:
+    python MarkerRegistry.py --deployment lab4 [--source recording.npz]
+'''
+import time
+import argparse
+import numpy as np
+import cv2
+
+MARKER_DEPLOYMENTS = {
+    # calibration anchors, numbered like the Quest spatial anchors (lab2 SpatialAnchors.cs counts from 1)
+    'lab2': {'dictionary': 'DICT_4X4_1000', 'ids': (1, 2, 3, 4)},
+    # reload 2, bee 23, cart 5, 10, 50, 100, 125 (lab4 Server.cs / MediaPipeClient.py)
+    'lab4': {'dictionary': 'DICT_6X6_1000', 'ids': (2, 5, 10, 23, 50, 100, 125)},
+}
+
+
+def marker_bits(dictionary, index):
+    return cv2.aruco.Dictionary.getBitsFromByteList(dictionary.bytesList[index:index + 1], dictionary.markerSize)
+
+
+def min_distance(dictionary, indices):
+    "Smallest bit distance between two of the markers over all four rotations"
+    bits = [marker_bits(dictionary, index) for index in indices]
+    best = dictionary.markerSize ** 2
+    for i in range(len(bits)):
+        # a marker against its own rotations as well, that is what makes orientation ambiguous
+        rotations = [np.rot90(bits[i], k) for k in range(1, 4)]
+        best = min([best] + [int(np.sum(bits[i] != r)) for r in rotations])
+        for j in range(i + 1, len(bits)):
+            for k in range(4):
+                best = min(best, int(np.sum(np.rot90(bits[i], k) != bits[j])))
+    return best
+
+
+def restricted_dictionary(deployment):
+    "Dictionary with only the deployed markers and the array mapping its indices back to marker IDs"
+    config = MARKER_DEPLOYMENTS[deployment]
+    base = cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, config['dictionary']))
+    ids = np.array(sorted(config['ids']), dtype=np.int32)
+
+    distance = min_distance(base, ids)
+    # never correct more bits than the base dictionary, more correction means more false positives
+    correction = min(base.maxCorrectionBits, (distance - 1) // 2)
+    dictionary = cv2.aruco.Dictionary(base.bytesList[ids], base.markerSize, correction)
+    return dictionary, ids
+
+
+class RestrictedDetector:
+    "ArucoDetector on the restricted dictionary that reports the deployment's marker IDs"
+    def __init__(self, deployment, parameters=None):
+        self.dictionary, self.ids = restricted_dictionary(deployment)
+        self.detector = cv2.aruco.ArucoDetector(self.dictionary, parameters or cv2.aruco.DetectorParameters())
+
+    def detectMarkers(self, image):
+        "Same result layout as cv2.aruco.ArucoDetector.detectMarkers: (corners, ids or None, rejected)"
+        corners, indices, rejected = self.detector.detectMarkers(image)
+        if indices is None:
+            return corners, None, rejected
+        return corners, self.ids[indices], rejected
+
+
+def clutter_images(count, width=640, height=480, seed=0):
+    "Frames full of random black bordered bit patterns, the worst case for phantom markers"
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        image = np.full((height, width), 255, np.uint8)
+        for _ in range(40):
+            cells = int(rng.integers(6, 9))
+            cell = int(rng.integers(6, 14))
+            pattern = np.zeros((cells, cells), np.uint8)
+            pattern[1:-1, 1:-1] = rng.integers(0, 2, (cells - 2, cells - 2)) * 255
+            patch = cv2.resize(pattern, (cells * cell, cells * cell), interpolation=cv2.INTER_NEAREST)
+            x = int(rng.integers(0, width - patch.shape[1]))
+            y = int(rng.integers(0, height - patch.shape[0]))
+            image[y:y + patch.shape[0], x:x + patch.shape[1]] = patch
+        images.append(cv2.cvtColor(image, cv2.COLOR_GRAY2BGR))
+    return images
+
+
+def benchmark_dictionaries(images, deployment):
+    "Decode time and markers outside the deployment for the full and the restricted dictionary"
+    config = MARKER_DEPLOYMENTS[deployment]
+    deployed = set(config['ids'])
+    full = cv2.aruco.ArucoDetector(cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, config['dictionary'])),
+                                   cv2.aruco.DetectorParameters())
+    restricted = RestrictedDetector(deployment)
+    print(f"{deployment}: {len(deployed)} of 1000 markers, min distance "
+          f"{min_distance(restricted.dictionary, range(len(restricted.ids)))} bits "
+          f"(correction {restricted.dictionary.maxCorrectionBits} bits)", flush=True)
+
+    results = {}
+    for name, detector in (('full', full), ('restricted', restricted)):
+        ms = []
+        detections = 0
+        phantoms = 0
+        for image in images:
+            t0 = time.perf_counter()
+            _, ids, _ = detector.detectMarkers(image)
+            ms.append((time.perf_counter() - t0) * 1000.0)
+            if ids is not None:
+                detections += len(ids)
+                phantoms += sum(int(marker_id) not in deployed for marker_id in ids.ravel())
+        print(f"{name}: {np.mean(ms):.2f} ms mean, {np.percentile(ms, 95):.2f} ms p95, "
+              f"{detections} detections, {phantoms} outside the deployment "
+              f"({phantoms / len(images):.2f} per frame)", flush=True)
+        results[name] = {'mean_ms': float(np.mean(ms)), 'detections': detections, 'phantoms': phantoms}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--deployment', choices=list(MARKER_DEPLOYMENTS), default='lab4')
+    parser.add_argument('--source', help="recorded .bag or .npz file, default generates cluttered frames")
+    parser.add_argument('--frames', type=int, default=100, help="number of frames to compare")
+    args = parser.parse_args()
+
+    if args.source is None:
+        images = clutter_images(args.frames)
+    else:
+        from FrameSource import open_source
+        images = []
+        with open_source(args.source, real_time=False) as source:
+            for frame in source:
+                images.append(frame.color_image.copy())
+                if len(images) >= args.frames:
+                    break
+    benchmark_dictionaries(images, args.deployment)
@@ -0,0 +1,125 @@
+# LAB4
+
+'''
+ROI predicted ArUco tracking.
+The cart and reload markers move smoothly, so after a full frame scan every
+marker's next position is predicted from its last motion and detectMarkers
+only runs on padded crops around those predictions. A full frame scan runs
+every few frames to pick up new markers and right away when a tracked marker
+is lost, so the detection cost follows the number of markers instead of the
+frame area.
+MarkerTracker.detectMarkers has the same signature as
+cv2.aruco.ArucoDetector.detectMarkers and can replace it in the clients.
+'''
+import numpy as np
+
+RESCAN_INTERVAL = 30
+
+
+class MarkerTracker:
+    "detectMarkers in crops around the predicted markers, full frame scan every rescan_interval frames or on loss"
+    def __init__(self, detector, rescan_interval=RESCAN_INTERVAL, padding=0.5, min_padding=16):
+        self.detector = detector                # cv2.aruco.ArucoDetector or anything with the same detectMarkers
+        self.rescan_interval = rescan_interval
+        self.padding = padding                  # crop margin as a fraction of the marker size
+        self.min_padding = min_padding          # pixels
+        self.tracks = {}                        # id -> (corners (4,2), velocity (2,) in pixels per frame)
+        self.since_scan = 0
+
+        self.full_scans = 0
+        self.roi_scans = 0
+        self.scanned_pixels = 0
+        self.frame_pixels = 0
+
+    def crop_box(self, corners, velocity, width, height):
+        size = np.max(np.ptp(corners, axis=0))
+        margin = self.padding * size + self.min_padding + np.max(np.abs(velocity))
+        x0, y0 = np.floor(corners.min(axis=0) - margin).astype(int)
+        x1, y1 = np.ceil(corners.max(axis=0) + margin).astype(int)
+        return (max(int(x0), 0), max(int(y0), 0), min(int(x1), width), min(int(y1), height))
+
+    def detect_full(self, image):
+        self.full_scans += 1
+        self.since_scan = 0
+        self.scanned_pixels += image.shape[0] * image.shape[1]
+        corners, ids, rejected = self.detector.detectMarkers(image)
+        if ids is None:
+            return {}
+        return {int(marker_id[0]): c.reshape(4, 2) for marker_id, c in zip(ids, corners)}
+
+    def detect_rois(self, image):
+        height, width = image.shape[:2]
+        # constant velocity prediction of every tracked marker, padded by its size and speed
+        boxes = merge_crops([self.crop_box(corners + velocity, velocity, width, height)
+                             for corners, velocity in self.tracks.values()])
+        found = {}
+        for x0, y0, x1, y1 in boxes:
+            self.scanned_pixels += (x1 - x0) * (y1 - y0)
+            corners, ids, _ = self.detector.detectMarkers(image[y0:y1, x0:x1])
+            if ids is None:
+                continue
+            for marker_id, c in zip(ids, corners):
+                # crop coordinates back to the full frame, first crop wins if a marker shows up twice
+                found.setdefault(int(marker_id[0]), c.reshape(4, 2) + np.float32([x0, y0]))
+        self.roi_scans += 1
+        return found
+
+    def update(self, found):
+        tracks = {}
+        for marker_id, corners in found.items():
+            previous = self.tracks.get(marker_id)
+            if previous is None:
+                velocity = np.zeros(2, dtype=np.float32)
+            else:
+                velocity = np.mean(corners - previous[0], axis=0)
+            tracks[marker_id] = (corners, velocity)
+        self.tracks = tracks
+
+    def detectMarkers(self, image):
+        "Same result layout as cv2.aruco.ArucoDetector.detectMarkers: (corners, ids or None, rejected)"
+        self.frame_pixels += image.shape[0] * image.shape[1]
+        self.since_scan += 1
+
+        if not self.tracks or self.since_scan >= self.rescan_interval:
+            found = self.detect_full(image)
+        else:
+            found = self.detect_rois(image)
+            if len(found) < len(self.tracks):
+                # a tracked marker moved out of its crop or left the view
+                found = self.detect_full(image)
+
+        self.update(found)
+        if not found:
+            return (), None, ()
+        marker_ids = list(found)
+        corners = tuple(found[marker_id].reshape(1, 4, 2).astype(np.float32) for marker_id in marker_ids)
+        ids = np.array(marker_ids, dtype=np.int32).reshape(-1, 1)
+        return corners, ids, ()
+
+    def report(self):
+        "Print how many scans were full frame and the share of the image that was searched"
+        area = self.scanned_pixels / max(self.frame_pixels, 1)
+        print(f"marker tracker: {self.full_scans} full scans, {self.roi_scans} roi scans, "
+              f"{100.0 * area:.1f}% of the frame area searched", flush=True)
+
+
+def area(box):
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+
+def merge_crops(boxes):
+    "Join crops only when their union is cheaper to scan than both crops apart"
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                union = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                if area(union) <= area(a) + area(b):
+                    boxes = [box for k, box in enumerate(boxes) if k not in (i, j)] + [union]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
@@ -10,10 +10,26 @@ https://github.com/google-ai-edge/mediapipe/blob/master/docs/solutions/pose.md
 import mediapipe as mp
 import cv2
 import numpy as np
-import pyrealsense2 as rs
+
+def draw_landmarks_on_image(rgb_image, detection_result):
+  "Draw face mesh and skeleton on a copy of the image, needs no Holistic model (DetectionWorkers.py results)"
+  annotated_image = np.copy(rgb_image)
+  mp.solutions.drawing_utils.draw_landmarks(
+        annotated_image,
+        detection_result.face_landmarks,
+        mp.solutions.holistic.FACEMESH_TESSELATION,
+        landmark_drawing_spec=None,
+        connection_drawing_spec=mp.solutions.drawing_styles.get_default_face_mesh_tesselation_style())
+  mp.solutions.drawing_utils.draw_landmarks(
+        annotated_image,
+        detection_result.pose_landmarks,
+        mp.solutions.holistic.POSE_CONNECTIONS,
+        landmark_drawing_spec=mp.solutions.drawing_styles.get_default_pose_landmarks_style())
+  return annotated_image
 
 class MediaPipe:
-    def __init__(self):
+    def __init__(self, smoother=None):
+      self.smoother = smoother    # Smoothing filter bank for the skeleton joints, None keeps raw points
       self.mp_drawing = mp.solutions.drawing_utils          # mediapipe drawing
       self.mp_drawing_styles = mp.solutions.drawing_styles  # mediapipe drawing style
       self.mp_holistic = mp.solutions.holistic                     # mediapipe pose detection
@@ -28,19 +44,7 @@ class MediaPipe:
 
     def draw_landmarks_on_image(self, rgb_image, detection_result):
       "Draw skeleton on image"
-      annotated_image = np.copy(rgb_image)
-      self.mp_drawing.draw_landmarks(
-            annotated_image,
-            detection_result.face_landmarks,
-            self.mp_holistic.FACEMESH_TESSELATION,
-            landmark_drawing_spec=None,
-            connection_drawing_spec=self.mp_drawing_styles.get_default_face_mesh_tesselation_style())
-      self.mp_drawing.draw_landmarks(
-            annotated_image,
-            detection_result.pose_landmarks,
-            self.mp_holistic.POSE_CONNECTIONS,
-            landmark_drawing_spec=self.mp_drawing_styles.get_default_pose_landmarks_style())
-      return annotated_image
+      return draw_landmarks_on_image(rgb_image, detection_result)
     
     def print_result(self, image, results):
       "Print LEFT_SHOULDER pixel coordinates"
@@ -51,58 +55,59 @@ class MediaPipe:
               f'{results.pose_landmarks.landmark[self.mp_holistic.PoseLandmark.LEFT_SHOULDER].y * image_height})'
         )
 
+    def landmark_pixels(self, landmarks, image):
+      "Landmarks -> (N,2) integer pixel array clamped to the image"
+      image_height, image_width, _ = image.shape
+      pixels = np.array([[landmark.x * image_width, landmark.y * image_height] for landmark in landmarks])
+      pixels = pixels.astype(np.int32)
+      pixels[:, 0] = np.clip(pixels[:, 0], 0, image_width-1)
+      pixels[:, 1] = np.clip(pixels[:, 1], 0, image_height-1)
+      return pixels
+
+    def points_to_3D(self, landmarks, image, depth_frame):
+      "Convert several landmarks to RealSense 3D coordinates in one pass, z == 0 where depth is missing"
+      pixels = self.landmark_pixels(landmarks, image)
+      depth_frame.filter_rois(pixels[:, None, :])
+      return depth_frame.deproject(pixels)
+
     def point_to_3D(self, landmark, image, depth_frame):
       "Convert Pixel coordinates to RealSense 3D coordinates"
-      depth_intrinsics = depth_frame.profile.as_video_stream_profile().intrinsics
-      image_height, image_width, _ = image.shape
-      x = int(landmark.x * image_width)
-      x = min(image_width-1, max(x, 0))
-      y = int(landmark.y * image_height)
-      y = min(image_height-1, max(y, 0))
-      depth = depth_frame.get_distance(x, y)
-      return rs.rs2_deproject_pixel_to_point(depth_intrinsics, [x, y], depth) if depth > 0 else None
+      point = self.points_to_3D([landmark], image, depth_frame)[0]
+      return point.tolist() if point[2] > 0 else None
     
     def skeleton(self, image, results, depth_frame):
         "Return 3D coordinates of head, hands, and feet"
         if results.pose_landmarks is None:
             return None
-        
-        # head3D = self.point_to_3D(
-        #     results.pose_landmarks.landmark[self.mp_holistic.PoseLandmark.NOSE],
-        #     image, depth_frame)
-        # if head3D is None:
-        #     return None
-        # Head_x, Head_y, Head_z = head3D
-        
-        rWrist3D = self.point_to_3D(
-            results.pose_landmarks.landmark[self.mp_holistic.PoseLandmark.RIGHT_WRIST],
-            image, depth_frame)
-        if rWrist3D is None:
+
+        landmark = results.pose_landmarks.landmark
+        PoseLandmark = self.mp_holistic.PoseLandmark
+        rWrist3D, lWrist3D, lFoot3D, rFoot3D = self.points_to_3D([
+            # landmark[PoseLandmark.NOSE],
+            landmark[PoseLandmark.RIGHT_WRIST],
+            landmark[PoseLandmark.LEFT_WRIST],
+            landmark[PoseLandmark.LEFT_ANKLE],
+            landmark[PoseLandmark.RIGHT_ANKLE],
+        ], image, depth_frame)
+
+        if self.smoother is not None:
+            # smooth the joints with depth in one call, joint index is the filter id
+            joints = np.array([rWrist3D, lWrist3D, lFoot3D, rFoot3D])
+            seen = [i for i in range(len(joints)) if joints[i, 2] > 0]
+            joints[seen] = self.smoother.update(seen, joints[seen], depth_frame.timestamp / 1000.0)
+            rWrist3D, lWrist3D, lFoot3D, rFoot3D = joints
+
+        if rWrist3D[2] <= 0:
             return None
-        RHand_x, RHand_y, RHand_z = rWrist3D
+        RHand_x, RHand_y, RHand_z = rWrist3D.tolist()
         
-        lWrist3D = self.point_to_3D(
-            results.pose_landmarks.landmark[self.mp_holistic.PoseLandmark.LEFT_WRIST],
-            image, depth_frame)
-        if lWrist3D is None:
+        if lWrist3D[2] <= 0:
             return None
-        LHand_x, LHand_y, LHand_z = lWrist3D
-        
-        lFoot3D = self.point_to_3D(
-            results.pose_landmarks.landmark[self.mp_holistic.PoseLandmark.LEFT_ANKLE],
-            image, depth_frame)
-        if lFoot3D is None:
-            lFoot3D = (0.0, 0.0, 0.0)
-            # return None
-        LFoot_x, LFoot_y, LFoot_z = lFoot3D
+        LHand_x, LHand_y, LHand_z = lWrist3D.tolist()
         
-        rFoot3D = self.point_to_3D(
-            results.pose_landmarks.landmark[self.mp_holistic.PoseLandmark.RIGHT_ANKLE],
-            image, depth_frame)
-        if rFoot3D is None:
-            rFoot3D = (0.0, 0.0, 0.0)
-            # return None
-        RFoot_x, RFoot_y, RFoot_z = rFoot3D
+        # missing foot depth reports the origin instead of dropping the skeleton
+        LFoot_x, LFoot_y, LFoot_z = lFoot3D.tolist() if lFoot3D[2] > 0 else (0.0, 0.0, 0.0)
+        RFoot_x, RFoot_y, RFoot_z = rFoot3D.tolist() if rFoot3D[2] > 0 else (0.0, 0.0, 0.0)
         
         msg = {
             # 'Head_x': Head_x, 'Head_y': Head_y, 'Head_z': Head_z,
@@ -2,145 +2,212 @@
 
 # from ultralytics import YOLOvv11
 
-import socket
-import json
 import cv2
 import numpy as np
-import pyrealsense2 as rs
-from MediaPipe import MediaPipe
-from collections import defaultdict, deque
-import threading
-import time
+from MarkerDepth import MarkerDepthEstimator
+from MarkerTracking import MarkerTracker
+from PyramidDetection import PyramidDetector
+from MarkerRegistry import RestrictedDetector, MARKER_DEPLOYMENTS
+from Smoothing import create_filter_bank, FILTERS
+from Tracks import TrackTable, describe, COAST_TTL
+from FrameSource import open_source, benchmark, benchmark_profiles, STREAM_PROFILES, ThreadedSource
+from DetectionWorkers import DetectionPool
+from UnityLink import UnityLink
+from WireFormat import encode_tracking, json_message, BINARY_VERSION, MARKER, APPEARED
+from Deltas import DeltaEncoder, FULL, DELTA, KEYFRAME_INTERVAL, POSITION_DEADBAND
+from Datagrams import DatagramChannel, DATAGRAM_PORT
+from Tracing import tracer
+import argparse
 
 from scipy.linalg import lstsq
-from scipy.spatial.transform import Rotation
 
 HOST = "127.0.0.1" # localhost
 PORT = 13456
 
+# marker depth from a 5x5 grid inside each marker quad instead of the 4 corner pixels
+MARKER_DEPTH = MarkerDepthEstimator(grid=5, method='median')
+
 
 # NOTE: Arcuo ID for -> Reload: 2
 # NOTE: Arcuo Id for -> Cart: 5, 5, 10, 50, 100, 125 
 
+# frames a marker keeps being sent after its last detection, reload marker 2 toggles
+# the basket mode in Server.cs so a short dropout must not end it
+MARKER_TTLS = {2: 30}
+
 # TODO: edge case check only one has to be running either mediapipe or arcuo markers
 
-def socket_client():
-    mp = MediaPipe()
-    
-    pipeline = rs.pipeline()
-    config = rs.config()
-
-    pipeline_wrapper = rs.pipeline_wrapper(pipeline)
-    pipeline_profile = config.resolve(pipeline_wrapper)
-    device = pipeline_profile.get_device()
-    device_product_line = str(device.get_info(rs.camera_info.product_line))
-
-    found_rgb = False
-    for s in device.sensors:
-        if s.get_info(rs.camera_info.name) == 'RGB Camera':
-            found_rgb = True
-            break
-    if not found_rgb:
-        print("[main] The demo requires Depth camera with Color sensor")
-        exit(0)
-
-    config.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
-    config.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 30)
-
-    arucoDict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_6X6_1000)
+def create_aruco_detector(tracking=False, pyramid_scale=None, deployment=None):
     arucoParam = cv2.aruco.DetectorParameters()
-    arucoDetector = cv2.aruco.ArucoDetector(arucoDict, arucoParam)
+    if deployment is not None:
+        # dictionary with only the markers of this deployment (MarkerRegistry.MARKER_DEPLOYMENTS)
+        arucoDetector = RestrictedDetector(deployment, arucoParam)
+    else:
+        arucoDict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_6X6_1000)
+        arucoDetector = cv2.aruco.ArucoDetector(arucoDict, arucoParam)
+    if pyramid_scale is not None:
+        # find markers at low resolution, refine their corners at full resolution
+        arucoDetector = PyramidDetector(arucoDetector, scale=pyramid_scale)
+    if tracking:
+        # search only around the predicted markers, full frame every few frames
+        return MarkerTracker(arucoDetector)
+    return arucoDetector
+
+def create_mediapipe(smoothing='none'):
+    "MediaPipe with an optional filter bank on the skeleton joints"
+    # loads the model libraries, only the processes that run pose detection import it
+    from MediaPipe import MediaPipe
+    return MediaPipe(smoother=create_filter_bank(smoothing))
+
+def detect_pose(frame, mp):
+    "MediaPipe pose on one frame, return the 3D hand points"
+    with tracer.stage('mediapipe', frame.number):
+        detection_results = mp.detect(frame.color_image)
+    with tracer.stage('skeleton', frame.number):
+        skeleton_data = mp.skeleton(frame.color_image, detection_results, frame)
+
+    if skeleton_data is not None:
+        skeleton_points = np.array([
+            # [skeleton_data['Head_x'], skeleton_data['Head_y'], skeleton_data['Head_z']],
+            [skeleton_data['LHand_x'], skeleton_data['LHand_y'], skeleton_data['LHand_z']],
+            [skeleton_data['RHand_x'], skeleton_data['RHand_y'], skeleton_data['RHand_z']],
+            # [skeleton_data['LFoot_x'], skeleton_data['LFoot_y'], skeleton_data['LFoot_z']],
+            # [skeleton_data['RFoot_x'], skeleton_data['RFoot_y'], skeleton_data['RFoot_z']]
+        ])
+    else:
+        skeleton_points = np.empty((0, 3))
+
+    # print("MediaPipe Skeleton:", skeleton_data, flush=True)
+    return skeleton_points, detection_results
+
+def detect_aruco(frame, arucoDetector):
+    "ArUco markers on one frame, return the 3D center of every marker with valid depth"
+    # detect markers on the raw image, the drawn face mesh can cover them
+    with tracer.stage('detect_markers', frame.number):
+        corners, ids, _ = arucoDetector.detectMarkers(frame.color_image)
+    # print(corners, ids, flush = True)
 
-    pipeline.start(config)
-    align_to = rs.stream.color
-    align = rs.align(align_to)
+    arcuo_coordinates = {}
+    if ids is not None:
+        # 3D corners of all markers at once from depth sampled over each marker
+        with tracer.stage('depth_lookup', frame.number):
+            corners_3d_all, valid = MARKER_DEPTH.estimate(frame, np.concatenate(corners))
+
+        for id, corners_3d, is_valid in zip(ids, corners_3d_all, valid):
+            if is_valid:
+                arcuo_coordinates[int(id[0])] = np.mean(corners_3d, axis = 0)
+
+    return arcuo_coordinates, corners, ids
+
+def merge_points(skeleton_points, arcuo_coordinates):
+    "Append arcuo markers to the skeleton points, they share one calibration"
+    if not arcuo_coordinates:
+        return skeleton_points
+    return np.vstack([skeleton_points, np.array(list(arcuo_coordinates.values()))])
+
+def detect_frame(frame, mp, arucoDetector):
+    "Run MediaPipe and ArUco on one frame, return the 3D skeleton and marker points"
+    skeleton_points, detection_results = detect_pose(frame, mp)
+    arcuo_coordinates, corners, ids = detect_aruco(frame, arucoDetector)
+    skeleton_points = merge_points(skeleton_points, arcuo_coordinates)
+    return skeleton_points, arcuo_coordinates, detection_results, corners, ids
+
+def show_frame(color_image):
+    "Mirror and display the frame, return True when q was pressed, t prints the stage latencies so far"
+    cv2.namedWindow('RealSense', cv2.WINDOW_AUTOSIZE)
+    color_image = cv2.flip(color_image, 1)
+    cv2.imshow('RealSense', color_image)
+    key = cv2.waitKey(1) & 0xFF
+    if key == ord('t'):
+        tracer.report()
+    return key == ord('q')
+
+def socket_client(source, workers=0, aruco_options=None, smoothing='none', coast_ttl=COAST_TTL, wire_format='json',
+                  delta_options=None, datagram_options=None, trace_file=None):
+    aruco_options = aruco_options or {}
+    if workers > 0:
+        # pose and arcuo detection run in worker processes over shared memory frames
+        pool = DetectionPool(pose_workers=workers, aruco_options=aruco_options, smoothing=smoothing)
+        # the model stays in the workers, drawing their landmarks only needs the mediapipe drawing utils
+        from MediaPipe import draw_landmarks_on_image
+    else:
+        pool = None
+        mp = create_mediapipe(smoothing)
+        arucoDetector = create_aruco_detector(**aruco_options)
 
     # model = YOLOvv11.from_pretrained("leeyunjai/yolo11-balldetect")
 
+    # markers stay visible through short dropouts instead of flickering
+    tracks = TrackTable(coast_ttl=coast_ttl, ttl=MARKER_TTLS)
+    # skeleton points and markers keep their own last sent state, ids overlap between the two
+    delta_encoders = (DeltaEncoder(**delta_options), DeltaEncoder(**delta_options)) if delta_options is not None else None
+    frame_count = 0
+
     T_matrix = None
     calibration_samples = []
     CALIBRATION_SAMPLES_NEEDED = 5
-    
-    arcuo_coordinates = {}
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.connect((HOST, PORT))
-            sock.setblocking(0)
-            
-            while True:
-                frames = pipeline.wait_for_frames()
-                aligned_frames = align.process(frames)
-                depth_frame = aligned_frames.get_depth_frame()
-                color_frame = aligned_frames.get_color_frame()
-                
-                if not depth_frame or not color_frame:
-                    continue
-
-                color_image = np.asanyarray(color_frame.get_data())
-                # depth_image = np.asanyarray(depth_frame.get_data())    
 
-                detection_results = mp.detect(color_image)
-                color_image = mp.draw_landmarks_on_image(color_image, detection_results)
-
-                corners, ids, _ = arucoDetector.detectMarkers(color_image)
-                # print(corners, ids, flush = True)
-                intrinsics = depth_frame.profile.as_video_stream_profile().get_intrinsics()
-                
-                skeleton_data = mp.skeleton(color_image, detection_results, depth_frame)
-
-                # early exit
-                # if (skeleton_data is None or ids is None):
-                #     cv2.namedWindow('RealSense', cv2.WINDOW_AUTOSIZE)
-                #     color_image = cv2.flip(color_image, 1)
-                #     cv2.imshow('RealSense', color_image)
-                #     cv2.waitKey(1)
-                #     continue
-
-
-                if skeleton_data is not None:
-                    skeleton_points = np.array([
-                        # [skeleton_data['Head_x'], skeleton_data['Head_y'], skeleton_data['Head_z']],
-                        [skeleton_data['LHand_x'], skeleton_data['LHand_y'], skeleton_data['LHand_z']],
-                        [skeleton_data['RHand_x'], skeleton_data['RHand_y'], skeleton_data['RHand_z']],
-                        # [skeleton_data['LFoot_x'], skeleton_data['LFoot_y'], skeleton_data['LFoot_z']],
-                        # [skeleton_data['RFoot_x'], skeleton_data['RFoot_y'], skeleton_data['RFoot_z']]
-                    ])
-                else:
-                    skeleton_points = np.empty((0, 3))
-
-                # print("MediaPipe Skeleton:", skeleton_data, flush=True)
-                
-                if ids is not None:
-                    for id, marker in zip(ids,corners):
-                        valid_coordinates = []
+    def reconnected(link):
+        # a restarted unity starts from a keyframe, T_matrix still holds
+        if delta_encoders is not None:
+            for delta_encoder in delta_encoders:
+                delta_encoder.reset()
 
-                        for corner in marker[0]:
-                            x,y = corner
-                            depth = depth_frame.get_distance(int(x), int(y))
+    # the socket runs on its own asyncio thread and reconnects by itself, the frame loop only queues messages
+    link = UnityLink(HOST, PORT, wire_format, on_connect=reconnected).start()
+    # calibration stays on tcp, tracking messages can go out as udp datagrams (Datagrams.py)
+    tracking = DatagramChannel(HOST, **datagram_options) if datagram_options is not None else link
+    anchors_seen = 0    # unity messages the calibration has used
 
-                            if depth > 0:
-                                coord = rs.rs2_deproject_pixel_to_point(intrinsics, [x, y], depth)
-                                valid_coordinates.append(coord)
-                        
-                        if len(valid_coordinates) == 4:
-                            avg_coordinates = np.mean(valid_coordinates, axis = 0)
-                            # print("HELLOOOOOOOOOOOOOOOOOOOOOOOOOOO -------", id, avg_coordinates)
-                            arcuo_coordinates[int(id[0])] = avg_coordinates
-                            
-                            # append arcuo marker to environment
-                            #skeleton_points.append([avg_coordinates[0], avg_coordinates[1], avg_coordinates[2]])
-                            skeleton_points = np.append(skeleton_points, [avg_coordinates], axis=0)
-                            print("Skeleton Points:", skeleton_points, len(skeleton_points),flush=True)
-
-                    # color_image = cv2.aruco.drawDetectedMarkers(color_image, corners, ids)
-                    # print("IDS", ids)
-                    # print("Corners", corners)
-                    cv2.aruco.drawDetectedMarkers(color_image, corners, ids)
-                else:
-                    arcuo_coordinates = {}
-
-                try:
-                    msg = receive(sock)
+    source.start()
+    try:
+        for frame in source:
+            # gaps in the camera frame numbers are frames the camera or ThreadedSource dropped
+            tracer.frame(frame)
+            captured = frame.capture_time()
+            if pool is None:
+                skeleton_points, arcuo_coordinates, detection_results, corners, ids = detect_frame(frame, mp, arucoDetector)
+                color_image = mp.draw_landmarks_on_image(frame.color_image, detection_results)
+            else:
+                # results come back a few frames later, joined by frame number
+                pool.submit(frame)
+                joined = pool.latest()
+                if joined is None:
+                    if show_frame(frame.color_image):
+                        break
+                    continue
+                # draw, time and trace the frame the results belong to, not the one just submitted
+                frame = joined['frame']
+                captured = frame.capture_time()
+                (skeleton_points, landmarks), (arcuo_coordinates, corners, ids) = joined['pose'], joined['aruco']
+                color_image = draw_landmarks_on_image(frame.color_image, landmarks)
+                skeleton_points = merge_points(skeleton_points, arcuo_coordinates)
+
+            frame_count += 1
+            transitions = tracks.update(frame_count, arcuo_coordinates)
+            if transitions:
+                print("Marker tracks:", describe(transitions), flush=True)
+
+            # early exit
+            # if (skeleton_data is None or ids is None):
+            #     cv2.namedWindow('RealSense', cv2.WINDOW_AUTOSIZE)
+            #     color_image = cv2.flip(color_image, 1)
+            #     cv2.imshow('RealSense', color_image)
+            #     cv2.waitKey(1)
+            #     continue
+
+            if ids is not None:
+                print("Skeleton Points:", skeleton_points, len(skeleton_points),flush=True)
+                # color_image = cv2.aruco.drawDetectedMarkers(color_image, corners, ids)
+                # print("IDS", ids)
+                # print("Corners", corners)
+                cv2.aruco.drawDetectedMarkers(color_image, corners, ids)
+
+            try:
+                # CALIBRATION PHASE: one sample per new set of unity anchors
+                received = link.newer(anchors_seen) if T_matrix is None else None
+                if received is not None:
+                    anchors_seen, msg = received
                     anchors = msg['listOfAnchors']
                     
                     unity_points = np.array([
@@ -153,137 +220,191 @@ def socket_client():
                 
                     print("Unity Anchor Points:", unity_points, len(unity_points),flush=True)
 
+                    # get the first three point (head, lHand, rHand) points from skeleton points
+                    if len(skeleton_points) == 3 and len(unity_points) == 3:
+                        calibration_samples.append((skeleton_points.copy()[:3], unity_points.copy()))
+                        print(f"calibration sample {len(calibration_samples)}/{CALIBRATION_SAMPLES_NEEDED}", flush=True)
+                    
+                    if len(calibration_samples) >= CALIBRATION_SAMPLES_NEEDED:
+                        all_skeleton = np.vstack([s for s, u in calibration_samples]) # CALIBRATION_SAMPLES_NEEDED X 4
+                        all_unity = np.vstack([u for s, u in calibration_samples]) # CALIBRATION_SAMPLES_NEEDED X 4
 
-                    # CALIBRATION PHASE
-                    if T_matrix is None:
-                        # get the first three point (head, lHand, rHand) points from skeleton points
-                        if len(skeleton_points) == 3 and len(unity_points) == 3:
-                            calibration_samples.append((skeleton_points.copy()[:3], unity_points.copy()))
-                            print(f"calibration sample {len(calibration_samples)}/{CALIBRATION_SAMPLES_NEEDED}", flush=True)
                         
-                        if len(calibration_samples) >= CALIBRATION_SAMPLES_NEEDED:
-                            all_skeleton = np.vstack([s for s, u in calibration_samples]) # CALIBRATION_SAMPLES_NEEDED X 4
-                            all_unity = np.vstack([u for s, u in calibration_samples]) # CALIBRATION_SAMPLES_NEEDED X 4
-
-                            
-                            skeleton_homogeneous = np.hstack([all_skeleton, np.ones((all_skeleton.shape[0], 1))])
-                            
-                            T_transpose, _, _, s = lstsq(skeleton_homogeneous, all_unity)
-                            T_matrix = T_transpose.T
-                            
-                            print("=" * 50)
-                            print("CALIBRATION COMPLETE!")
-                            print("T_matrix:")
-                            print(T_matrix)
-
-                    # TRACKING PHASE
-                    if T_matrix is not None:
-                        transformed_skeleton_anchors = []
-                        transformed_arcuo_anchors = []
+                        skeleton_homogeneous = np.hstack([all_skeleton, np.ones((all_skeleton.shape[0], 1))])
                         
-                        # transform skeleton points
-                        for index, skeleton_point in enumerate(skeleton_points):
-                            homogenous_skeleton_point = np.array([
-                                skeleton_point[0], 
-                                skeleton_point[1], 
-                                skeleton_point[2], 
-                                1.0
-                            ])
-                            
-                            transformed_point = (T_matrix @ homogenous_skeleton_point)[:3]
-                            
-                            transformed_skeleton_anchor = {
-                                'anchor_id': index,
-                                'original_position': {
-                                    'x': float(skeleton_point[0]),
-                                    'y': float(skeleton_point[1]),
-                                    'z': float(skeleton_point[2]),
-                                },
-                                'transformed_position': {
-                                    'x': float(transformed_point[0]),
-                                    'y': float(transformed_point[1]),
-                                    'z': float(transformed_point[2]),
-                                }
-                            }
-                            transformed_skeleton_anchors.append(transformed_skeleton_anchor)
+                        T_transpose, _, _, s = lstsq(skeleton_homogeneous, all_unity)
+                        T_matrix = T_transpose.T
                         
-                        # transform skeleton points
-                        if arcuo_coordinates:
-                            for marker_id, marker_pos in arcuo_coordinates.items():
-
-                                marker_point = np.array([marker_pos[0], marker_pos[1], marker_pos[2], 1.0])
-                                transformed_point = (T_matrix @ marker_point)[:3]
-
-                                transformed_arcuo_anchor ={
-                                    'anchor_id': marker_id,
-                                    'original_position': {
-                                        'x': float(marker_pos[0]),
-                                        'y': float(marker_pos[1]),
-                                        'z': float(marker_pos[2])
-                                    },
-                                    'transformed_position': {
-                                        'x': float(transformed_point[0]),
-                                        'y': float(transformed_point[1]),
-                                        'z': float(transformed_point[2])
-                                    }
-                                }
-
-                                transformed_arcuo_anchors.append(transformed_arcuo_anchor)
-
-
-                        # assemble message type
-                        response_msg = {
-                            'transformedSkeletonAnchors': transformed_skeleton_anchors,
-                            'transformedArcuoAnchors': transformed_arcuo_anchors # transformed_arcuo_anchors
-                        }
-                        # print(f"Sending transformed positions:", response_msg, flush=True)
-                        send(sock, response_msg)
-                        arcuo_coordinates = {}
-                        skeleton_points = np.empty((0, 3))
+                        print("=" * 50)
+                        print("CALIBRATION COMPLETE!")
+                        print("T_matrix:")
+                        print(T_matrix)
                     else:
                         response_msg = {
                             'transformedSkeletonAnchors': [],
                             'transformedArcuoAnchors': []
                         }
-                        send(sock, response_msg)
-                        arcuo_coordinates = {}
-                        skeleton_points = np.empty((0, 3))
-                    
-                    time.sleep(0.05)
-                    
-                except BlockingIOError:
-                    pass
-                except Exception as e:
-                    print(f"ERROR: {e}", flush=True)
+                        send(link, response_msg)
+
+                # TRACKING PHASE: every frame, no longer paced by unity's anchor messages
+                if T_matrix is not None:
+                    # skeleton points by index and the confirmed and coasting markers, transformed at once
+                    visible_markers, _ = tracks.visible()
+                    skeleton_points = np.asarray(skeleton_points, dtype=np.float64).reshape(-1, 3)
+                    marker_ids = list(visible_markers)
+                    marker_points = np.array([visible_markers[marker_id] for marker_id in marker_ids]).reshape(-1, 3)
+                    with tracer.stage('transform', frame.number):
+                        skeleton = anchor_group(delta_encoders[0] if delta_encoders else None, list(range(len(skeleton_points))), skeleton_points, T_matrix)
+                        markers = anchor_group(delta_encoders[1] if delta_encoders else None, marker_ids, marker_points, T_matrix)
+
+                    if skeleton is None and markers is None:
+                        # nothing moved beyond its dead-band, unity keeps the last state
+                        pass
+                    elif link.wire_version == BINARY_VERSION:
+                        send_tracking(tracking, frame_count, skeleton or EMPTY_GROUP, markers or EMPTY_GROUP)
+                        tracer.sent(captured, frame.number)
+                    else:
+                        send(tracking, tracking_message(skeleton or EMPTY_GROUP, markers or EMPTY_GROUP))
+                        tracer.sent(captured, frame.number)
+                
+            except Exception as e:
+                print(f"ERROR: {e}", flush=True)
+            
+            # Display
+            if show_frame(color_image):
+                break
                 
-                # Display
-                cv2.namedWindow('RealSense', cv2.WINDOW_AUTOSIZE)
-                color_image = cv2.flip(color_image, 1)
-                cv2.imshow('RealSense', color_image)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
-                    
     finally:
-        pipeline.stop()
+        source.stop()
+        if pool is not None:
+            pool.stop()
+        if tracking is not link:
+            tracking.close()
+        link.stop()
         cv2.destroyAllWindows()
-
-def receive(sock):
-    data = sock.recv(4096)
-    data = data.decode('utf-8')
-    msg = json.loads(data)
-    # print("Received:", msg, flush=True)
-    return msg
-
-def send(sock, msg):
-    data = json.dumps(msg)
-    sock.sendall(data.encode('utf-8'))
-    # print("Sent to server:", msg, flush=True)
+        tracer.report(trace_file)
+
+def benchmark_loop(source, workers=0, aruco_options=None, smoothing='none', trace_file=None):
+    "Replay the source through detect_frame without socket or display"
+    aruco_options = aruco_options or {}
+    if workers > 0:
+        pool = DetectionPool(pose_workers=workers, aruco_options=aruco_options, smoothing=smoothing)
+
+        def process(frame):
+            # blocking submit keeps every frame, so this measures pool throughput
+            pool.submit(frame, block=True)
+            pool.latest()
+
+        try:
+            with source:
+                return benchmark(source, process)
+        finally:
+            pool.stop()
+            # detection runs in the workers, only the capture stages are traced here
+            tracer.report(trace_file)
+
+    mp = create_mediapipe(smoothing)
+    arucoDetector = create_aruco_detector(**aruco_options)
+    with source:
+        result = benchmark(source, lambda frame: detect_frame(frame, mp, arucoDetector))
+    if isinstance(arucoDetector, MarkerTracker):
+        arucoDetector.report()
+    tracer.report(trace_file)
+    return result
+
+def send(connection, msg):
+    connection.send(msg)
+
+# (mode, ids, original, transformed, appeared, disappeared) of one anchor list with nothing to send
+EMPTY_GROUP = (DELTA, [], np.empty((0, 3)), np.empty((0, 3)), [], [])
+
+def anchor_group(delta_encoder, ids, points, T_matrix):
+    "Transformed anchors of one list, only the ones that changed in delta mode, None when none did"
+    transformed = points @ T_matrix[:3, :3].T + T_matrix[:3, 3]
+    if delta_encoder is None:
+        return FULL, ids, points, transformed, [], []
+    update = delta_encoder.update(ids, transformed)
+    if update is None:
+        return None
+    mode, send_mask, appeared, disappeared = update
+    rows = np.flatnonzero(send_mask)
+    return mode, [ids[i] for i in rows], points[rows], transformed[rows], appeared, disappeared
+
+def tracking_message(skeleton, markers):
+    "JSON tracking message, delta fields only in delta mode"
+    mode = min(skeleton[0], markers[0])     # both lists keyframe on the same tick
+    response_msg = {
+        'transformedSkeletonAnchors': json_message(*skeleton[1:4])['transformedAnchors'],
+        'transformedArcuoAnchors': json_message(*markers[1:4])['transformedAnchors']
+    }
+    if mode != FULL:
+        response_msg.update({
+            'deltaMode': mode,
+            'appearedSkeletonAnchors': skeleton[4], 'disappearedSkeletonAnchors': skeleton[5],
+            'appearedArcuoAnchors': markers[4], 'disappearedArcuoAnchors': markers[5]
+        })
+    return response_msg
+
+def send_tracking(connection, sequence, skeleton, markers):
+    "Binary tracking message (WireFormat.py): skeleton points by index, then the markers flagged MARKER"
+    mode = min(skeleton[0], markers[0])
+    ids = list(skeleton[1]) + list(markers[1])
+    flags = np.array([APPEARED if anchor_id in skeleton[4] else 0 for anchor_id in skeleton[1]] +
+                     [MARKER | (APPEARED if anchor_id in markers[4] else 0) for anchor_id in markers[1]], dtype=np.uint32)
+    disappeared = list(skeleton[5]) + list(markers[5])
+    disappeared_flags = np.array([0] * len(skeleton[5]) + [MARKER] * len(markers[5]), dtype=np.uint32)
+    with tracer.stage('encode'):
+        payload = encode_tracking(ids, np.vstack([skeleton[2], markers[2]]), np.vstack([skeleton[3], markers[3]]),
+                                  flags=flags, sequence=sequence, mode=mode,
+                                  disappeared=disappeared, disappeared_flags=disappeared_flags)
+    connection.send_frame(payload)
 
 if __name__ == "__main__":
-    # start thread with socket code
-    # t1 = threading.Thread(target=socket_client)
-    # t1.start()
-    socket_client()
-
-    # realsense runs on the main thread
-    # realsense_loop()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', help="recorded .bag or .npz file instead of the live camera")
+    parser.add_argument('--benchmark', action='store_true', help="replay as fast as possible and report frames/s")
+    parser.add_argument('--align', choices=['full', 'sparse'], default='full', help="rs.align every frame or only the queried pixels")
+    parser.add_argument('--profile', choices=list(STREAM_PROFILES), help="stream profile, default picks the fastest one the camera supports")
+    parser.add_argument('--benchmark-profiles', action='store_true', help="compare latency of every stream profile on the live camera")
+    parser.add_argument('--depth-filters', type=lambda s: s.split(','), help="numpy depth filters run around the queried pixels, e.g. spatial,temporal,hole_filling")
+    parser.add_argument('--filter-full-frame', action='store_true', help="run --depth-filters on the whole depth image")
+    parser.add_argument('--rs-filters', type=lambda s: s.split(','), help="librealsense filters on the raw frame, e.g. spatial,temporal,hole_filling")
+    parser.add_argument('--track-markers', action='store_true', help="detect markers only around their predicted positions")
+    parser.add_argument('--pyramid-scale', type=float, choices=[0.5, 0.25], help="find markers on a downscaled image, refine corners at full resolution")
+    parser.add_argument('--markers', choices=list(MARKER_DEPLOYMENTS), help="decode only the marker IDs of this deployment")
+    parser.add_argument('--smoothing', choices=('none',) + FILTERS, default='none', help="skeleton joint filter, none as before")
+    parser.add_argument('--coast-ttl', type=int, default=COAST_TTL, help="frames a marker is still sent after its last detection")
+    parser.add_argument('--wire-format', choices=['json', 'binary'], default='json', help="binary float32 tracking messages if the server supports them")
+    parser.add_argument('--delta', action='store_true', help="send keyframes and in between only anchors that moved")
+    parser.add_argument('--keyframe-interval', type=int, default=KEYFRAME_INTERVAL, help="messages between two full keyframes in --delta mode")
+    parser.add_argument('--deadband', type=float, default=POSITION_DEADBAND, help="meters an anchor has to move before --delta sends it again")
+    parser.add_argument('--transport', choices=['tcp', 'udp'], default='tcp', help="tracking messages over the tcp connection or as udp datagrams")
+    parser.add_argument('--datagram-port', type=int, default=DATAGRAM_PORT, help="unity's udp port for --transport udp")
+    parser.add_argument('--inject-loss', type=float, default=0.0, help="drop this fraction of tracking datagrams, for testing")
+    parser.add_argument('--inject-reorder', type=float, default=0.0, help="swap this fraction of tracking datagrams with the next one, for testing")
+    parser.add_argument('--workers', type=int, default=0, help="number of MediaPipe worker processes, 0 runs detection inline")
+    parser.add_argument('--trace-file', help="write the per-stage latency histograms (Tracing.py) as JSON on exit")
+    args = parser.parse_args()
+    if args.workers > 0 and args.depth_filters and not args.filter_full_frame:
+        # region filters run where depth is read, the workers cannot share their temporal state
+        parser.error("--depth-filters with --workers needs --filter-full-frame")
+    aruco_options = {'tracking': args.track_markers, 'pyramid_scale': args.pyramid_scale, 'deployment': args.markers}
+
+    if args.benchmark_profiles:
+        mp = create_mediapipe(args.smoothing)
+        arucoDetector = create_aruco_detector(**aruco_options)
+        benchmark_profiles(lambda frame: detect_frame(frame, mp, arucoDetector), align=args.align)
+    elif args.benchmark:
+        benchmark_loop(open_source(args.source, real_time=False, align=args.align, profile=args.profile,
+                                   rs_filters=args.rs_filters, depth_filters=args.depth_filters,
+                                   filter_full_frame=args.filter_full_frame), args.workers, aruco_options, args.smoothing,
+                      args.trace_file)
+    else:
+        # capture on its own thread so slow MediaPipe inference only drops stale frames
+        socket_client(ThreadedSource(open_source(args.source, align=args.align, profile=args.profile,
+                                                 rs_filters=args.rs_filters, depth_filters=args.depth_filters,
+                                                 filter_full_frame=args.filter_full_frame)), args.workers, aruco_options, args.smoothing,
+                      args.coast_ttl, args.wire_format,
+                      {'keyframe_interval': args.keyframe_interval, 'position_deadband': args.deadband} if args.delta else None,
+                      {'port': args.datagram_port, 'loss': args.inject_loss, 'reorder': args.inject_reorder} if args.transport == 'udp' else None,
+                      args.trace_file)
@@ -0,0 +1,96 @@
+# LAB4
+
+'''
+Latency compensating pose extrapolation.
+A marker pose is already old when it leaves the client: exposure, alignment,
+detection, JSON, the network and Unity's message queue all come before the
+headset shows it. PosePredictor keeps a velocity and an angular velocity per
+anchor (array rows like Smoothing.FilterBank) and extrapolates positions and
+quaternions forward by the measured capture -> send time plus a configured
+downstream latency.
+'''
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from Smoothing import FilterBank
+
+MAX_HORIZON = 0.25  # seconds, never extrapolate further than this
+
+
+class PosePredictor(FilterBank):
+    "Per anchor constant velocity and angular velocity extrapolation"
+    def __init__(self, capacity=16, latency=0.05, velocity_smoothing=0.5, max_speed=3.0, max_angular_speed=2 * np.pi):
+        self.latency = latency                          # seconds added after sending: network, Unity, display
+        self.velocity_smoothing = velocity_smoothing    # weight of the newest velocity sample
+        self.max_speed = max_speed                      # m/s, faster estimates are clamped
+        self.max_angular_speed = max_angular_speed      # rad/s
+        self.horizon = latency
+        super().__init__(3, capacity)
+
+    def allocate(self, capacity):
+        old = getattr(self, 'position', None)
+        position = np.zeros((capacity, 3))
+        velocity = np.zeros((capacity, 3))
+        position_time = np.full(capacity, np.nan)
+        quaternion = np.tile([0.0, 0.0, 0.0, 1.0], (capacity, 1))
+        angular = np.zeros((capacity, 3))
+        rotation_time = np.full(capacity, np.nan)
+        if old is not None:
+            n = old.shape[0]
+            position[:n] = old
+            velocity[:n] = self.velocity
+            position_time[:n] = self.position_time
+            quaternion[:n] = self.quaternion
+            angular[:n] = self.angular
+            rotation_time[:n] = self.rotation_time
+        self.position, self.velocity, self.position_time = position, velocity, position_time
+        self.quaternion, self.angular, self.rotation_time = quaternion, angular, rotation_time
+
+    def reset_rows(self, rows):
+        self.velocity[rows] = 0.0
+        self.position_time[rows] = np.nan
+        self.angular[rows] = 0.0
+        self.rotation_time[rows] = np.nan
+
+    def set_horizon(self, capture_time, now):
+        "Extrapolate by the time since capture plus the downstream latency"
+        self.horizon = float(np.clip(now - capture_time + self.latency, 0.0, MAX_HORIZON))
+        return self.horizon
+
+    def filter(self, rows, values, timestamp):
+        dt = timestamp - self.position_time[rows]
+        # a repeated capture time (same snapshot sent twice) keeps the old velocity
+        moved = np.isfinite(dt) & (dt > 0)
+        if np.any(moved):
+            moved_rows = rows[moved]
+            sample = (values[moved] - self.position[moved_rows]) / dt[moved, None]
+            sample = clamp_norm(sample, self.max_speed)
+            self.velocity[moved_rows] += self.velocity_smoothing * (sample - self.velocity[moved_rows])
+        self.position[rows] = values
+        self.position_time[rows] = timestamp
+        return values + self.velocity[rows] * self.horizon
+
+    def rotate(self, ids, quaternions, timestamp):
+        "Add (N,4) xyzw quaternions seen at timestamp, return them extrapolated by the horizon"
+        quaternions = np.asarray(quaternions, dtype=np.float64).reshape(-1, 4)
+        if len(ids) == 0:
+            return quaternions
+        rows = self.rows(ids)
+        current = Rotation.from_quat(quaternions)
+
+        dt = timestamp - self.rotation_time[rows]
+        moved = np.isfinite(dt) & (dt > 0)
+        if np.any(moved):
+            moved_rows = rows[moved]
+            # body frame angular velocity from the rotation between the last two samples
+            delta = Rotation.from_quat(self.quaternion[moved_rows]).inv() * current[np.flatnonzero(moved)]
+            sample = clamp_norm(delta.as_rotvec() / dt[moved, None], self.max_angular_speed)
+            self.angular[moved_rows] += self.velocity_smoothing * (sample - self.angular[moved_rows])
+        self.quaternion[rows] = quaternions
+        self.rotation_time[rows] = timestamp
+        return (current * Rotation.from_rotvec(self.angular[rows] * self.horizon)).as_quat()
+
+
+def clamp_norm(vectors, limit):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors * np.minimum(1.0, limit / np.maximum(norms, 1e-12))
@@ -0,0 +1,119 @@
+# LAB4
+
+'''
+Coarse to fine ArUco detection.
+Candidate markers are found on a half or quarter resolution grayscale image,
+which is where detectMarkers spends its time (adaptive thresholding and
+contour search scale with the pixel count). Only the corners of the markers
+that were found are refined to sub-pixel accuracy on the full resolution
+image before they go to deprojection.
+Run this file on a recording to compare latency and corner error against the
+full resolution detectMarkers call:
+    python PyramidDetection.py recording.npz --dictionary DICT_6X6_1000
+'''
+import time
+import argparse
+import numpy as np
+import cv2
+
+from FrameSource import open_source
+
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+
+
+class PyramidDetector:
+    "detectMarkers on a downscaled grayscale image, corners refined on the full resolution one"
+    def __init__(self, detector, scale=0.5, window=5):
+        self.detector = detector    # cv2.aruco.ArucoDetector or anything with the same detectMarkers
+        self.scale = scale          # 0.5 or 0.25 of the input resolution
+        self.window = window        # half size of the cornerSubPix search window in full resolution pixels
+
+    def detectMarkers(self, image):
+        "Same result layout as cv2.aruco.ArucoDetector.detectMarkers: (corners, ids or None, rejected)"
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        small = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        corners, ids, rejected = self.detector.detectMarkers(small)
+        if ids is None:
+            return (), None, rejected
+
+        # all corners of the frame in one cornerSubPix call, pixel centers shift with the scale
+        points = (np.concatenate(corners).reshape(-1, 2) + 0.5) / self.scale - 0.5
+        points = np.ascontiguousarray(points, dtype=np.float32)
+        cv2.cornerSubPix(gray, points, (self.window, self.window), (-1, -1), SUBPIX_CRITERIA)
+        refined = tuple(points.reshape(-1, 1, 4, 2))
+        return refined, ids, rejected
+
+
+def corner_errors(reference, candidate):
+    "Pixel distance of every corner of the markers both detections found, matched by id"
+    ref_corners, ref_ids = reference
+    corners, ids = candidate
+    if ref_ids is None:
+        return np.empty(0), 0
+    if ids is None:
+        # every marker of the reference was missed
+        return np.empty(0), len(ref_ids)
+    found = {int(marker_id[0]): c.reshape(4, 2) for marker_id, c in zip(ids, corners)}
+    errors = []
+    missed = 0
+    for marker_id, c in zip(ref_ids, ref_corners):
+        match = found.get(int(marker_id[0]))
+        if match is None:
+            missed += 1
+            continue
+        errors.append(np.linalg.norm(match - c.reshape(4, 2), axis=1))
+    return (np.concatenate(errors) if errors else np.empty(0)), missed
+
+
+def benchmark_pyramid(images, dictionary, scales=(0.5, 0.25)):
+    "Latency and corner error of every pyramid scale against full resolution detectMarkers"
+    detector = cv2.aruco.ArucoDetector(cv2.aruco.getPredefinedDictionary(dictionary), cv2.aruco.DetectorParameters())
+
+    full_ms = []
+    reference = []
+    for image in images:
+        t0 = time.perf_counter()
+        corners, ids, _ = detector.detectMarkers(image)
+        full_ms.append((time.perf_counter() - t0) * 1000.0)
+        reference.append((corners, ids))
+    markers = sum(0 if ids is None else len(ids) for _, ids in reference)
+    print(f"full resolution: {np.mean(full_ms):.2f} ms mean, {np.percentile(full_ms, 95):.2f} ms p95, "
+          f"{markers} markers", flush=True)
+
+    results = {1.0: {'mean_ms': float(np.mean(full_ms))}}
+    for scale in scales:
+        pyramid = PyramidDetector(detector, scale=scale)
+        ms = []
+        errors = []
+        missed = 0
+        for image, ref in zip(images, reference):
+            t0 = time.perf_counter()
+            corners, ids, _ = pyramid.detectMarkers(image)
+            ms.append((time.perf_counter() - t0) * 1000.0)
+            frame_errors, frame_missed = corner_errors(ref, (corners, ids))
+            errors.append(frame_errors)
+            missed += frame_missed
+        errors = np.concatenate(errors)
+        mean_error = float(np.mean(errors)) if len(errors) else float('nan')
+        max_error = float(np.max(errors)) if len(errors) else float('nan')
+        print(f"scale {scale}: {np.mean(ms):.2f} ms mean, {np.percentile(ms, 95):.2f} ms p95, "
+              f"corner error {mean_error:.3f} px mean {max_error:.3f} px max, {missed} markers missed", flush=True)
+        results[scale] = {'mean_ms': float(np.mean(ms)), 'mean_error': mean_error,
+                          'max_error': max_error, 'missed': missed}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', help="recorded .bag or .npz file")
+    parser.add_argument('--dictionary', default='DICT_6X6_1000', help="cv2.aruco predefined dictionary name")
+    parser.add_argument('--frames', type=int, default=200, help="number of frames to compare")
+    args = parser.parse_args()
+
+    images = []
+    with open_source(args.source, real_time=False) as source:
+        for frame in source:
+            images.append(frame.color_image.copy())
+            if len(images) >= args.frames:
+                break
+    benchmark_pyramid(images, getattr(cv2.aruco, args.dictionary))
@@ -0,0 +1,231 @@
+# LAB4
+
+'''
+Filter bank for marker and joint smoothing.
+Every tracked ID owns a row in preallocated arrays, so one update call
+smooths all IDs of a frame with a few vectorized numpy operations and no
+per-marker allocation. Three filters share the interface:
+    MovingAverage   box filter over the last N samples with running sums
+    OneEuroFilter   speed adaptive low pass, smooth at rest and low lag in motion
+    KalmanFilter    constant velocity Kalman filter per axis
+The box filter lags by half its window, which is why smoothing was taken out
+of the lab4 client; the One-Euro and Kalman filters keep the lag small.
+'''
+from abc import ABC, abstractmethod
+import numpy as np
+
+FILTERS = ('average', 'one_euro', 'kalman')
+
+
+class FilterBank(ABC):
+    "Rows of filter state indexed by marker or joint ID, grown by doubling"
+    def __init__(self, dim=3, capacity=16):
+        self.dim = dim
+        self.capacity = capacity
+        self.slots = {}         # id -> row
+        self.free = list(range(capacity - 1, -1, -1))
+        self.allocate(capacity)
+
+    @abstractmethod
+    def allocate(self, capacity):
+        "Create or grow the state arrays to capacity rows"
+
+    @abstractmethod
+    def reset_rows(self, rows):
+        "Forget the state of these rows, the next sample starts them fresh"
+
+    @abstractmethod
+    def filter(self, rows, values, timestamp):
+        "Smooth (N,dim) values for these rows, return (N,dim)"
+
+    def rows(self, ids):
+        rows = np.empty(len(ids), dtype=np.intp)
+        new = []
+        for i, id in enumerate(ids):
+            row = self.slots.get(id)
+            if row is None:
+                if not self.free:
+                    self.free = list(range(2 * self.capacity - 1, self.capacity - 1, -1))
+                    self.capacity *= 2
+                    self.allocate(self.capacity)
+                row = self.free.pop()
+                self.slots[id] = row
+                new.append(row)
+            rows[i] = row
+        if new:
+            self.reset_rows(np.array(new, dtype=np.intp))
+        return rows
+
+    def update(self, ids, values, timestamp):
+        "Add one sample per ID taken at timestamp (seconds), return the smoothed (N,dim) values"
+        values = np.asarray(values, dtype=np.float64).reshape(-1, self.dim)
+        if len(ids) == 0:
+            return values
+        return self.filter(self.rows(ids), values, timestamp)
+
+    def remove(self, ids):
+        for id in ids:
+            row = self.slots.pop(id, None)
+            if row is not None:
+                self.free.append(row)
+
+    def retain(self, ids):
+        "Drop every ID that is not in ids"
+        self.remove([id for id in self.slots if id not in ids])
+
+
+class MovingAverage(FilterBank):
+    "Mean of the last window samples from a ring buffer and a running sum"
+    def __init__(self, dim=3, capacity=16, window=5):
+        self.window = window
+        super().__init__(dim, capacity)
+
+    def allocate(self, capacity):
+        old = getattr(self, 'buffer', None)
+        buffer = np.zeros((capacity, self.window, self.dim))
+        sums = np.zeros((capacity, self.dim))
+        heads = np.zeros(capacity, dtype=np.intp)
+        counts = np.zeros(capacity, dtype=np.intp)
+        if old is not None:
+            n = old.shape[0]
+            buffer[:n] = old
+            sums[:n] = self.sums
+            heads[:n] = self.heads
+            counts[:n] = self.counts
+        self.buffer, self.sums, self.heads, self.counts = buffer, sums, heads, counts
+
+    def reset_rows(self, rows):
+        self.buffer[rows] = 0.0
+        self.sums[rows] = 0.0
+        self.heads[rows] = 0
+        self.counts[rows] = 0
+
+    def filter(self, rows, values, timestamp):
+        heads = self.heads[rows]
+        # the slot under the head holds the oldest sample once the window is full, zero before
+        self.sums[rows] += values - self.buffer[rows, heads]
+        self.buffer[rows, heads] = values
+        self.heads[rows] = (heads + 1) % self.window
+        self.counts[rows] = np.minimum(self.counts[rows] + 1, self.window)
+        return self.sums[rows] / self.counts[rows, None]
+
+
+class OneEuroFilter(FilterBank):
+    "One-Euro filter (Casiez et al. 2012), cutoff rises with speed"
+    def __init__(self, dim=3, capacity=16, min_cutoff=0.5, beta=10.0, derivative_cutoff=1.0):
+        self.min_cutoff = min_cutoff                # Hz at rest, lower is smoother
+        self.beta = beta                            # cutoff increase per m/s, higher is less lag
+        self.derivative_cutoff = derivative_cutoff  # Hz for the speed estimate
+        super().__init__(dim, capacity)
+
+    def allocate(self, capacity):
+        old = getattr(self, 'value', None)
+        value = np.zeros((capacity, self.dim))
+        speed = np.zeros((capacity, self.dim))
+        last = np.full(capacity, np.nan)
+        if old is not None:
+            n = old.shape[0]
+            value[:n] = old
+            speed[:n] = self.speed
+            last[:n] = self.last
+        self.value, self.speed, self.last = value, speed, last
+
+    def reset_rows(self, rows):
+        self.last[rows] = np.nan
+
+    def filter(self, rows, values, timestamp):
+        last = self.last[rows]
+        fresh = np.isnan(last)
+        dt = np.where(fresh, 1.0, np.maximum(timestamp - last, 1e-6))[:, None]
+
+        previous = np.where(fresh[:, None], values, self.value[rows])
+        previous_speed = np.where(fresh[:, None], 0.0, self.speed[rows])
+        alpha_d = smoothing_factor(dt, self.derivative_cutoff)
+        speed = previous_speed + alpha_d * ((values - previous) / dt - previous_speed)
+
+        cutoff = self.min_cutoff + self.beta * np.linalg.norm(speed, axis=1, keepdims=True)
+        alpha = smoothing_factor(dt, cutoff)
+        smoothed = previous + alpha * (values - previous)
+
+        self.value[rows] = smoothed
+        self.speed[rows] = speed
+        self.last[rows] = timestamp
+        return smoothed
+
+
+class KalmanFilter(FilterBank):
+    "Constant velocity Kalman filter, the same 2x2 covariance serves all axes of a row"
+    def __init__(self, dim=3, capacity=16, process_noise=4.0, measurement_noise=1e-4):
+        self.process_noise = process_noise          # acceleration variance, (m/s^2)^2
+        self.measurement_noise = measurement_noise  # position variance, m^2
+        super().__init__(dim, capacity)
+
+    def allocate(self, capacity):
+        old = getattr(self, 'position', None)
+        position = np.zeros((capacity, self.dim))
+        velocity = np.zeros((capacity, self.dim))
+        covariance = np.zeros((capacity, 2, 2))
+        last = np.full(capacity, np.nan)
+        if old is not None:
+            n = old.shape[0]
+            position[:n] = old
+            velocity[:n] = self.velocity
+            covariance[:n] = self.covariance
+            last[:n] = self.last
+        self.position, self.velocity, self.covariance, self.last = position, velocity, covariance, last
+
+    def reset_rows(self, rows):
+        self.last[rows] = np.nan
+
+    def filter(self, rows, values, timestamp):
+        last = self.last[rows]
+        fresh = np.isnan(last)
+        dt = np.where(fresh, 0.0, np.maximum(timestamp - last, 0.0))
+
+        # predict
+        position = self.position[rows] + self.velocity[rows] * dt[:, None]
+        velocity = self.velocity[rows]
+        p = self.covariance[rows]
+        q = self.process_noise
+        p00 = p[:, 0, 0] + dt * (2 * p[:, 0, 1] + dt * p[:, 1, 1]) + q * dt ** 4 / 4
+        p01 = p[:, 0, 1] + dt * p[:, 1, 1] + q * dt ** 3 / 2
+        p11 = p[:, 1, 1] + q * dt ** 2
+
+        # update with the measured position
+        s = p00 + self.measurement_noise
+        k0 = p00 / s
+        k1 = p01 / s
+        innovation = values - position
+        position = position + k0[:, None] * innovation
+        velocity = velocity + k1[:, None] * innovation
+        covariance = np.stack([np.stack([(1 - k0) * p00, (1 - k0) * p01], axis=1),
+                               np.stack([(1 - k0) * p01, p11 - k1 * p01], axis=1)], axis=1)
+
+        # a new row starts at the measurement, at rest and with a wide velocity prior
+        position[fresh] = values[fresh]
+        velocity[fresh] = 0.0
+        covariance[fresh] = np.array([[self.measurement_noise, 0.0], [0.0, 1.0]])
+
+        self.position[rows] = position
+        self.velocity[rows] = velocity
+        self.covariance[rows] = covariance
+        self.last[rows] = timestamp
+        return position
+
+
+def smoothing_factor(dt, cutoff):
+    tau = 1.0 / (2 * np.pi * cutoff)
+    return 1.0 / (1.0 + tau / dt)
+
+
+def create_filter_bank(kind, dim=3, **params):
+    "'average', 'one_euro' or 'kalman' filter bank, None for 'none'"
+    if kind is None or kind == 'none':
+        return None
+    if kind == 'average':
+        return MovingAverage(dim, **params)
+    if kind == 'one_euro':
+        return OneEuroFilter(dim, **params)
+    if kind == 'kalman':
+        return KalmanFilter(dim, **params)
+    raise ValueError(f"unknown filter: {kind}")
@@ -0,0 +1,88 @@
+# LAB4
+
+'''
+Detection snapshots shared between the camera thread and the socket thread.
+The camera thread publishes one immutable MarkerSnapshot per frame by
+replacing a single reference, which is atomic in CPython, so readers never
+take a lock and never copy: whatever snapshot they picked up stays
+consistent while the next one is built. The sequence number tells a reader
+whether anything arrived since the snapshot it used last.
+SendScheduler wakes the socket thread when a snapshot is published instead of
+polling, at most max_rate times per second; snapshots published while it
+waits for its slot coalesce into the newest one.
+'''
+import time
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+MarkerSnapshot = namedtuple('MarkerSnapshot', ['sequence', 'capture_time', 'coordinates', 'rotations', 'frame_number'],
+                            defaults=(None,))
+MarkerSnapshot.__doc__ = "Marker positions and quaternions of one frame, read-only mappings keyed by marker id"
+
+EMPTY = MappingProxyType({})
+
+
+class SnapshotBuffer:
+    "Latest MarkerSnapshot, published by reference swap from a single writer thread"
+    def __init__(self):
+        self.current = MarkerSnapshot(0, None, EMPTY, EMPTY)
+        self.changed = threading.Condition()    # only for waking waiters, readers never take it
+
+    def publish(self, coordinates, rotations, capture_time, frame_number=None):
+        "Hand over dicts the writer no longer touches, return the new snapshot"
+        # the back buffer is filled completely before the single assignment makes it the front one
+        snapshot = MarkerSnapshot(self.current.sequence + 1, capture_time,
+                                  MappingProxyType(coordinates), MappingProxyType(rotations), frame_number)
+        self.current = snapshot
+        with self.changed:
+            self.changed.notify_all()
+        return snapshot
+
+    def latest(self):
+        return self.current
+
+    def newer(self, sequence):
+        "Latest snapshot if it is newer than sequence, else None"
+        snapshot = self.current
+        return snapshot if snapshot.sequence > sequence else None
+
+    def wait(self, sequence, timeout=None):
+        "Block until a snapshot newer than sequence is published or timeout passes, return the latest"
+        with self.changed:
+            self.changed.wait_for(lambda: self.current.sequence > sequence, timeout)
+        return self.current
+
+
+class SendScheduler:
+    "Hands the sender each new snapshot as soon as it is published, no more than max_rate per second"
+    def __init__(self, snapshots, max_rate=30.0, timeout=1.0):
+        self.snapshots = snapshots
+        self.interval = 1.0 / max_rate
+        self.timeout = timeout      # seconds without a new snapshot before the latest one is sent again
+        self.sequence = 0
+        self.last_send = 0.0
+        self.sends = 0
+        self.coalesced = 0          # snapshots replaced by a newer one before they were sent
+        self.repeats = 0            # sends of an unchanged snapshot after a timeout
+
+    def next(self):
+        "Wait for the next snapshot worth sending"
+        # hold the rate limit first, whatever is published meanwhile coalesces into the latest snapshot
+        delay = self.last_send + self.interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        snapshot = self.snapshots.wait(self.sequence, self.timeout)
+        if snapshot.sequence == self.sequence:
+            self.repeats += 1
+        else:
+            self.coalesced += max(snapshot.sequence - self.sequence - 1, 0) if self.sends else 0
+        self.sequence = snapshot.sequence
+        self.last_send = time.perf_counter()
+        self.sends += 1
+        return snapshot
+
+    def report(self):
+        "Print how many snapshots were sent, coalesced and repeated"
+        print(f"send scheduler: {self.sends} sends, {self.coalesced} snapshots coalesced, "
+              f"{self.repeats} repeats after {self.timeout:.1f} s without detections", flush=True)
@@ -0,0 +1,85 @@
+# LAB4
+
+'''
+Sparse depth -> color alignment.
+rs.align reprojects the whole depth frame into the color camera every frame,
+but we only ever look at a few hundred color pixels. SparseAligner maps just
+those pixels into the raw depth image with the depth/color extrinsics, the
+same search rs2_project_color_pixel_to_depth_pixel does, vectorized over all
+queries and split into a coarse and a fine pass.
+'''
+import numpy as np
+
+from Deprojection import get_deprojector, project_points, extrinsics_to_matrix
+
+
+class SparseAligner:
+    "Color-aligned depth for individual color pixels of one depth/color stream pair"
+    def __init__(self, depth_intrinsics, color_intrinsics, depth_to_color, color_to_depth,
+                 depth_scale, depth_min=0.3, depth_max=6.0, coarse_stride=4, max_steps=256):
+        self.depth_intrinsics = depth_intrinsics
+        self.color_intrinsics = color_intrinsics
+        self.depth_scale = depth_scale
+        self.depth_min = depth_min      # meters, search range along the epipolar line
+        self.depth_max = depth_max
+        self.coarse_stride = coarse_stride   # depth pixels between samples of the first pass
+        self.max_steps = max_steps
+        self.depth_to_color = extrinsics_to_matrix(depth_to_color)
+        self.color_to_depth = extrinsics_to_matrix(color_to_depth)
+        self.depth_deprojector = get_deprojector(depth_intrinsics, depth_scale)
+        self.color_deprojector = get_deprojector(color_intrinsics, depth_scale)
+
+    def depth_at(self, pixels, depth_image):
+        "(N,2) color pixels + raw z16 depth image -> (N,) depth in meters in the color camera, 0 where missing"
+        pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 2)
+        count = pixels.shape[0]
+        if count == 0:
+            return np.zeros(0)
+
+        # epipolar segment in the depth image between depth_min and depth_max
+        rotation, translation = self.color_to_depth
+        ends = []
+        for depth in (self.depth_min, self.depth_max):
+            points = self.color_deprojector.deproject_depth(pixels, np.full(count, depth))
+            ends.append(project_points(self.depth_intrinsics, points @ rotation.T + translation))
+        start, end = ends
+
+        # coarse pass every few depth pixels along the segment, then every pixel around the best hit
+        length = np.max(np.linalg.norm(end - start, axis=1))
+        steps = int(np.clip(np.ceil(length / self.coarse_stride) + 1, 2, self.max_steps))
+        t = np.broadcast_to(np.linspace(0.0, 1.0, steps), (count, steps))
+        best_t, _, _ = self.search(pixels, start, end, t, depth_image)
+
+        pixel_step = 1.0 / max(length, 1.0)
+        offsets = np.arange(-self.coarse_stride, self.coarse_stride + 1) * pixel_step
+        t = np.clip(best_t[:, None] + offsets[None, :], 0.0, 1.0)
+        _, aligned, found = self.search(pixels, start, end, t, depth_image)
+        return np.where(found, aligned, 0.0)
+
+    def search(self, pixels, start, end, t, depth_image):
+        "Candidate depth pixels at fractions t of each segment -> best t, its color depth and whether one was usable"
+        count, steps = t.shape
+        width = self.depth_intrinsics.width
+        height = self.depth_intrinsics.height
+
+        candidates = start[:, None, :] + (end - start)[:, None, :] * t[..., None]
+        candidates = np.rint(candidates).astype(np.int32).reshape(-1, 2)
+        inside = ((candidates[:, 0] >= 0) & (candidates[:, 0] < width) &
+                  (candidates[:, 1] >= 0) & (candidates[:, 1] < height))
+        candidates[:, 0] = np.clip(candidates[:, 0], 0, width - 1)
+        candidates[:, 1] = np.clip(candidates[:, 1], 0, height - 1)
+
+        # project every candidate depth pixel back into color and keep the closest one
+        depth = depth_image[candidates[:, 1], candidates[:, 0]] * self.depth_scale
+        rotation, translation = self.depth_to_color
+        points = self.depth_deprojector.deproject_depth(candidates, depth) @ rotation.T + translation
+        with np.errstate(all='ignore'):
+            projected = project_points(self.color_intrinsics, points)
+        distance = np.sum((projected.reshape(count, steps, 2) - pixels[:, None, :]) ** 2, axis=-1)
+        usable = (inside & (depth > 0)).reshape(count, steps)
+        distance = np.where(usable, distance, np.inf)
+
+        rows = np.arange(count)
+        best = np.argmin(distance, axis=1)
+        aligned = points.reshape(count, steps, 3)[rows, best, 2]
+        return t[rows, best], aligned, np.any(usable, axis=1)
@@ -0,0 +1,256 @@
+# LAB4
+
+'''
+Python stand-in for the Unity Server.cs, so the protocol can be load tested
+without a headset. It keeps the same contract as both Unity projects:
+    - listens on port 13456, sends {'listOfAnchors': [...]} every
+      anchor_interval seconds (lab2: the placed quest anchors, lab4: left
+      hand, right hand and cart)
+    - answers the wire format offer, decodes JSON and binary tracking
+      messages, keyframes and deltas, skips keepalive frames
+    - the first message after connecting is the lab2 calibration reply,
+      its round trip from the anchors it answers is measured
+    - applies tracking datagrams on port 13457, newest sequence only
+Messages come out as the full anchor lists Server.cs hands to Update,
+{list name: {anchor id: (original xyz, transformed xyz)}}.
+Slow consumers: delay sleeps before every message is applied, like a slow
+Update; stall stops reading for stall seconds every stall_every seconds,
+so the socket buffers fill up and the client has to drop or queue.
+Run it on its own and point a client at it:
+    python StandInServer.py [--flavor lab2|lab4] [--anchors 2,5,10] [--delay 0] [--stall 0 --stall-every 0]
+'''
+import json
+import time
+import socket
+import argparse
+import threading
+
+from Framing import FramedConnection
+from Datagrams import DatagramReceiver, DATAGRAM_PORT, MAX_DATAGRAM
+from WireFormat import is_binary, decode_tracking, JSON_VERSION, BINARY_VERSION, MARKER, DISAPPEARED
+from Deltas import FULL, KEYFRAME
+
+PORT = 13456
+ANCHOR_INTERVAL = 0.5       # seconds, Server.cs Update sends the anchors every 0.5 s
+
+# anchor id -> unity position, per project
+ANCHOR_SETS = {
+    'lab2': {2: (0.2, 0.0, 1.02), 5: (0.5, 0.0, 1.05), 10: (1.0, 0.2, 1.1)},
+    'lab4': {1: (-0.3, 1.2, 0.5), 2: (0.3, 1.2, 0.5), 3: (0.0, 0.0, 1.0)},
+}
+# names of the anchor lists in the tracking messages; lab4 splits records by the MARKER flag
+LISTS = {
+    'lab2': ('transformedAnchors',),
+    'lab4': ('transformedSkeletonAnchors', 'transformedArcuoAnchors'),
+}
+# delta fields of the JSON messages per list (Deltas.py)
+DELTA_FIELDS = {
+    'transformedAnchors': ('appearedAnchors', 'disappearedAnchors'),
+    'transformedSkeletonAnchors': ('appearedSkeletonAnchors', 'disappearedSkeletonAnchors'),
+    'transformedArcuoAnchors': ('appearedArcuoAnchors', 'disappearedArcuoAnchors'),
+}
+
+
+def xyz(position):
+    return (position['x'], position['y'], position['z'])
+
+
+class StandInServer:
+    "Server.cs contract over TCP and UDP, one client at a time, handing decoded messages to on_message"
+    def __init__(self, flavor='lab2', anchors=None, host='127.0.0.1', port=PORT, datagram_port=DATAGRAM_PORT,
+                 anchor_interval=ANCHOR_INTERVAL, delay=0.0, stall=0.0, stall_every=0.0, on_message=None):
+        self.flavor = flavor
+        self.lists = LISTS[flavor]
+        self.anchors = dict(ANCHOR_SETS[flavor] if anchors is None else anchors)
+        self.address = (host, port)
+        self.datagram_address = (host, datagram_port)
+        self.anchor_interval = anchor_interval
+        self.delay = delay
+        self.stall = stall
+        self.stall_every = stall_every
+        self.on_message = on_message    # called with (full message, receive time) on the receiving thread
+        self.running = False
+        self.lock = threading.Lock()    # tcp and udp share the delta state, like Lock in Server.cs
+        self.state = {name: {} for name in self.lists}
+        self.connection = None
+        self.client_address = None
+        self.datagrams = None
+        self.anchors_sent = None        # perf_counter of the newest anchor message, for the calibration round trip
+        self.calibrated = False
+        self.calibration_rtt = None
+        self.connects = 0
+        self.messages = 0
+        self.bytes = 0
+        self.stalls = 0
+
+    def start(self):
+        self.running = True
+        self.listener = socket.create_server(self.address)
+        self.datagram_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.datagram_sock.bind(self.datagram_address)
+        self.datagram_sock.settimeout(0.5)
+        self.datagrams = DatagramReceiver(self.datagram_sock)
+        self.threads = [threading.Thread(target=target, daemon=True)
+                        for target in (self.accept_loop, self.datagram_loop, self.anchor_loop)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.listener.close()
+        if self.connection is not None:
+            self.connection.sock.close()
+        for thread in self.threads:
+            thread.join(2.0)
+        self.datagram_sock.close()
+
+    def report(self):
+        "Print what arrived, the calibration round trip and the stalls"
+        rtt = f"{self.calibration_rtt * 1000:.1f} ms" if self.calibration_rtt is not None else "none"
+        stale = self.datagrams.stale if self.datagrams else 0
+        print(f"stand-in server: {self.connects} connects, {self.messages} messages, {self.bytes} bytes, "
+              f"{stale} stale datagrams, calibration round trip {rtt}, {self.stalls} stalls", flush=True)
+
+    # connection
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                sock, address = self.listener.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.lock:
+                # a new client starts with a keyframe, its own datagram sequence and an uncalibrated scene
+                self.state = {name: {} for name in self.lists}
+                self.datagrams.last = None
+                self.calibrated = self.flavor != 'lab2'
+            self.connection = FramedConnection(sock)
+            self.client_address = address[0]
+            self.connects += 1
+            try:
+                self.read_loop(self.connection)
+            except (OSError, ConnectionError, ValueError) as e:
+                print(f"stand-in server: client gone ({e!r})", flush=True)
+            self.client_address = None
+            self.connection = None
+            sock.close()
+
+    def read_loop(self, connection):
+        next_stall = time.perf_counter() + self.stall_every if self.stall and self.stall_every else None
+        while self.running:
+            if next_stall is not None and time.perf_counter() >= next_stall:
+                # a slow consumer, the kernel buffers fill up behind us
+                self.stalls += 1
+                time.sleep(self.stall)
+                next_stall = time.perf_counter() + self.stall_every
+            payload = connection.receive_frame()
+            if not payload:
+                continue    # keepalive
+            if not is_binary(payload):
+                msg = json.loads(payload)
+                if 'protocolVersions' in msg:
+                    version = BINARY_VERSION if BINARY_VERSION in msg['protocolVersions'] else JSON_VERSION
+                    self.send({'protocolVersion': version})
+                    continue
+            self.handle(payload)
+
+    def datagram_loop(self):
+        while self.running:
+            try:
+                datagram, address = self.datagram_sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if address[0] != self.client_address:
+                continue
+            with self.lock:
+                payload = self.datagrams.accept(datagram)
+            if payload is not None:
+                self.handle(bytes(payload))
+
+    def anchor_loop(self):
+        msg = {'listOfAnchors': [{'id': anchor_id, 'position': dict(zip('xyz', position))}
+                                 for anchor_id, position in self.anchors.items()]}
+        while self.running:
+            connection = self.connection
+            if connection is not None:
+                try:
+                    self.anchors_sent = time.perf_counter()
+                    connection.send(msg)
+                except OSError:
+                    pass
+            time.sleep(self.anchor_interval)
+
+    def send(self, msg):
+        self.connection.send(msg)
+
+    # messages
+
+    def handle(self, payload):
+        "Decode one tracking message, rebuild the full anchor lists, hand them on after the configured delay"
+        received = time.perf_counter()
+        if self.delay:
+            time.sleep(self.delay)
+        mode, updates, disappeared = self.decode(payload)
+        with self.lock:
+            self.messages += 1
+            self.bytes += len(payload)
+            if not self.calibrated:
+                # Server.cs takes the first message as the calibration reply to the anchors
+                self.calibrated = True
+                if self.anchors_sent is not None:
+                    self.calibration_rtt = received - self.anchors_sent
+            for name in self.lists:
+                if mode == FULL or mode == KEYFRAME:
+                    self.state[name] = {}
+                for anchor_id in disappeared[name]:
+                    self.state[name].pop(anchor_id, None)
+                self.state[name].update(updates[name])
+            message = {name: dict(anchors) for name, anchors in self.state.items()}
+        if self.on_message is not None:
+            self.on_message(message, received)
+
+    def decode(self, payload):
+        "(Deltas mode, {list: {id: (original, transformed)}}, {list: [disappeared ids]}) of a JSON or binary message"
+        updates = {name: {} for name in self.lists}
+        disappeared = {name: [] for name in self.lists}
+        if is_binary(payload):
+            mode, _, records = decode_tracking(payload)
+            for record in records:
+                name = self.lists[-1] if record['flags'] & MARKER else self.lists[0]
+                if record['flags'] & DISAPPEARED:
+                    disappeared[name].append(int(record['anchor_id']))
+                else:
+                    updates[name][int(record['anchor_id'])] = (tuple(record['original'].tolist()),
+                                                               tuple(record['transformed'].tolist()))
+            return mode, updates, disappeared
+        msg = json.loads(payload)
+        for name in self.lists:
+            for anchor in msg.get(name, []):
+                updates[name][anchor['anchor_id']] = (xyz(anchor['original_position']), xyz(anchor['transformed_position']))
+            disappeared[name] = msg.get(DELTA_FIELDS[name][1], [])
+        return msg.get('deltaMode', FULL), updates, disappeared
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--flavor', choices=list(ANCHOR_SETS), default='lab2', help="which Server.cs to stand in for")
+    parser.add_argument('--anchors', type=lambda s: [int(i) for i in s.split(',')], help="anchor ids to send, placed on a line")
+    parser.add_argument('--delay', type=float, default=0.0, help="seconds spent on every message before it is applied")
+    parser.add_argument('--stall', type=float, default=0.0, help="seconds the server stops reading, every --stall-every seconds")
+    parser.add_argument('--stall-every', type=float, default=0.0)
+    parser.add_argument('--host', default='0.0.0.0')
+    args = parser.parse_args()
+    anchors = {anchor_id: (0.3 * i, 0.1 * (i % 2), 1.0 + 0.05 * i) for i, anchor_id in enumerate(args.anchors)} if args.anchors else None
+
+    server = StandInServer(args.flavor, anchors, args.host, delay=args.delay, stall=args.stall, stall_every=args.stall_every).start()
+    try:
+        while True:
+            time.sleep(5.0)
+            server.report()
+    except KeyboardInterrupt:
+        server.stop()
+        server.report()
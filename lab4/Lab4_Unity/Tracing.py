@@ -0,0 +1,151 @@
+# LAB4
+
+'''
+Per-stage latency of the tracking pipeline, from the camera frame to the socket.
+Every stage records its perf_counter duration into a log-linear histogram in
+the style of HdrHistogram: 32 sub-buckets per power of two microseconds, so
+any value is kept within about 3 % however long the run, in fixed memory and
+O(1) per sample. Stages (each optional, whatever the running client does):
+    wait_for_frames, align            FrameSource.RealSenseSource.read
+    detect_markers, depth_lookup      ArUco detection and marker depth / pose
+    mediapipe, skeleton               MediaPipe inference and its 3D joints
+    transform                         T_matrix (and the delta encoder in lab4)
+    encode, send                      JSON / binary encoding, socket write or sendto
+    capture_to_send                   sensor timestamp (arrival time for replays and when
+                                      the camera clock is not the host clock) to the socket send
+Frames handed to frame() are checked for gaps in their camera frame numbers,
+the frames that never reached detection. The module keeps one tracer, all
+threads record into it; report() prints every stage and optionally writes
+the histograms as JSON, the baseline to compare optimizations against.
+'''
+import json
+import time
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+SUB_BUCKET_BITS = 5                 # 32 sub-buckets per power of two, about 3 % resolution
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_MICROSECONDS = 60 * 1000 * 1000  # longer samples count as one minute
+BUCKETS = (MAX_MICROSECONDS.bit_length() - SUB_BUCKET_BITS + 1) * SUB_BUCKETS
+REPORT_PERCENTILES = (50, 90, 99, 99.9)
+
+
+def bucket_index(microseconds):
+    "Bucket of a value: exact below 64 us, then 32 buckets per power of two"
+    exponent = max(microseconds.bit_length() - SUB_BUCKET_BITS - 1, 0)
+    return exponent * SUB_BUCKETS + (microseconds >> exponent)
+
+
+def bucket_value(index):
+    "Lowest microsecond value of a bucket, or of an array of buckets"
+    exponent = np.maximum(index // SUB_BUCKETS - 1, 0)
+    return (index - exponent * SUB_BUCKETS) << exponent
+
+
+class LatencyHistogram:
+    "Log-linear histogram of durations, HdrHistogram style"
+    def __init__(self):
+        self.counts = np.zeros(BUCKETS, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.max_frame = None       # frame number of the slowest sample, when the stage knows it
+
+    def record(self, seconds, frame_number=None):
+        microseconds = min(max(int(seconds * 1e6), 0), MAX_MICROSECONDS)
+        self.counts[bucket_index(microseconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+            self.max_frame = frame_number
+
+    def percentile(self, q):
+        "Value in seconds below which q percent of the samples fall"
+        if self.count == 0:
+            return 0.0
+        bucket = int(np.searchsorted(np.cumsum(self.counts), q / 100.0 * self.count))
+        # the top of the bucket, so a percentile never reads lower than the samples
+        return min(bucket_value(bucket + 1) / 1e6, self.max)
+
+    def mean(self):
+        return self.total / max(self.count, 1)
+
+    def dump(self):
+        "Plain dict: summary plus the nonzero buckets as [lowest microseconds, count]"
+        rows = np.flatnonzero(self.counts)
+        values = bucket_value(rows)
+        return {
+            'count': self.count,
+            'mean_ms': self.mean() * 1000.0,
+            'max_ms': self.max * 1000.0,
+            'max_frame': self.max_frame,
+            **{f'p{q}_ms': self.percentile(q) * 1000.0 for q in REPORT_PERCENTILES},
+            'buckets_us': [[int(value), int(self.counts[row])] for value, row in zip(values, rows)],
+        }
+
+
+class FrameTracer:
+    "Histograms per stage plus frame-drop detection, shared by every thread"
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}        # stage -> LatencyHistogram, in the order stages first ran
+        self.frames = 0
+        self.last_number = None
+        self.dropped = 0            # frame numbers skipped between two traced frames
+        self.gaps = 0               # times frames were skipped
+        self.started = time.perf_counter()
+
+    def record(self, stage, seconds, frame_number=None):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram()
+            histogram.record(seconds, frame_number)
+
+    @contextmanager
+    def stage(self, name, frame_number=None):
+        "Time the body of a with block as one sample of stage name"
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0, frame_number)
+
+    def frame(self, frame):
+        "Note a frame that reached detection, gaps in the camera frame numbers are dropped frames"
+        with self.lock:
+            self.frames += 1
+            # a looping recording starts over, that is not a drop
+            if self.last_number is not None and frame.number > self.last_number + 1:
+                self.dropped += frame.number - self.last_number - 1
+                self.gaps += 1
+            self.last_number = frame.number
+
+    def sent(self, capture_time, frame_number=None):
+        "The frame captured at capture_time (time.time() seconds) just went out on the socket"
+        if capture_time is not None:
+            self.record('capture_to_send', time.time() - capture_time, frame_number)
+
+    def report(self, path=None):
+        "Print the stage percentiles and the dropped frames, write the histograms as JSON to path"
+        with self.lock:
+            elapsed = time.perf_counter() - self.started
+            histograms = {stage: histogram.dump() for stage, histogram in self.histograms.items()}
+            frames, dropped, gaps = self.frames, self.dropped, self.gaps
+        print(f"trace: {frames} frames in {elapsed:.1f} s, {dropped} dropped in {gaps} gaps "
+              f"({100.0 * dropped / max(frames + dropped, 1):.1f} %)", flush=True)
+        for stage, summary in histograms.items():
+            worst = f" (frame {summary['max_frame']})" if summary['max_frame'] is not None else ""
+            print(f"trace: {stage:16s} {summary['count']:7d} x, mean {summary['mean_ms']:7.2f} ms, "
+                  + ", ".join(f"p{q} {summary[f'p{q}_ms']:7.2f}" for q in REPORT_PERCENTILES)
+                  + f", max {summary['max_ms']:7.2f} ms{worst}", flush=True)
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump({'elapsed_s': elapsed, 'frames': frames, 'dropped': dropped, 'gaps': gaps,
+                           'stages': histograms}, f, indent=1)
+            print(f"trace: histograms written to {path}", flush=True)
+
+
+tracer = FrameTracer()
@@ -0,0 +1,113 @@
+# LAB4
+
+'''
+Marker track lifecycle.
+Instead of dropping every marker on the first frame it is not detected, each
+marker ID owns a row in a small array table with its last pose, the frame it
+was last seen on, a hit count and a state:
+    TENTATIVE   seen, but not on enough frames yet to be trusted
+    CONFIRMED   seen on the latest frame
+    COASTING    missed for fewer frames than its TTL, keeps its last pose
+    LOST        missed for longer than its TTL, the row is freed
+update() only reports state transitions, so callers react to a marker
+appearing or disappearing instead of diffing dicts every frame.
+'''
+import numpy as np
+
+TENTATIVE = 0
+CONFIRMED = 1
+COASTING = 2
+LOST = 3
+STATE_NAMES = ('tentative', 'confirmed', 'coasting', 'lost')
+
+CONFIRM_HITS = 2
+COAST_TTL = 10      # frames a confirmed marker keeps its pose without detections
+
+
+class TrackTable:
+    "Per marker ID pose, last seen frame, hits and lifecycle state in preallocated arrays"
+    def __init__(self, confirm_hits=CONFIRM_HITS, coast_ttl=COAST_TTL, ttl=None, capacity=16):
+        self.confirm_hits = confirm_hits    # detections before a track is confirmed
+        self.coast_ttl = coast_ttl          # default grace period in frames
+        self.ttl = dict(ttl or {})          # marker id -> grace period overriding coast_ttl
+        self.rows = {}                      # marker id -> row
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.positions = np.zeros((capacity, 3))
+        self.rotations = np.zeros((capacity, 4))
+        self.has_rotation = np.zeros(capacity, dtype=bool)
+        self.last_seen = np.zeros(capacity, dtype=np.int64)
+        self.hits = np.zeros(capacity, dtype=np.int64)
+        self.states = np.full(capacity, LOST, dtype=np.int8)
+        self.ttls = np.zeros(capacity, dtype=np.int64)
+
+    def grow(self):
+        extra = len(self.ids)
+        self.ids = np.concatenate([self.ids, np.full(extra, -1, dtype=np.int64)])
+        self.positions = np.concatenate([self.positions, np.zeros((extra, 3))])
+        self.rotations = np.concatenate([self.rotations, np.zeros((extra, 4))])
+        self.has_rotation = np.concatenate([self.has_rotation, np.zeros(extra, dtype=bool)])
+        self.last_seen = np.concatenate([self.last_seen, np.zeros(extra, dtype=np.int64)])
+        self.hits = np.concatenate([self.hits, np.zeros(extra, dtype=np.int64)])
+        self.states = np.concatenate([self.states, np.full(extra, LOST, dtype=np.int8)])
+        self.ttls = np.concatenate([self.ttls, np.zeros(extra, dtype=np.int64)])
+
+    def row(self, marker_id):
+        row = self.rows.get(marker_id)
+        if row is None:
+            free = np.flatnonzero(self.ids < 0)
+            if len(free) == 0:
+                self.grow()
+                free = np.flatnonzero(self.ids < 0)
+            row = int(free[0])
+            self.rows[marker_id] = row
+            self.ids[row] = marker_id
+            self.hits[row] = 0
+            self.has_rotation[row] = False
+            self.ttls[row] = self.ttl.get(marker_id, self.coast_ttl)
+        return row
+
+    def update(self, frame_number, positions, rotations=None):
+        "Add one frame of detections (id -> position, id -> quaternion), return [(id, old state, new state)]"
+        rotations = rotations or {}
+        for marker_id, position in positions.items():
+            row = self.row(marker_id)
+            self.positions[row] = position
+            if marker_id in rotations:
+                self.rotations[row] = rotations[marker_id]
+                self.has_rotation[row] = True
+            self.last_seen[row] = frame_number
+            self.hits[row] += 1
+
+        # states are only written below, new rows still read lost here
+        old_states = self.states.copy()
+        active = self.ids >= 0
+        age = frame_number - self.last_seen
+        seen = active & (age == 0)
+        confirmed = seen & (self.hits >= self.confirm_hits)
+        self.states[seen & ~confirmed] = TENTATIVE
+        self.states[confirmed] = CONFIRMED
+        missed = active & (age > 0)
+        self.states[missed & (old_states != TENTATIVE) & (age <= self.ttls)] = COASTING
+        # tentative tracks get no grace period, a single hit is not a marker yet
+        self.states[missed & ((old_states == TENTATIVE) | (age > self.ttls))] = LOST
+
+        changed = np.flatnonzero((self.states != old_states) & active)
+        # a new track comes from a free row, so it shows up as lost -> tentative
+        transitions = [(int(self.ids[row]), int(old_states[row]), int(self.states[row])) for row in changed]
+        for row in changed:
+            if self.states[row] == LOST:
+                del self.rows[int(self.ids[row])]
+                self.ids[row] = -1
+        return transitions
+
+    def visible(self):
+        "Confirmed and coasting tracks as (id -> position list, id -> quaternion list)"
+        rows = np.flatnonzero((self.states == CONFIRMED) | (self.states == COASTING))
+        positions = {int(self.ids[row]): self.positions[row].tolist() for row in rows}
+        rotations = {int(self.ids[row]): self.rotations[row].tolist() for row in rows if self.has_rotation[row]}
+        return positions, rotations
+
+
+def describe(transitions):
+    "Readable transition list for logging"
+    return ", ".join(f"{marker_id}: {STATE_NAMES[old]} -> {STATE_NAMES[new]}" for marker_id, old, new in transitions)
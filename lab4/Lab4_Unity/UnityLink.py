@@ -0,0 +1,215 @@
+# LAB4
+
+'''
+Connection to the Unity server that survives Unity restarts.
+The socket lives on an asyncio loop in its own thread, with a reader task
+and a writer task per connection, so the camera and frame loops never touch
+it: they queue outgoing messages with send / send_frame and pick up the
+newest anchor message with newer / wait. When the connection drops, the
+link reconnects with exponential backoff and negotiates the wire format
+again; the caller's on_connect callback then restores whatever Unity lost
+(a keyframe, the calibration message), while T_matrix stays with the caller.
+    outbound    bounded queue, the oldest message is dropped when it is full
+                and everything is dropped while disconnected, poses go stale
+    keepalive   an empty frame after keepalive seconds without a message,
+                Server.cs skips it; no message from Unity for read_timeout
+                seconds (it sends its anchors twice a second) means it is gone
+'''
+import json
+import time
+import random
+import socket
+import asyncio
+import threading
+
+from Framing import HEADER, MAX_FRAME, encode_frame
+from WireFormat import VERSIONS, JSON_VERSION, NEGOTIATE_TIMEOUT
+from Tracing import tracer
+
+QUEUE_SIZE = 8              # outgoing messages, about a quarter second at 30 Hz
+KEEPALIVE_INTERVAL = 1.0    # seconds without a sent message before an empty frame goes out
+READ_TIMEOUT = 5.0          # seconds without a message from unity before the connection counts as dead
+CONNECT_TIMEOUT = 3.0
+RECONNECT_MIN = 0.5         # seconds, doubled after every failed attempt
+RECONNECT_MAX = 8.0
+
+
+class UnityLink:
+    "Framed connection to Unity on a background asyncio loop, reconnecting with backoff"
+    def __init__(self, host, port, wire_format='json', queue_size=QUEUE_SIZE, keepalive=KEEPALIVE_INTERVAL,
+                 read_timeout=READ_TIMEOUT, on_connect=None):
+        self.host = host
+        self.port = port
+        self.wire_format = wire_format
+        self.queue_size = queue_size
+        self.keepalive = keepalive
+        self.read_timeout = read_timeout
+        self.on_connect = on_connect        # called on the loop thread after every (re)connect with the link
+        self.wire_version = JSON_VERSION
+        self.connected = False
+        self.loop = None
+        self.queue = None
+        self.thread = None
+        self.task = None
+        # newest message from unity, handed to other threads under the condition
+        self.received = threading.Condition()
+        self.message_count = 0
+        self.message = None
+        self.connects = 0
+        self.sent = 0
+        self.dropped = 0                    # messages dropped on a full queue or while disconnected
+
+    def start(self):
+        ready = threading.Event()
+        self.thread = threading.Thread(target=asyncio.run, args=(self.main(ready),), daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.task.cancel)
+            self.thread.join()
+        self.report()
+
+    # caller side, any thread
+
+    def send(self, msg):
+        with tracer.stage('encode'):
+            payload = json.dumps(msg).encode('utf-8')
+        self.send_frame(payload)
+
+    def send_frame(self, payload):
+        "Queue a payload for the writer task, never blocks"
+        if not self.connected:
+            self.dropped += 1
+            return
+        self.loop.call_soon_threadsafe(self.enqueue, payload)
+
+    def newer(self, count):
+        "(message count, newest message) if a message arrived after count messages, else None"
+        with self.received:
+            return (self.message_count, self.message) if self.message_count > count else None
+
+    def wait(self, count, timeout=None):
+        "Block until a message newer than count arrives or timeout passes, None on timeout"
+        with self.received:
+            self.received.wait_for(lambda: self.message_count > count, timeout)
+        return self.newer(count)
+
+    def report(self):
+        print(f"unity link: {self.connects} connects, {self.sent} messages sent, {self.dropped} dropped", flush=True)
+
+    # loop side
+
+    def enqueue(self, payload):
+        if self.queue is None:
+            self.dropped += 1
+            return
+        if self.queue.full():
+            # the oldest pose is the least useful one
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(payload)
+
+    def deliver(self, msg):
+        with self.received:
+            self.message_count += 1
+            self.message = msg
+            self.received.notify_all()
+
+    async def main(self, ready):
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        ready.set()
+        try:
+            await self.run()
+        except asyncio.CancelledError:
+            pass
+
+    async def run(self):
+        delay = RECONNECT_MIN
+        while True:
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError) as e:
+                # jitter, so several clients do not hammer a restarting server in lockstep
+                wait = delay * random.uniform(0.8, 1.2)
+                print(f"unity not reachable ({e or 'timeout'}), retrying in {wait:.1f} s", flush=True)
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, RECONNECT_MAX)
+                continue
+            delay = RECONNECT_MIN
+            await self.session(reader, writer)
+
+    async def session(self, reader, writer):
+        "One connection: negotiate, then run reader and writer until either fails"
+        sock = writer.get_extra_info('socket')
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        tasks = []
+        try:
+            self.wire_version = await self.negotiate(reader, writer) if self.wire_format == 'binary' else JSON_VERSION
+            self.queue = asyncio.Queue(self.queue_size)
+            self.connected = True
+            self.connects += 1
+            print(f"connected to unity, wire format version {self.wire_version}", flush=True)
+            if self.on_connect is not None:
+                self.on_connect(self)
+            tasks = [asyncio.create_task(self.read_loop(reader)), asyncio.create_task(self.write_loop(writer))]
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            error = next(iter(done)).exception()
+            print(f"connection to unity lost ({error!r}), reconnecting", flush=True)
+        except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+            print(f"connection to unity failed ({e!r}), reconnecting", flush=True)
+        finally:
+            self.connected = False
+            self.queue = None
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def read_message(self, reader):
+        "Next JSON message, None for an empty keepalive frame"
+        length, = HEADER.unpack(await reader.readexactly(HEADER.size))
+        if length > MAX_FRAME:
+            raise ValueError(f"frame of {length} bytes, the stream is out of sync")
+        payload = await reader.readexactly(length)
+        return json.loads(payload) if length else None
+
+    async def negotiate(self, reader, writer):
+        "Offer the wire format versions, JSON when the server does not answer"
+        writer.write(encode_frame(json.dumps({'protocolVersions': list(VERSIONS)}).encode('utf-8')))
+        await writer.drain()
+        deadline = time.monotonic() + NEGOTIATE_TIMEOUT
+        try:
+            while True:
+                msg = await asyncio.wait_for(self.read_message(reader), max(deadline - time.monotonic(), 0))
+                if msg is None:
+                    continue
+                if 'protocolVersion' in msg:
+                    return msg['protocolVersion'] if msg['protocolVersion'] in VERSIONS else JSON_VERSION
+                self.deliver(msg)
+        except asyncio.TimeoutError:
+            print("server did not answer the version offer, using JSON", flush=True)
+            return JSON_VERSION
+
+    async def read_loop(self, reader):
+        while True:
+            msg = await asyncio.wait_for(self.read_message(reader), self.read_timeout)
+            if msg is not None:
+                self.deliver(msg)
+
+    async def write_loop(self, writer):
+        while True:
+            try:
+                payload = await asyncio.wait_for(self.queue.get(), self.keepalive)
+            except asyncio.TimeoutError:
+                payload = b''
+            t0 = time.perf_counter()
+            writer.write(encode_frame(payload))
+            await writer.drain()
+            if payload:
+                # the socket write, plus waiting on a full send buffer
+                tracer.record('send', time.perf_counter() - t0)
+                self.sent += 1
@@ -0,0 +1,152 @@
+# LAB4
+
+'''
+Binary encoding of tracking messages.
+A JSON tracking message spends a few hundred bytes and a dozen float() calls
+per anchor on nested {'x', 'y', 'z'} dicts. Version 1 of the wire format
+packs every anchor into one fixed 48 byte record written straight from the
+numpy arrays:
+    header   uint8 kind (TRACKING_FRAME + Deltas mode), uint8 version, uint16 count, uint32 sequence
+    record   int32 anchor_id, uint32 flags, float32[3] original position,
+             float32[3] transformed position, float32[4] rotation xyzw
+all little endian. A JSON payload starts with '{', so both kinds share the
+length prefixed frames of Framing.py. The client offers the versions it
+speaks at connect (UnityLink.negotiate) and uses binary only when the server
+answers with 1 (Server.cs DecodeTransformedBinary); an old server never
+answers and the client stays on JSON.
+Run this file to compare encode and decode times against the JSON messages:
+    python WireFormat.py [--anchors 8] [--iterations 2000]
+'''
+import time
+import json
+import struct
+import argparse
+import numpy as np
+
+from Deltas import FULL, DELTA
+
+JSON_VERSION = 0
+BINARY_VERSION = 1
+VERSIONS = (BINARY_VERSION, JSON_VERSION)  # preferred first
+NEGOTIATE_TIMEOUT = 2.0     # seconds to wait for the server's answer before falling back to JSON
+
+TRACKING_FRAME = 0x01       # full message, TRACKING_FRAME + KEYFRAME and + DELTA for delta mode (Deltas.py)
+HEADER = struct.Struct('<BBHI')
+RECORD = np.dtype([('anchor_id', '<i4'), ('flags', '<u4'), ('original', '<f4', 3),
+                   ('transformed', '<f4', 3), ('rotation', '<f4', 4)])
+
+# record flags
+HAS_ROTATION = 1
+MARKER = 2      # lab4: an arcuo marker, otherwise a skeleton joint
+APPEARED = 4    # delta mode: first record of this anchor since it was last gone
+DISAPPEARED = 8 # delta mode: the anchor is gone, the record carries no pose
+
+
+def encode_tracking(ids, original, transformed, rotations=None, flags=None, sequence=0, mode=FULL,
+                    disappeared=(), disappeared_flags=0):
+    "(N,) ids, (N,3) positions and optional (N,4) quaternions (nan rows for none) -> binary payload"
+    count = len(ids)
+    records = np.zeros(count + len(disappeared), dtype=RECORD)
+    anchors = records[:count]
+    anchors['anchor_id'] = ids
+    anchors['original'] = original
+    anchors['transformed'] = transformed
+    if flags is not None:
+        anchors['flags'] = flags
+    if rotations is not None:
+        rotations = np.asarray(rotations, dtype=np.float64).reshape(-1, 4)
+        has_rotation = ~np.isnan(rotations[:, 0])
+        anchors['rotation'][has_rotation] = rotations[has_rotation]
+        anchors['flags'] |= np.where(has_rotation, HAS_ROTATION, 0).astype(np.uint32)
+    records['anchor_id'][count:] = disappeared
+    records['flags'][count:] = np.asarray(disappeared_flags, dtype=np.uint32) | DISAPPEARED
+    return HEADER.pack(TRACKING_FRAME + mode, BINARY_VERSION, len(records), sequence & 0xFFFFFFFF) + records.tobytes()
+
+
+def is_binary(payload):
+    return len(payload) > 0 and TRACKING_FRAME <= payload[0] <= TRACKING_FRAME + DELTA
+
+
+def decode_tracking(payload):
+    "Reference decoder: binary payload -> (Deltas mode, sequence, record array viewing the payload)"
+    kind, version, count, sequence = HEADER.unpack_from(payload)
+    if not is_binary(payload) or version != BINARY_VERSION:
+        raise ValueError(f"not a version {BINARY_VERSION} tracking frame: kind {kind}, version {version}")
+    records = np.frombuffer(payload, dtype=RECORD, count=count, offset=HEADER.size)
+    return kind - TRACKING_FRAME, sequence, records
+
+
+def anchor_dicts(records):
+    "Records -> the anchor dicts of the JSON messages, to check both encodings carry the same anchors"
+    anchors = []
+    for record in records:
+        anchor = {
+            'anchor_id': int(record['anchor_id']),
+            'original_position': dict(zip('xyz', record['original'].tolist())),
+            'transformed_position': dict(zip('xyz', record['transformed'].tolist())),
+        }
+        if record['flags'] & HAS_ROTATION:
+            anchor['rotation'] = dict(zip('xyzw', record['rotation'].tolist()))
+        anchors.append(anchor)
+    return anchors
+
+
+def json_message(ids, original, transformed, rotations=None):
+    "The JSON tracking message of the lab2 client for the same arrays"
+    anchors = []
+    for i, anchor_id in enumerate(ids):
+        anchor = {
+            'anchor_id': int(anchor_id),
+            'original_position': {'x': float(original[i][0]), 'y': float(original[i][1]), 'z': float(original[i][2])},
+            'transformed_position': {'x': float(transformed[i][0]), 'y': float(transformed[i][1]), 'z': float(transformed[i][2])},
+        }
+        if rotations is not None and not np.isnan(rotations[i][0]):
+            quat = rotations[i]
+            anchor['rotation'] = {'x': float(quat[0]), 'y': float(quat[1]), 'z': float(quat[2]), 'w': float(quat[3])}
+        anchors.append(anchor)
+    return {'transformedAnchors': anchors}
+
+
+def benchmark_encoding(anchors=8, iterations=2000, seed=0):
+    "Encode and decode time per message and bytes per message, JSON against binary"
+    rng = np.random.default_rng(seed)
+    ids = np.arange(anchors)
+    original = rng.normal(size=(anchors, 3))
+    transformed = rng.normal(size=(anchors, 3))
+    rotations = rng.normal(size=(anchors, 4))
+    rotations /= np.linalg.norm(rotations, axis=1, keepdims=True)
+
+    results = {}
+    for name, encode, decode in (
+            ('json', lambda: json.dumps(json_message(ids, original, transformed, rotations)).encode('utf-8'),
+             lambda payload: json.loads(payload)),
+            ('binary', lambda: encode_tracking(ids, original, transformed, rotations),
+             lambda payload: decode_tracking(payload))):
+        t0 = time.perf_counter()
+        for _ in range(iterations):
+            payload = encode()
+        encode_us = (time.perf_counter() - t0) / iterations * 1e6
+        t0 = time.perf_counter()
+        for _ in range(iterations):
+            decode(payload)
+        decode_us = (time.perf_counter() - t0) / iterations * 1e6
+        print(f"{name}: {len(payload)} bytes, encode {encode_us:.1f} us, decode {decode_us:.1f} us "
+              f"({anchors} anchors)", flush=True)
+        results[name] = {'bytes': len(payload), 'encode_us': encode_us, 'decode_us': decode_us}
+
+    # both encodings carry the same anchors up to float32 rounding
+    _, _, records = decode_tracking(encode_tracking(ids, original, transformed, rotations))
+    reference = json_message(ids, original, transformed, rotations)['transformedAnchors']
+    for decoded, expected in zip(anchor_dicts(records), reference):
+        assert decoded['anchor_id'] == expected['anchor_id']
+        for key in ('original_position', 'transformed_position', 'rotation'):
+            assert np.allclose(list(decoded[key].values()), list(expected[key].values()), atol=1e-6)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--anchors', type=int, default=8, help="anchors per message")
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+    benchmark_encoding(args.anchors, args.iterations)
@@ -0,0 +1,10 @@
+# LAB4
+
+'''
+The lab4 modules import each other by bare name, run the tests with them on the path:
+    python -m pytest lab4/Lab4_Unity/tests
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
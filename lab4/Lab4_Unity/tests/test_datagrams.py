@@ -0,0 +1,72 @@
+# LAB4
+
+'''
+Sequence numbered datagrams: serial comparison across the uint32 wraparound,
+the receiver dropping stale datagrams and the sender dropping oversize ones.
+'''
+import socket
+import pytest
+
+from Datagrams import HEADER, MAX_DATAGRAM, DatagramChannel, DatagramReceiver, Impairment, is_newer
+
+
+@pytest.mark.parametrize('sequence, last, newer', [
+    (2, 1, True),
+    (1, 2, False),
+    (5, 5, False),
+    (0, 0xFFFFFFFF, True),          # wrapped around
+    (3, 0xFFFFFFFE, True),
+    (0xFFFFFFFF, 0, False),         # from before the wraparound
+    (0x7FFFFFFF, 0, True),          # just under half the sequence space ahead
+    (0x80000000, 0, False),         # half the space ahead is ambiguous, treated as old
+])
+def test_is_newer(sequence, last, newer):
+    assert is_newer(sequence, last) == newer
+
+
+def datagram(sequence, payload=b'x'):
+    return HEADER.pack(sequence) + payload
+
+
+def test_receiver_drops_stale_datagrams_across_wraparound():
+    receiver = DatagramReceiver(None)
+    applied = [sequence for sequence in (0xFFFFFFFE, 0xFFFFFFFF, 0xFFFFFFFD, 0, 2, 1, 3)
+               if receiver.accept(datagram(sequence)) is not None]
+    assert applied == [0xFFFFFFFE, 0xFFFFFFFF, 0, 2, 3]
+    assert (receiver.applied, receiver.stale) == (5, 2)
+
+
+def test_receiver_ignores_truncated_datagram():
+    receiver = DatagramReceiver(None)
+    assert receiver.accept(b'\x01\x00') is None
+    assert bytes(receiver.accept(datagram(1, b'payload'))) == b'payload'
+
+
+def test_impairment_reorders_with_the_next_datagram():
+    impairment = Impairment(reorder=1.0, seed=0)
+    assert impairment.apply(b'a') == []
+    assert impairment.apply(b'b') == [b'b', b'a']
+
+
+@pytest.fixture
+def receiver_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(1.0)
+    yield sock
+    sock.close()
+
+
+def test_channel_sequences_and_oversize_drop(receiver_socket):
+    channel = DatagramChannel('127.0.0.1', receiver_socket.getsockname()[1])
+    receiver = DatagramReceiver(receiver_socket)
+    channel.send({'transformedAnchors': []})
+    # too large for one datagram: dropped and counted, no sequence number used
+    channel.send_frame(bytes(MAX_DATAGRAM))
+    channel.send_frame(b'\x01binary')
+    channel.close()
+
+    assert bytes(receiver.receive()) == b'{"transformedAnchors": []}'
+    assert bytes(receiver.receive()) == b'\x01binary'
+    assert receiver.last == 2
+    assert (channel.sent, channel.dropped) == (2, 1)
@@ -0,0 +1,89 @@
+# LAB4
+
+'''
+DeltaEncoder: dead-bands, keyframes and anchors appearing and disappearing.
+'''
+import numpy as np
+
+from Deltas import KEYFRAME, DELTA, DeltaEncoder
+
+IDENTITY = [0.0, 0.0, 0.0, 1.0]
+
+
+def test_first_update_is_a_keyframe():
+    encoder = DeltaEncoder()
+    mode, send, appeared, disappeared = encoder.update([1, 2], [[0, 0, 1], [1, 0, 1]])
+    assert mode == KEYFRAME
+    assert send.tolist() == [True, True]
+    assert (appeared, disappeared) == ([1, 2], [])
+
+
+def test_position_deadband():
+    encoder = DeltaEncoder(position_deadband=0.01)
+    encoder.update([1, 2], [[0, 0, 1], [1, 0, 1]])
+    # nothing moved beyond the dead-band, nothing to send
+    assert encoder.update([1, 2], [[0.005, 0, 1], [1, 0, 1]]) is None
+    mode, send, _, _ = encoder.update([1, 2], [[0.02, 0, 1], [1, 0, 1]])
+    assert mode == DELTA
+    assert send.tolist() == [True, False]
+
+
+def test_slow_drift_adds_up():
+    encoder = DeltaEncoder(position_deadband=0.01)
+    encoder.update([1], [[0, 0, 1]])
+    sent = [encoder.update([1], [[0.004 * step, 0, 1]]) is not None for step in range(1, 5)]
+    # compared against the last sent pose, not the previous sample
+    assert sent == [False, False, True, False]
+
+
+def test_per_anchor_deadband():
+    encoder = DeltaEncoder(position_deadband=0.01, deadbands={2: 0.1})
+    encoder.update([1, 2], [[0, 0, 1], [1, 0, 1]])
+    _, send, _, _ = encoder.update([1, 2], [[0.05, 0, 1], [1.05, 0, 1]])
+    assert send.tolist() == [True, False]
+
+
+def test_rotation_deadband_and_rotation_appearing():
+    encoder = DeltaEncoder(rotation_deadband=0.1)
+    encoder.update([1, 2], [[0, 0, 1], [1, 0, 1]], [IDENTITY, [np.nan] * 4])
+    small = [0.0, 0.0, np.sin(0.02), np.cos(0.02)]      # 0.04 rad about z
+    assert encoder.update([1, 2], [[0, 0, 1], [1, 0, 1]], [small, [np.nan] * 4]) is None
+    large = [0.0, 0.0, np.sin(0.1), np.cos(0.1)]        # 0.2 rad
+    _, send, _, _ = encoder.update([1, 2], [[0, 0, 1], [1, 0, 1]], [large, IDENTITY])
+    assert send.tolist() == [True, True]
+
+
+def test_forced_keyframe_after_interval_and_reset():
+    encoder = DeltaEncoder(keyframe_interval=3)
+    modes = [encoder.update([1], [[0, 0, 1]]) for _ in range(7)]
+    # a static scene still gets a keyframe every interval ticks
+    assert [None if update is None else update[0] for update in modes] == [KEYFRAME, None, None, KEYFRAME, None, None, KEYFRAME]
+
+    encoder.reset()
+    mode, send, _, _ = encoder.update([1], [[0, 0, 1]])
+    assert mode == KEYFRAME
+    assert send.tolist() == [True]
+
+
+def test_appear_and_disappear():
+    encoder = DeltaEncoder()
+    encoder.update([1, 2], [[0, 0, 1], [1, 0, 1]])
+    mode, send, appeared, disappeared = encoder.update([1, 3], [[0, 0, 1], [2, 0, 1]])
+    assert mode == DELTA
+    assert send.tolist() == [False, True]
+    assert (appeared, disappeared) == ([3], [2])
+
+    # a gone anchor is reported once, and comes back as appeared
+    assert encoder.update([1, 3], [[0, 0, 1], [2, 0, 1]]) is None
+    _, send, appeared, disappeared = encoder.update([1, 2, 3], [[0, 0, 1], [1, 0, 1], [2, 0, 1]])
+    assert send.tolist() == [False, True, False]
+    assert (appeared, disappeared) == ([2], [])
+
+
+def test_disappearing_alone_is_sent():
+    encoder = DeltaEncoder()
+    encoder.update([1, 2], [[0, 0, 1], [1, 0, 1]])
+    mode, send, appeared, disappeared = encoder.update([1], [[0, 0, 1]])
+    assert mode == DELTA
+    assert send.tolist() == [False]
+    assert (appeared, disappeared) == ([], [2])
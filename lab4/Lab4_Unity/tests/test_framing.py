@@ -0,0 +1,88 @@
+# LAB4
+
+'''
+FrameDecoder and FramedConnection: frames split over reads and several frames per read.
+'''
+import json
+import socket
+import pytest
+
+from Framing import HEADER, MAX_FRAME, FrameDecoder, FramedConnection, encode_frame
+
+
+def frames_of(decoder):
+    frames = []
+    while True:
+        frame = decoder.next_frame()
+        if frame is None:
+            return frames
+        frames.append(bytes(frame))
+
+
+def test_frame_split_over_feeds():
+    payload = b'{"anchor_id": 7}'
+    data = encode_frame(payload)
+    decoder = FrameDecoder()
+    # header and payload both arrive in pieces
+    for i in range(len(data) - 1):
+        decoder.feed(data[i:i + 1])
+        assert decoder.next_frame() is None
+    decoder.feed(data[-1:])
+    assert frames_of(decoder) == [payload]
+
+
+def test_frames_coalesced_in_one_feed():
+    payloads = [b'first', b'', b'third frame']
+    decoder = FrameDecoder()
+    decoder.feed(b''.join(encode_frame(payload) for payload in payloads))
+    assert frames_of(decoder) == payloads
+
+
+def test_frame_larger_than_the_buffer():
+    payload = bytes(range(256)) * 200
+    decoder = FrameDecoder(capacity=64)
+    data = encode_frame(payload)
+    frames = []
+    for i in range(0, len(data), 50):
+        decoder.feed(data[i:i + 50])
+        frames += frames_of(decoder)
+    assert frames == [payload]
+
+
+def test_length_beyond_max_frame_is_out_of_sync():
+    decoder = FrameDecoder()
+    decoder.feed(HEADER.pack(MAX_FRAME + 1))
+    with pytest.raises(ValueError):
+        decoder.next_frame()
+
+
+def test_connection_over_socket_pair():
+    client, server = socket.socketpair()
+    try:
+        messages = [{'listOfAnchors': [{'anchor_id': i}]} for i in range(20)]
+        stream = b''.join(encode_frame(json.dumps(msg).encode('utf-8')) for msg in messages)
+        # odd sized writes, so reads split frames and also return several at once
+        for i in range(0, len(stream), 37):
+            server.sendall(stream[i:i + 37])
+        connection = FramedConnection(client)
+        assert [connection.receive() for _ in messages] == messages
+
+        FramedConnection(server).send({'transformedAnchors': []})
+        # the keepalive carries no message
+        server.sendall(encode_frame(b''))
+        FramedConnection(server).send({'done': True})
+        assert connection.receive() == {'transformedAnchors': []}
+        assert connection.receive() == {'done': True}
+    finally:
+        client.close()
+        server.close()
+
+
+def test_receive_raises_when_closed():
+    client, server = socket.socketpair()
+    server.sendall(HEADER.pack(10) + b'abc')
+    server.close()
+    connection = FramedConnection(client)
+    with pytest.raises(ConnectionError):
+        connection.receive()
+    client.close()
@@ -0,0 +1,79 @@
+# LAB4
+
+'''
+Filter banks: row bookkeeping shared by all filters and the behaviour of each filter.
+'''
+import numpy as np
+import pytest
+
+from Smoothing import FilterBank, MovingAverage, OneEuroFilter, KalmanFilter, create_filter_bank
+
+
+def test_filter_bank_is_abstract():
+    with pytest.raises(TypeError):
+        FilterBank()
+
+
+def test_moving_average_window():
+    bank = MovingAverage(dim=1, window=3)
+    smoothed = [bank.update([1], [[value]], step)[0, 0] for step, value in enumerate([3.0, 6.0, 9.0, 12.0])]
+    assert smoothed == pytest.approx([3.0, 4.5, 6.0, 9.0])
+
+
+def test_rows_grow_and_are_reused():
+    bank = MovingAverage(dim=1, capacity=2, window=2)
+    ids = list(range(5))
+    values = np.arange(5, dtype=float)[:, None]
+    np.testing.assert_allclose(bank.update(ids, values, 0.0), values)
+    assert bank.capacity == 8
+    # state survived the growth
+    np.testing.assert_allclose(bank.update(ids, values + 2, 1.0), values + 1)
+
+    bank.retain({0, 1})
+    assert set(bank.slots) == {0, 1}
+    # a reused row starts fresh
+    np.testing.assert_allclose(bank.update([9], [[100.0]], 2.0), [[100.0]])
+
+
+@pytest.mark.parametrize('kind', ['one_euro', 'kalman'])
+def test_constant_signal_passes_unchanged(kind):
+    bank = create_filter_bank(kind)
+    point = np.array([[0.1, -0.2, 1.5]])
+    for step in range(30):
+        smoothed = bank.update([4], point, step / 30.0)
+    np.testing.assert_allclose(smoothed, point, atol=1e-9)
+
+
+@pytest.mark.parametrize('kind', ['one_euro', 'kalman'])
+def test_noise_is_reduced(kind):
+    rng = np.random.default_rng(0)
+    bank = create_filter_bank(kind)
+    truth = np.array([0.0, 0.0, 1.5])
+    errors = []
+    for step in range(300):
+        noisy = truth + rng.normal(scale=0.005, size=3)
+        smoothed = bank.update([1], noisy[None], step / 30.0)[0]
+        if step >= 30:
+            errors.append((np.linalg.norm(noisy - truth), np.linalg.norm(smoothed - truth)))
+    raw, filtered = np.mean(errors, axis=0)
+    assert filtered < 0.7 * raw
+
+
+def test_kalman_tracks_constant_velocity_without_lag():
+    bank = KalmanFilter(dim=1)
+    for step in range(60):
+        smoothed = bank.update([1], [[0.5 * step / 30.0]], step / 30.0)
+    assert smoothed[0, 0] == pytest.approx(0.5 * 59 / 30.0, abs=1e-3)
+    assert bank.velocity[bank.slots[1], 0] == pytest.approx(0.5, abs=1e-2)
+
+
+def test_one_euro_first_sample_is_passed_through():
+    bank = OneEuroFilter(dim=3)
+    np.testing.assert_allclose(bank.update([1, 2], [[1, 2, 3], [4, 5, 6]], 0.0), [[1, 2, 3], [4, 5, 6]])
+
+
+def test_create_filter_bank():
+    assert create_filter_bank('none') is None
+    assert isinstance(create_filter_bank('average', window=4), MovingAverage)
+    with pytest.raises(ValueError):
+        create_filter_bank('median')
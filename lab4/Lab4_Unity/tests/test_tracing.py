@@ -0,0 +1,81 @@
+# LAB4
+
+'''
+Latency histogram bucket math and the frame tracer's drop counting.
+'''
+import json
+import numpy as np
+import pytest
+
+from Tracing import SUB_BUCKETS, BUCKETS, MAX_MICROSECONDS, LatencyHistogram, FrameTracer, bucket_index, bucket_value
+
+
+def test_exact_below_two_sub_bucket_ranges():
+    for microseconds in range(2 * SUB_BUCKETS):
+        index = bucket_index(microseconds)
+        assert index == microseconds
+        assert bucket_value(index) == microseconds
+
+
+def test_buckets_are_monotonic_and_contain_their_values():
+    values = np.unique(np.geomspace(1, MAX_MICROSECONDS, 5000).astype(np.int64))
+    indices = [bucket_index(int(value)) for value in values]
+    assert all(a <= b for a, b in zip(indices, indices[1:]))
+    assert max(indices) < BUCKETS
+    for value, index in zip(values, indices):
+        assert bucket_value(index) <= value < bucket_value(index + 1)
+
+
+def test_bucket_width_within_resolution():
+    for value in (100, 1000, 12345, 1000000, MAX_MICROSECONDS):
+        index = bucket_index(value)
+        width = bucket_value(index + 1) - bucket_value(index)
+        assert width / bucket_value(index) <= 1.0 / SUB_BUCKETS
+
+
+def test_bucket_value_of_an_array():
+    indices = np.array([0, 63, 64, 100])
+    assert bucket_value(indices).tolist() == [int(bucket_value(int(index))) for index in indices]
+
+
+def test_percentiles():
+    histogram = LatencyHistogram()
+    for milliseconds in range(1, 101):
+        histogram.record(milliseconds / 1000.0, frame_number=milliseconds)
+    assert histogram.count == 100
+    assert histogram.max_frame == 100
+    assert histogram.mean() == pytest.approx(0.0505)
+    # the top of the bucket, so within the resolution above the sample and never above the max
+    assert 0.050 <= histogram.percentile(50) <= 0.050 * (1 + 1.0 / SUB_BUCKETS) + 1e-6
+    assert 0.099 <= histogram.percentile(99) <= 0.1
+    assert histogram.percentile(100) == pytest.approx(0.1)
+
+
+def test_out_of_range_samples_are_clamped():
+    histogram = LatencyHistogram()
+    histogram.record(-1.0)
+    histogram.record(3600.0)
+    assert histogram.counts[0] == 1
+    assert histogram.counts[bucket_index(MAX_MICROSECONDS)] == 1
+
+
+def test_dropped_frames_and_report(tmp_path, capsys):
+    class Frame:
+        def __init__(self, number):
+            self.number = number
+
+    tracer = FrameTracer()
+    # a looping recording starts over, that is not a drop
+    for number in (1, 2, 5, 6, 10, 1, 2):
+        tracer.frame(Frame(number))
+    assert (tracer.frames, tracer.dropped, tracer.gaps) == (7, 5, 2)
+
+    with tracer.stage('detect_markers', frame_number=2):
+        pass
+    path = tmp_path / 'trace.json'
+    tracer.report(str(path))
+    assert 'detect_markers' in capsys.readouterr().out
+    summary = json.loads(path.read_text())
+    assert summary['dropped'] == 5
+    assert summary['stages']['detect_markers']['count'] == 1
+    assert summary['stages']['detect_markers']['max_frame'] == 2
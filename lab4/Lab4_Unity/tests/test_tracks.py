@@ -0,0 +1,61 @@
+# LAB4
+
+'''
+TrackTable lifecycle: tentative -> confirmed -> coasting -> lost with per-marker TTLs.
+'''
+from Tracks import TENTATIVE, CONFIRMED, COASTING, LOST, TrackTable, describe
+
+POSITION = [0.0, 0.0, 1.0]
+
+
+def test_confirm_coast_and_lose():
+    tracks = TrackTable(confirm_hits=2, coast_ttl=2)
+    assert tracks.update(0, {5: POSITION}) == [(5, LOST, TENTATIVE)]
+    assert tracks.update(1, {5: POSITION}) == [(5, TENTATIVE, CONFIRMED)]
+    assert tracks.update(2, {5: POSITION}) == []
+    assert tracks.update(3, {}) == [(5, CONFIRMED, COASTING)]
+    # coasting keeps the last pose visible until the TTL runs out
+    assert tracks.update(4, {}) == []
+    assert tracks.visible()[0] == {5: POSITION}
+    assert tracks.update(5, {}) == [(5, COASTING, LOST)]
+    assert tracks.visible() == ({}, {})
+    assert 5 not in tracks.rows
+
+
+def test_coasting_track_is_confirmed_again():
+    tracks = TrackTable(confirm_hits=2, coast_ttl=3)
+    tracks.update(0, {5: POSITION})
+    tracks.update(1, {5: POSITION})
+    tracks.update(2, {})
+    assert tracks.update(3, {5: [0.1, 0.0, 1.0]}) == [(5, COASTING, CONFIRMED)]
+    assert tracks.visible()[0] == {5: [0.1, 0.0, 1.0]}
+
+
+def test_tentative_track_gets_no_grace_period():
+    tracks = TrackTable(confirm_hits=3, coast_ttl=10)
+    tracks.update(0, {5: POSITION})
+    assert tracks.update(1, {}) == [(5, TENTATIVE, LOST)]
+    # a lost marker starts over with no hits
+    assert tracks.update(2, {5: POSITION}) == [(5, LOST, TENTATIVE)]
+    assert tracks.visible() == ({}, {})
+
+
+def test_per_marker_ttl():
+    tracks = TrackTable(confirm_hits=1, coast_ttl=1, ttl={7: 3})
+    tracks.update(0, {5: POSITION, 7: POSITION})
+    assert tracks.update(1, {}) == [(5, CONFIRMED, COASTING), (7, CONFIRMED, COASTING)]
+    assert tracks.update(2, {}) == [(5, COASTING, LOST)]
+    assert tracks.update(3, {}) == []
+    assert tracks.update(4, {}) == [(7, COASTING, LOST)]
+
+
+def test_rotations_and_growing_past_capacity():
+    tracks = TrackTable(confirm_hits=1, capacity=2)
+    positions = {marker_id: [float(marker_id), 0.0, 1.0] for marker_id in range(5)}
+    transitions = tracks.update(0, positions, {3: [0.0, 0.0, 0.0, 1.0]})
+    assert sorted(transitions) == [(marker_id, LOST, CONFIRMED) for marker_id in range(5)]
+    assert tracks.visible() == (positions, {3: [0.0, 0.0, 0.0, 1.0]})
+
+
+def test_describe():
+    assert describe([(5, LOST, TENTATIVE), (6, CONFIRMED, COASTING)]) == "5: lost -> tentative, 6: confirmed -> coasting"
@@ -0,0 +1,68 @@
+# LAB4
+
+'''
+Binary tracking messages against the JSON messages they replace.
+'''
+import json
+import numpy as np
+import pytest
+
+from Deltas import FULL, DELTA
+from WireFormat import (HEADER, RECORD, HAS_ROTATION, MARKER, DISAPPEARED, anchor_dicts, decode_tracking,
+                        encode_tracking, is_binary, json_message)
+
+
+def random_anchors(count=5, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = np.arange(10, 10 + count)
+    original = rng.normal(size=(count, 3))
+    transformed = rng.normal(size=(count, 3))
+    rotations = rng.normal(size=(count, 4))
+    rotations /= np.linalg.norm(rotations, axis=1, keepdims=True)
+    return ids, original, transformed, rotations
+
+
+def test_json_binary_round_trip():
+    ids, original, transformed, rotations = random_anchors()
+    rotations[1] = np.nan       # an anchor without rotation
+    payload = encode_tracking(ids, original, transformed, rotations, sequence=42)
+    assert len(payload) == HEADER.size + len(ids) * RECORD.itemsize
+    mode, sequence, records = decode_tracking(payload)
+    assert (mode, sequence) == (FULL, 42)
+
+    # the JSON message, through json like on the wire, and the decoded records carry the same anchors
+    expected = json.loads(json.dumps(json_message(ids, original, transformed, rotations)))['transformedAnchors']
+    decoded = anchor_dicts(records)
+    assert [anchor['anchor_id'] for anchor in decoded] == [anchor['anchor_id'] for anchor in expected]
+    for anchor, reference in zip(decoded, expected):
+        assert anchor.keys() == reference.keys()
+        for key in ('original_position', 'transformed_position', 'rotation'):
+            if key in reference:
+                assert list(anchor[key]) == list(reference[key])
+                np.testing.assert_allclose(list(anchor[key].values()), list(reference[key].values()), atol=1e-6)
+    assert 'rotation' not in decoded[1]
+
+
+def test_flags_and_disappeared_records():
+    ids, original, transformed, _ = random_anchors(3)
+    flags = np.array([MARKER, 0, MARKER])
+    payload = encode_tracking(ids, original, transformed, flags=flags, sequence=7, mode=DELTA,
+                              disappeared=[99, 98], disappeared_flags=MARKER)
+    mode, sequence, records = decode_tracking(payload)
+    assert (mode, sequence) == (DELTA, 7)
+    assert records['anchor_id'].tolist() == [10, 11, 12, 99, 98]
+    assert records['flags'].tolist() == [MARKER, 0, MARKER, MARKER | DISAPPEARED, MARKER | DISAPPEARED]
+    assert not np.any(records['flags'] & HAS_ROTATION)
+
+
+def test_sequence_wraps_to_uint32():
+    ids, original, transformed, _ = random_anchors(1)
+    _, sequence, _ = decode_tracking(encode_tracking(ids, original, transformed, sequence=(1 << 32) + 5))
+    assert sequence == 5
+
+
+def test_json_payload_is_not_binary():
+    assert not is_binary(b'{"transformedAnchors": []}')
+    assert not is_binary(b'')
+    with pytest.raises(ValueError):
+        decode_tracking(b'{"transformedAnchors": []}')